@@ -2,7 +2,7 @@ from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin
 from django.utils.translation import gettext_lazy as _
 
-from .models import CustomUser, UserProfile, Location, Attendance, UserFaceImage
+from .models import CustomUser, UserProfile, Location, Attendance, UserFaceImage, FaceVerificationJob, FaceVerificationEvent
 
 class UserProfileInline(admin.StackedInline):
     model = UserProfile
@@ -51,8 +51,22 @@ class UserFaceImageAdmin(admin.ModelAdmin):
     search_fields = ('user__email',)
     ordering = ('user', 'angle_index')
 
+class FaceVerificationJobAdmin(admin.ModelAdmin):
+    list_display = ('user', 'status', 'created_at', 'completed_at')
+    list_filter = ('status', 'created_at')
+    search_fields = ('user__email',)
+    readonly_fields = ('id', 'result', 'created_at', 'completed_at')
+
+class FaceVerificationEventAdmin(admin.ModelAdmin):
+    list_display = ('user', 'source', 'matched', 'similarity', 'reference_angle', 'development_override', 'created_at')
+    list_filter = ('source', 'matched', 'development_override', 'created_at')
+    search_fields = ('user__email',)
+    readonly_fields = [field.name for field in FaceVerificationEvent._meta.fields]
+
 admin.site.register(CustomUser, CustomUserAdmin)
 admin.site.register(UserProfile, UserProfileAdmin)
 admin.site.register(Location, LocationAdmin)
 admin.site.register(Attendance, AttendanceAdmin)
 admin.site.register(UserFaceImage, UserFaceImageAdmin)
+admin.site.register(FaceVerificationJob, FaceVerificationJobAdmin)
+admin.site.register(FaceVerificationEvent, FaceVerificationEventAdmin)
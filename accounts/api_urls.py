@@ -7,8 +7,10 @@ from .api_views import (
     AttendanceListView, AttendanceDetailView,
     AttendanceCheckInView, AttendanceCheckOutView,
     UserAttendanceSummaryView, FaceImageUploadView,
-    FaceRecognitionAttendanceView, FaceCheckView, FaceHistoryView,
-    MultiFaceImageUploadView
+    FaceRecognitionAttendanceView, AsyncFaceRecognitionAttendanceView,
+    FaceVerificationJobView, FaceCheckView, FaceHistoryView,
+    FaceStatusView, FaceImageVariantView,
+    MultiFaceImageUploadView, MultiFaceImageBatchUploadView
 )
 
 urlpatterns = [
@@ -41,7 +43,13 @@ urlpatterns = [
     path('face/admin-upload/', FaceImageUploadView.as_view(), name='face-admin-upload'),
     path('face/multi-upload/', MultiFaceImageUploadView.as_view(), name='face-multi-upload'),
     path('face/admin-multi-upload/', MultiFaceImageUploadView.as_view(), name='face-admin-multi-upload'),
+    path('face/multi-upload/batch/', MultiFaceImageBatchUploadView.as_view(), name='face-multi-upload-batch'),
+    path('face/admin-multi-upload/batch/', MultiFaceImageBatchUploadView.as_view(), name='face-admin-multi-upload-batch'),
     path('face/check-in/', FaceRecognitionAttendanceView.as_view(), name='face-check-in'),
+    path('face/check-in/jobs/<uuid:job_id>/', FaceVerificationJobView.as_view(), name='face-verification-job'),
+    path('face/check-in/async/', AsyncFaceRecognitionAttendanceView.as_view(), name='face-check-in-async'),
     path('face/check/', FaceCheckView.as_view(), name='face-check'),
     path('face/history/', FaceHistoryView.as_view(), name='face-history'),
+    path('face/status/', FaceStatusView.as_view(), name='face-status'),
+    path('face/variants/<int:size>/<path:name>', FaceImageVariantView.as_view(), name='face-image-variant'),
 ]
\ No newline at end of file
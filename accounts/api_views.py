@@ -4,11 +4,28 @@ from rest_framework.views import APIView
 from rest_framework.authtoken.views import ObtainAuthToken
 from rest_framework.authtoken.models import Token
 from rest_framework.permissions import IsAuthenticated
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework.utils.encoders import JSONEncoder
+from asgiref.sync import sync_to_async
 from django.contrib.auth import get_user_model
 from django.shortcuts import get_object_or_404
+from django.urls import reverse
+from django.http import FileResponse, Http404, JsonResponse
+from django.utils.decorators import method_decorator
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
 from django.utils import timezone
 from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Max
+from django.utils.http import parse_etags, quote_etag
+import asyncio
+from functools import partial
+import hashlib
+import logging
+import mimetypes
 import os
+import posixpath
 
 from .serializers import (
     UserSerializer, UserRegistrationSerializer, 
@@ -16,12 +33,22 @@ from .serializers import (
     LocationSerializer, AttendanceSerializer,
     AttendanceCheckInSerializer, AttendanceCheckOutSerializer,
     FaceRecognitionSerializer, FaceImageUploadSerializer,
-    MultiFaceImageUploadSerializer, UserFaceImageSerializer
+    MultiFaceImageUploadSerializer, MultiFaceImageBatchUploadSerializer,
+    UserFaceImageSerializer
 )
-from .models import UserProfile, Location, Attendance, UserFaceImage
-from .face_recognition_utils import verify_face
+from .models import UserProfile, Location, Attendance, UserFaceImage, FaceVerificationJob
+from .face_enrollment import extract_enrollment_template, extract_enrollment_templates
+from .face_media import FACE_MEDIA_DIR
+from .face_variants import generate_variants, get_or_create_variant, get_variant_sizes, variant_urls
+from .face_checkin import (
+    CheckInError, find_location_in_range, get_verification_executor, select_probe_frames, verify_probe_frames,
+)
+from .face_templates import current_profile_template
+from .face_jobs import PENDING_FACE_CHECKIN, VerificationQueueFull, get_job_status, submit_verification_job
+from .authentication import CachedTokenAuthentication, invalidate_token
 
 User = get_user_model()
+logger = logging.getLogger(__name__)
 
 class RegisterView(generics.CreateAPIView):
     """API view for user registration"""
@@ -71,8 +98,10 @@ class LogoutView(APIView):
     permission_classes = [IsAuthenticated]
     
     def post(self, request):
-        # Delete the user's token to logout
-        request.user.auth_token.delete()
+        # Delete the user's token to logout and drop it from the auth cache
+        token = request.user.auth_token
+        invalidate_token(token.key)
+        token.delete()
         return Response({'message': 'Successfully logged out'}, status=status.HTTP_200_OK)
 
 class UserProfileView(generics.RetrieveUpdateAPIView):
@@ -85,7 +114,7 @@ class UserProfileView(generics.RetrieveUpdateAPIView):
     
     def retrieve(self, request, *args, **kwargs):
         instance = self.get_object()
-        serializer = UserSerializer(instance)
+        serializer = UserSerializer(instance, context=self.get_serializer_context())
         return Response(serializer.data)
 
 class ChangePasswordView(generics.UpdateAPIView):
@@ -106,7 +135,8 @@ class ChangePasswordView(generics.UpdateAPIView):
             user.set_password(serializer.validated_data['new_password'])
             user.save()
             
-            # Update token
+            # Update token, making sure the old one is no longer served from the auth cache
+            invalidate_token(user.auth_token.key)
             user.auth_token.delete()
             token = Token.objects.create(user=user)
             
@@ -116,7 +146,7 @@ class ChangePasswordView(generics.UpdateAPIView):
             }, status=status.HTTP_200_OK)
         
         # Log validation errors for debugging
-        print("FaceImageUploadView - Validation errors:", serializer.errors)
+        logger.debug("ChangePasswordView - Validation errors: %s", serializer.errors)
         
         # Return a more detailed error response
         error_response = {
@@ -207,11 +237,13 @@ class AttendanceListView(generics.ListAPIView):
     
     def get_queryset(self):
         user = self.request.user
+        # Face check-ins still waiting for deferred verification are not listed
+        attendances = Attendance.objects.exclude(PENDING_FACE_CHECKIN)
         if user.is_staff:
             # Admins can see all attendance records
-            return Attendance.objects.all()
+            return attendances
         # Regular users can only see their own attendance records
-        return Attendance.objects.filter(user=user)
+        return attendances.filter(user=user)
 
 class AttendanceDetailView(generics.RetrieveUpdateAPIView):
     """API view for retrieving and updating attendance details"""
@@ -240,9 +272,9 @@ class AttendanceDetailView(generics.RetrieveUpdateAPIView):
         serializer.is_valid(raise_exception=True)
         self.perform_update(serializer)
         
-        # Log the update
-        print(f"Attendance record {instance.id} updated by admin {request.user.email}")
-        print(f"New data: {request.data}")
+        # Log the update (field names only, never the submitted values)
+        logger.info("Attendance record %s updated by admin %s (fields: %s)",
+                    instance.id, request.user.email, sorted(request.data.keys()))
         
         return Response(serializer.data)
 
@@ -304,7 +336,10 @@ class AttendanceCheckOutView(APIView):
             
             # Get the attendance record
             try:
-                attendance = Attendance.objects.get(id=attendance_id, user=request.user, check_out_time=None)
+                # A face check-in cannot be checked out before its verification completes
+                attendance = Attendance.objects.exclude(PENDING_FACE_CHECKIN).get(
+                    id=attendance_id, user=request.user, check_out_time=None
+                )
             except Attendance.DoesNotExist:
                 return Response({
                     'error': 'No active check-in found with this ID'
@@ -334,7 +369,7 @@ class UserAttendanceSummaryView(APIView):
         current_month = timezone.now().month
         current_year = timezone.now().year
         
-        attendances = Attendance.objects.filter(
+        attendances = Attendance.objects.exclude(PENDING_FACE_CHECKIN).filter(
             user=user,
             check_in_time__month=current_month,
             check_in_time__year=current_year
@@ -361,20 +396,15 @@ class FaceImageUploadView(APIView):
     permission_classes = [IsAuthenticated]
     
     def post(self, request):
-        # Log the request data for debugging
-        print("FaceImageUploadView - Request data:", request.data)
-        print("FaceImageUploadView - Request FILES:", request.FILES)
-        print("FaceImageUploadView - Content-Type:", request.META.get('CONTENT_TYPE', 'Not provided'))
+        # Log the shape of the request for debugging (never the file contents)
+        logger.debug("FaceImageUploadView - data keys: %s, files: %s, content type: %s",
+                     list(request.data.keys()), list(request.FILES.keys()),
+                     request.META.get('CONTENT_TYPE', 'Not provided'))
         
         # Check if there's a file in the request
         if not request.FILES:
-            print("FaceImageUploadView - No files found in request")
-            
-            # Try to get raw data if available
-            if hasattr(request, '_body'):
-                print("FaceImageUploadView - Raw request body length:", len(request._body))
-                if len(request._body) < 1000:  # Only print if not too large
-                    print("FaceImageUploadView - Raw request body:", request._body)
+            logger.debug("FaceImageUploadView - No files found in request (body length: %s)",
+                         request.META.get('CONTENT_LENGTH', 'unknown'))
         
         serializer = FaceImageUploadSerializer(data=request.data)
         
@@ -395,9 +425,22 @@ class FaceImageUploadView(APIView):
                 # User is uploading their own image
                 profile = request.user.profile
             
-            # Save face image
-            profile.face_image = serializer.validated_data['face_image']
+            # Extract the template at upload time, so check-ins compare
+            # against it instead of encoding the profile image every time
+            face_image = serializer.validated_data['face_image']
+            result = extract_enrollment_template(face_image)
+            if not result['accepted']:
+                return Response({
+                    'error': result['reason'],
+                    'metrics': result['metrics']
+                }, status=status.HTTP_400_BAD_REQUEST)
+            
+            # Save face image and its template
+            profile.face_image = face_image
+            profile.face_template = result['template']
+            profile.face_template_version = result['template_version']
             profile.save()
+            generate_variants(profile.face_image.name)
             
             # Ensure the directory exists with proper permissions
             email = profile.user.email
@@ -407,12 +450,27 @@ class FaceImageUploadView(APIView):
             
             return Response({
                 'message': 'Face image uploaded successfully',
-                'face_image_url': request.build_absolute_uri(profile.face_image.url) if profile.face_image else None
+                'face_image_url': request.build_absolute_uri(profile.face_image.url) if profile.face_image else None,
+                'face_image_variants': variant_urls(request, profile.face_image.name)
             }, status=status.HTTP_200_OK)
         
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
+def face_image_entries(request, face_images):
+    """Build the URL/angle/timestamp payload for a list of UserFaceImage rows"""
+    return [
+        {
+            'url': request.build_absolute_uri(img.image.url),
+            'angle_index': img.angle_index,
+            'created_at': img.created_at.isoformat(),
+            'updated_at': img.updated_at.isoformat(),
+            'variants': variant_urls(request, img.image.name)
+        }
+        for img in face_images
+    ]
+
+
 class MultiFaceImageUploadView(APIView):
     """API view for uploading multiple face images with different angles"""
     permission_classes = [IsAuthenticated]
@@ -439,37 +497,36 @@ class MultiFaceImageUploadView(APIView):
                 # User is uploading their own image
                 user = request.user
             
-            # Check if an image with this angle_index already exists for this user
-            try:
-                existing_image = UserFaceImage.objects.get(user=user, angle_index=angle_index)
-                # Update the existing image
-                existing_image.image = face_image
-                existing_image.save()
-                message = 'Face image updated successfully'
-            except UserFaceImage.DoesNotExist:
-                # Create a new image entry
-                user_face_image = UserFaceImage.objects.create(
-                    user=user,
-                    image=face_image,
-                    angle_index=angle_index
-                )
-                message = 'Face image uploaded successfully'
+            # Extract the template of the new image, so a replaced angle never
+            # keeps the template of the previous photo
+            result = extract_enrollment_template(face_image)
+            if not result['accepted']:
+                return Response({
+                    'error': result['reason'],
+                    'angle_index': angle_index,
+                    'metrics': result['metrics']
+                }, status=status.HTTP_400_BAD_REQUEST)
             
-            # Get all face images for this user
-            face_images = UserFaceImage.objects.filter(user=user)
-            face_image_urls = []
-            for img in face_images:
-                face_image_urls.append({
-                    'url': request.build_absolute_uri(img.image.url),
-                    'angle_index': img.angle_index,
-                    'created_at': img.created_at.isoformat(),
-                    'updated_at': img.updated_at.isoformat()
-                })
+            # Insert or replace the image and template for this angle
+            user_face_image, created = UserFaceImage.objects.update_or_create(
+                user=user,
+                angle_index=angle_index,
+                defaults={
+                    'image': face_image,
+                    'template': result['template'],
+                    'template_version': result['template_version'],
+                }
+            )
+            generate_variants(user_face_image.image.name)
+            message = 'Face image uploaded successfully' if created else 'Face image updated successfully'
+            
+            # Get all face images for this user in a single query
+            face_images = list(UserFaceImage.objects.filter(user=user))
             
             return Response({
                 'message': message,
-                'face_image_count': face_images.count(),
-                'face_image_urls': face_image_urls
+                'face_image_count': len(face_images),
+                'face_image_urls': face_image_entries(request, face_images)
             }, status=status.HTTP_200_OK)
         
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
@@ -490,15 +547,89 @@ class MultiFaceImageUploadView(APIView):
             # User is requesting their own images
             user = request.user
         
-        # Get all face images for this user
-        face_images = UserFaceImage.objects.filter(user=user)
+        # Get all face images for this user in a single query
+        face_images = list(UserFaceImage.objects.filter(user=user))
         serializer = UserFaceImageSerializer(face_images, many=True, context={'request': request})
         
         return Response({
-            'face_image_count': face_images.count(),
+            'face_image_count': len(face_images),
             'face_images': serializer.data
         }, status=status.HTTP_200_OK)
 
+
+class MultiFaceImageBatchUploadView(APIView):
+    """API view for uploading several face angles in one multipart request"""
+    permission_classes = [IsAuthenticated]
+    
+    def post(self, request):
+        serializer = MultiFaceImageBatchUploadSerializer(data=request.data)
+        
+        if serializer.is_valid():
+            face_images_by_angle = serializer.validated_data['face_images']
+            user_id = request.data.get('user_id')
+            
+            # Check if this is an admin upload for another user
+            if user_id and (request.user.is_staff or request.user.is_supervisor):
+                try:
+                    user = User.objects.get(id=user_id)
+                except User.DoesNotExist:
+                    return Response({
+                        'error': 'User not found'
+                    }, status=status.HTTP_404_NOT_FOUND)
+            else:
+                user = request.user
+            
+            # Detect faces and extract templates for all angles in parallel
+            extraction_results = extract_enrollment_templates(face_images_by_angle)
+            rejected_angles = [
+                {'angle_index': angle_index, 'reason': result['reason'], 'metrics': result['metrics']}
+                for angle_index, result in sorted(extraction_results.items())
+                if not result['accepted']
+            ]
+            
+            if len(rejected_angles) == len(face_images_by_angle):
+                return Response({
+                    'error': 'None of the uploaded images contain a usable face.',
+                    'rejected_angles': rejected_angles
+                }, status=status.HTTP_400_BAD_REQUEST)
+            
+            # Write every accepted angle (image and template) or none of them
+            created_angles = []
+            updated_angles = []
+            saved_names = []
+            with transaction.atomic():
+                for angle_index, face_image in sorted(face_images_by_angle.items()):
+                    result = extraction_results[angle_index]
+                    if not result['accepted']:
+                        continue
+                    user_face_image, created = UserFaceImage.objects.update_or_create(
+                        user=user,
+                        angle_index=angle_index,
+                        defaults={
+                            'image': face_image,
+                            'template': result['template'],
+                            'template_version': result['template_version'],
+                        }
+                    )
+                    (created_angles if created else updated_angles).append(angle_index)
+                    saved_names.append(user_face_image.image.name)
+            
+            for name in saved_names:
+                generate_variants(name)
+            
+            face_images = list(UserFaceImage.objects.filter(user=user))
+            
+            return Response({
+                'message': f'{len(created_angles) + len(updated_angles)} face image(s) saved successfully',
+                'created_angles': created_angles,
+                'updated_angles': updated_angles,
+                'rejected_angles': rejected_angles,
+                'face_image_count': len(face_images),
+                'face_image_urls': face_image_entries(request, face_images)
+            }, status=status.HTTP_200_OK)
+        
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
 class FaceCheckView(APIView):
     """API view for checking if a user has a reference face image"""
     permission_classes = [IsAuthenticated]
@@ -525,7 +656,8 @@ class FaceCheckView(APIView):
                     'url': request.build_absolute_uri(img.image.url),
                     'angle_index': img.angle_index,
                     'created_at': img.created_at.isoformat(),
-                    'updated_at': img.updated_at.isoformat()
+                    'updated_at': img.updated_at.isoformat(),
+                    'variants': variant_urls(request, img.image.name)
                 })
         
         return Response({
@@ -533,6 +665,7 @@ class FaceCheckView(APIView):
             'has_multiple_images': has_multiple_images,
             'face_image_count': face_image_count,
             'face_image_url': request.build_absolute_uri(profile.face_image.url) if has_face_image else None,
+            'face_image_variants': variant_urls(request, profile.face_image.name) if has_face_image else {},
             'face_image_urls': face_image_urls
         }, status=status.HTTP_200_OK)
 
@@ -572,6 +705,86 @@ class FaceHistoryView(APIView):
         }, status=status.HTTP_200_OK)
 
 
+class FaceImageVariantView(APIView):
+    """
+    API view serving fixed-size thumbnails of face images.
+    
+    Variants are generated on upload or on first access and cached under
+    MEDIA_ROOT/face_variants. Stored face image names never change content,
+    so responses can be cached by clients indefinitely.
+    """
+    permission_classes = [IsAuthenticated]
+    
+    def get(self, request, size, name):
+        name = posixpath.normpath(name)
+        if not name.startswith(f'{FACE_MEDIA_DIR}/') or size not in get_variant_sizes():
+            raise Http404
+        
+        # Regular users may only fetch thumbnails of their own face images
+        if not (request.user.is_staff or request.user.is_supervisor):
+            safe_email = request.user.email.replace('@', '_at_').replace('.', '_dot_')
+            if not name.startswith(f'{FACE_MEDIA_DIR}/{safe_email}/'):
+                return Response({'message': 'Permission denied'}, status=status.HTTP_403_FORBIDDEN)
+        
+        variant_path = get_or_create_variant(name, size)
+        if variant_path is None:
+            raise Http404
+        
+        response = FileResponse(open(variant_path, 'rb'), content_type=mimetypes.guess_type(variant_path)[0])
+        response['Cache-Control'] = 'private, max-age=31536000, immutable'
+        return response
+
+
+class FaceStatusView(APIView):
+    """
+    API view reporting a user's face enrollment status in one round trip.
+
+    Combines the payloads of FaceCheckView and FaceHistoryView, fetching the
+    user's face images with a single query. Responses carry an ETag so that
+    clients sending If-None-Match get a 304 while the enrollment is unchanged.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        user = request.user
+        profile = user.profile
+        user_images = UserFaceImage.objects.filter(user=user)
+
+        # Fingerprint the enrollment with one aggregate query, so a 304 never
+        # loads the face image rows. Any upload, replacement or deletion
+        # changes the row count or the newest updated_at.
+        summary = user_images.aggregate(count=Count('pk'), latest=Max('updated_at'), max_pk=Max('pk'))
+        fingerprint = hashlib.md5(
+            f"{profile.face_image.name if profile.face_image else ''}|{summary['count']}:{summary['max_pk']}:"
+            f"{summary['latest'].isoformat() if summary['latest'] else ''}".encode()
+        )
+        etag = quote_etag(fingerprint.hexdigest())
+
+        headers = {'ETag': etag, 'Cache-Control': 'private, no-cache'}
+        if_none_match = request.headers.get('If-None-Match')
+        if if_none_match:
+            client_etags = parse_etags(if_none_match)
+            if '*' in client_etags or etag in client_etags:
+                return Response(status=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+        face_images = list(user_images)
+        has_face_image = bool(profile.face_image)
+        has_multiple_images = len(face_images) > 0
+        latest_upload = max((img.updated_at for img in face_images), default=None)
+
+        return Response({
+            'has_uploads': has_face_image or has_multiple_images,
+            'has_face_image': has_face_image,
+            'has_multiple_images': has_multiple_images,
+            'face_image_count': len(face_images),
+            'face_image_url': request.build_absolute_uri(profile.face_image.url) if has_face_image else None,
+            'face_image_variants': variant_urls(request, profile.face_image.name) if has_face_image else {},
+            'face_image_urls': face_image_entries(request, face_images),
+            'last_upload': profile.face_image.name if has_face_image else None,
+            'latest_upload_date': latest_upload.isoformat() if latest_upload else None
+        }, status=status.HTTP_200_OK, headers=headers)
+
+
 class FaceRecognitionAttendanceView(APIView):
     """API view for checking in attendance with face recognition and location verification"""
     permission_classes = [IsAuthenticated]
@@ -584,10 +797,9 @@ class FaceRecognitionAttendanceView(APIView):
             profile = user.profile
             
             # Check if user has a reference face image (either single or multiple)
-            has_single_image = bool(profile.face_image)
-            has_multiple_images = UserFaceImage.objects.filter(user=user).exists()
+            reference_images = list(UserFaceImage.objects.filter(user=user))
             
-            if not has_single_image and not has_multiple_images:
+            if not profile.face_image and not reference_images:
                 return Response({
                     'error': 'No reference face images found. Please upload at least one face image first.'
                 }, status=status.HTTP_400_BAD_REQUEST)
@@ -597,120 +809,53 @@ class FaceRecognitionAttendanceView(APIView):
             longitude = serializer.validated_data['longitude']
             
             # Get all active locations
-            locations = Location.objects.filter(is_active=True)
+            locations = list(Location.objects.filter(is_active=True))
             
-            if not locations.exists():
+            if not locations:
                 return Response({
                     'error': 'No authorized locations found for attendance.'
                 }, status=status.HTTP_400_BAD_REQUEST)
             
             # Check if user is within range of any location
-            location_verified = False
-            location_id = None
-            
-            for location in locations:
-                distance = AttendanceCheckInSerializer().calculate_distance(
-                    latitude, longitude,
-                    location.latitude, location.longitude
-                )
-                if distance <= location.radius:
-                    location_verified = True
-                    location_id = location.id
-                    break
+            location = find_location_in_range(latitude, longitude, locations)
             
-            if not location_verified:
+            if location is None:
                 return Response({
                     'error': 'You are not within range of any authorized location.'
                 }, status=status.HTTP_400_BAD_REQUEST)
             
-            # Verify face
-            face_image = serializer.validated_data['face_image']
+            profile_face_image_name = profile.face_image.name if profile.face_image else None
+            profile_template = current_profile_template(profile) if profile_face_image_name else None
             
-            # Initialize variables for verification
-            verification_result = None
-            best_match_score = 0
-            best_verification_result = None
-            
-            # Check multiple face images first if available
-            if has_multiple_images:
-                multi_face_images = UserFaceImage.objects.filter(user=user)
-                
-                # Try to match against each reference image
-                for ref_image in multi_face_images:
-                    # Get the full path to the reference image
-                    reference_image_path = os.path.join(settings.MEDIA_ROOT, ref_image.image.name)
-                    
-                    # Ensure the reference image path exists
-                    if not os.path.exists(reference_image_path):
-                        continue  # Skip this reference image if it doesn't exist
-                    
-                    # Verify against this reference image
-                    current_result = verify_face(reference_image_path, face_image)
-                    
-                    # Keep track of the best match
-                    current_score = current_result.get('similarity', 0)
-                    if current_result['match'] or (current_score > best_match_score):
-                        best_match_score = current_score
-                        best_verification_result = current_result
-                        
-                        # If we found a match, we can stop checking
-                        if current_result['match']:
-                            break
-                
-                # Use the best result from multiple images
-                if best_verification_result:
-                    verification_result = best_verification_result
-            
-            # If no match found with multiple images or no multiple images available, try the single image
-            if (not verification_result or not verification_result['match']) and has_single_image:
-                # Get the full path to the reference image
-                reference_image_path = os.path.join(settings.MEDIA_ROOT, profile.face_image.name)
-                
-                # Ensure the reference image path exists
-                if not os.path.exists(reference_image_path):
-                    return Response({
-                        'error': f'Reference face image not found at path: {reference_image_path}'
-                    }, status=status.HTTP_400_BAD_REQUEST)
-                
-                single_image_result = verify_face(reference_image_path, face_image)
-                
-                # Use the single image result if it's better than the multiple image result
-                if not verification_result or single_image_result.get('similarity', 0) > best_match_score:
-                    verification_result = single_image_result
-            
-            # If we still don't have a verification result, return an error
-            if not verification_result:
-                return Response({
-                    'error': 'Failed to verify face against any reference images.'
-                }, status=status.HTTP_400_BAD_REQUEST)
+            # Quality-check every frame and keep the best ones, turning away
+            # unusable captures before queuing or running the full pipeline
+            try:
+                face_images = select_probe_frames(serializer.validated_data['face_images'])
+            except CheckInError as e:
+                return Response(e.payload, status=status.HTTP_400_BAD_REQUEST)
             
-            # DEVELOPMENT MODE: Allow lower confidence scores for testing
-            DEVELOPMENT_MODE = True  # Set to False in production
-            
-            if not verification_result['match']:
-                # In development mode, check if score is above minimum threshold
-                if DEVELOPMENT_MODE and verification_result.get('similarity', 0) * 100 >= 25.0:
-                    # For development, we'll force match if similarity is at least 25%
-                    import logging
-                    logger = logging.getLogger(__name__)
-                    logger.warning(f"DEVELOPMENT MODE: Forcing face match despite low score: {verification_result.get('similarity', 0) * 100:.2f}%")
-                    
-                    # Override the verification result
-                    verification_result['match'] = True
-                    verification_result['confidence'] = max(verification_result.get('confidence', 0), 60.0)  # Minimum 60% confidence
-                    verification_result['development_override'] = True
-                    verification_result['original_match'] = False
-                else:
-                    # Not in development mode or score too low even for development
-                    return Response({
-                        'error': 'Face verification failed. Please try again.',
-                        'details': verification_result
-                    }, status=status.HTTP_400_BAD_REQUEST)
+            if serializer.validated_data.get('deferred'):
+                return self.defer_verification(
+                    user, location, serializer.validated_data, face_images, reference_images, profile_face_image_name,
+                    profile_template
+                )
+            
+            # Verify face
+            try:
+                verification_result = verify_probe_frames(
+                    face_images,
+                    reference_images,
+                    profile_face_image_name,
+                    user=user,
+                    profile_template=profile_template
+                )
+            except CheckInError as e:
+                return Response(e.payload, status=status.HTTP_400_BAD_REQUEST)
             
             # Create attendance record
             attendance = Attendance.objects.create(
                 user=user,
-                location_id=location_id,
+                location=location,
                 check_in_latitude=latitude,
                 check_in_longitude=longitude,
                 is_verified=True,
@@ -723,4 +868,164 @@ class FaceRecognitionAttendanceView(APIView):
                 'face_verification': verification_result
             }, status=status.HTTP_201_CREATED)
         
-        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
\ No newline at end of file
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+    
+    def defer_verification(self, user, location, validated_data, face_images, reference_images, profile_face_image_name,
+                           profile_template=None):
+        """Record a pending check-in and queue its face verification"""
+        with transaction.atomic():
+            attendance = Attendance.objects.create(
+                user=user,
+                location=location,
+                check_in_latitude=validated_data['latitude'],
+                check_in_longitude=validated_data['longitude'],
+                is_verified=False,
+                verification_method="FACE_GPS"
+            )
+            job = FaceVerificationJob.objects.create(user=user, attendance=attendance)
+        
+        try:
+            submit_verification_job(job, face_images, reference_images, profile_face_image_name, profile_template)
+        except VerificationQueueFull:
+            attendance.delete()
+            job.delete()
+            return Response({
+                'error': 'Face verification is busy. Please try again shortly.'
+            }, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+        
+        return Response({
+            'message': 'Check-in received, face verification pending',
+            'job_id': str(job.pk),
+            'status': job.status,
+            'status_url': self.request.build_absolute_uri(reverse('face-verification-job', args=[job.pk])),
+            'attendance': AttendanceSerializer(attendance).data
+        }, status=status.HTTP_202_ACCEPTED)
+
+
+class FaceVerificationJobView(APIView):
+    """
+    API view for polling the outcome of a deferred face check-in
+    
+    Pass ?wait=<seconds> to long-poll until the job finishes (capped by
+    FACE_VERIFICATION_MAX_WAIT).
+    """
+    permission_classes = [IsAuthenticated]
+    
+    def get(self, request, job_id):
+        try:
+            wait = float(request.query_params.get('wait', 0))
+        except ValueError:
+            return Response({'error': 'wait must be a number of seconds'}, status=status.HTTP_400_BAD_REQUEST)
+        
+        jobs = FaceVerificationJob.objects.all()
+        if not (request.user.is_staff or request.user.is_supervisor):
+            jobs = jobs.filter(user=request.user)
+        
+        try:
+            job = get_job_status(job_id, wait=wait, queryset=jobs)
+        except FaceVerificationJob.DoesNotExist:
+            raise Http404
+        
+        return Response({
+            'job_id': str(job.pk),
+            'status': job.status,
+            'finished': job.is_finished,
+            'face_verification': job.result,
+            'attendance': AttendanceSerializer(job.attendance).data if job.attendance else None,
+            'created_at': job.created_at,
+            'completed_at': job.completed_at
+        })
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class AsyncFaceRecognitionAttendanceView(View):
+    """
+    Async variant of FaceRecognitionAttendanceView for ASGI deployments
+    
+    The request body has already been received by the ASGI handler, ORM
+    access goes through the async query API and decoding plus face
+    verification run on the shared verification executor, so the event
+    loop keeps serving other check-ins while inference is in progress.
+    Only token authentication is supported.
+    """
+    authentication_class = CachedTokenAuthentication
+    
+    async def post(self, request):
+        try:
+            auth = await sync_to_async(self.authentication_class().authenticate)(request)
+        except AuthenticationFailed as e:
+            return JsonResponse({'detail': str(e.detail)}, status=status.HTTP_401_UNAUTHORIZED)
+        if auth is None:
+            return JsonResponse({
+                'detail': 'Authentication credentials were not provided.'
+            }, status=status.HTTP_401_UNAUTHORIZED)
+        user = auth[0]
+        
+        loop = asyncio.get_running_loop()
+        executor = get_verification_executor()
+        
+        # Decoding the upload is CPU work as well, so validate off the loop
+        # Keep repeated fields, a burst arrives as several face_images files
+        data = request.POST.copy()
+        data.update(request.FILES)
+        serializer = FaceRecognitionSerializer(data=data)
+        if not await loop.run_in_executor(executor, serializer.is_valid):
+            return JsonResponse(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        
+        profile = await UserProfile.objects.filter(user=user).afirst()
+        profile_face_image_name = profile.face_image.name if profile and profile.face_image else None
+        profile_template = current_profile_template(profile) if profile_face_image_name else None
+        reference_images = [ref async for ref in UserFaceImage.objects.filter(user=user)]
+        
+        if not profile_face_image_name and not reference_images:
+            return JsonResponse({
+                'error': 'No reference face images found. Please upload at least one face image first.'
+            }, status=status.HTTP_400_BAD_REQUEST)
+        
+        latitude = serializer.validated_data['latitude']
+        longitude = serializer.validated_data['longitude']
+        
+        locations = [location async for location in Location.objects.filter(is_active=True)]
+        
+        if not locations:
+            return JsonResponse({
+                'error': 'No authorized locations found for attendance.'
+            }, status=status.HTTP_400_BAD_REQUEST)
+        
+        location = find_location_in_range(latitude, longitude, locations)
+        
+        if location is None:
+            return JsonResponse({
+                'error': 'You are not within range of any authorized location.'
+            }, status=status.HTTP_400_BAD_REQUEST)
+        
+        try:
+            face_images = await loop.run_in_executor(
+                executor, select_probe_frames, serializer.validated_data['face_images']
+            )
+            verification_result = await loop.run_in_executor(
+                executor,
+                partial(verify_probe_frames, user=user, source='async', profile_template=profile_template),
+                face_images,
+                reference_images,
+                profile_face_image_name
+            )
+        except CheckInError as e:
+            return JsonResponse(e.payload, encoder=JSONEncoder, status=status.HTTP_400_BAD_REQUEST)
+        
+        # user and location are passed as instances so serializing the
+        # record below needs no further queries
+        attendance = await Attendance.objects.acreate(
+            user=user,
+            location=location,
+            check_in_latitude=latitude,
+            check_in_longitude=longitude,
+            is_verified=True,
+            verification_method="FACE_GPS"
+        )
+        
+        return JsonResponse({
+            'message': 'Check-in successful with face verification',
+            'attendance': AttendanceSerializer(attendance).data,
+            'face_verification': verification_result
+        }, encoder=JSONEncoder, status=status.HTTP_201_CREATED)
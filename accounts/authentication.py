@@ -0,0 +1,141 @@
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.db import router
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+
+from .caching import TTLCache
+
+DEFAULT_TOKEN_AUTH_CACHE = {
+    'MAX_ENTRIES': 1024,
+    'TTL': 300,  # seconds, shared cache
+    # Seconds an entry is trusted from the in-process LRU. Invalidation only
+    # reaches the current process and the shared cache, so this bounds how
+    # long other workers keep accepting a revoked token.
+    'LOCAL_TTL': 5,
+    # Opt in once CACHES points at a backend shared by every worker (Redis, Memcached)
+    'USE_DJANGO_CACHE': False,
+    'CACHE_ALIAS': 'default',
+    'KEY_PREFIX': 'token-auth:',
+}
+
+# User fields left out of cached snapshots: the password hash and personal
+# data that authentication and permission checks never read. A restored user
+# loads them from the database (as deferred fields) only if accessed.
+SNAPSHOT_EXCLUDED_FIELDS = ('password', 'phone_number', 'date_of_birth')
+
+
+def get_token_cache_settings():
+    """Return TOKEN_AUTH_CACHE from settings merged over the defaults"""
+    config = dict(DEFAULT_TOKEN_AUTH_CACHE)
+    config.update(getattr(settings, 'TOKEN_AUTH_CACHE', {}))
+    return config
+
+
+_config = get_token_cache_settings()
+_local_cache = TTLCache(max_entries=_config['MAX_ENTRIES'], ttl=_config['LOCAL_TTL'])
+
+
+def _shared_cache():
+    """Return the Django cache backing the local LRU, or None if disabled"""
+    config = get_token_cache_settings()
+    if not config['USE_DJANGO_CACHE']:
+        return None
+    return caches[config['CACHE_ALIAS']]
+
+
+def _shared_key(key):
+    return f"{get_token_cache_settings()['KEY_PREFIX']}{key}"
+
+
+def _snapshot_user(user):
+    """
+    Take a plain-data snapshot of a user row.
+
+    Only concrete field values are kept, so every cache hit rebuilds a fresh
+    instance and requests never share (or mutate) the same model object.
+    SNAPSHOT_EXCLUDED_FIELDS are not kept at all.
+    """
+    field_names = tuple(f.attname for f in user._meta.concrete_fields
+                        if f.attname not in SNAPSHOT_EXCLUDED_FIELDS)
+    values = tuple(getattr(user, name) for name in field_names)
+    return (user._state.db, field_names, values)
+
+
+def _restore_user(snapshot):
+    """Rebuild a user instance from a snapshot created by _snapshot_user"""
+    db, field_names, values = snapshot
+    return get_user_model().from_db(db, field_names, values)
+
+
+def invalidate_token(key):
+    """Drop a single token from the local and shared caches"""
+    if not key:
+        return
+    _local_cache.delete(key)
+    shared = _shared_cache()
+    if shared is not None:
+        shared.delete(_shared_key(key))
+
+
+def invalidate_user_tokens(user):
+    """Drop every cached token that belongs to user"""
+    if user is None or user.pk is None:
+        return
+    keys = Token.objects.filter(user_id=user.pk).values_list('key', flat=True)
+    for key in keys:
+        invalidate_token(key)
+
+
+def clear_token_cache():
+    """Empty the in-process token cache (the shared cache expires on its own)"""
+    _local_cache.clear()
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """
+    Token authentication that caches the token -> user lookup.
+
+    Successful lookups are kept in a short-lived (LOCAL_TTL) in-process LRU
+    and, with USE_DJANGO_CACHE, in Django's cache framework behind it, shared
+    by all worker processes. Entries are invalidated on logout, password
+    change and whenever the user row is saved (e.g. deactivation); see
+    accounts/signals.py. The invalidation removes the shared entry at once,
+    while other processes may keep using their local copy for at most
+    LOCAL_TTL seconds.
+    """
+
+    def authenticate_credentials(self, key):
+        snapshot = _local_cache.get(key)
+
+        if snapshot is None:
+            shared = _shared_cache()
+            if shared is not None:
+                snapshot = shared.get(_shared_key(key))
+                if snapshot is not None:
+                    _local_cache.set(key, snapshot)
+
+        if snapshot is not None:
+            user = _restore_user(snapshot)
+            if user.is_active:
+                return (user, self._build_token(key, user))
+            # Should have been invalidated already, fall back to the database
+            invalidate_token(key)
+
+        user, token = super().authenticate_credentials(key)
+
+        snapshot = _snapshot_user(user)
+        _local_cache.set(key, snapshot)
+        shared = _shared_cache()
+        if shared is not None:
+            shared.set(_shared_key(key), snapshot, get_token_cache_settings()['TTL'])
+
+        return (user, token)
+
+    def _build_token(self, key, user):
+        """Build a Token instance for request.auth without querying the database"""
+        token = Token(key=key, user=user)
+        token._state.adding = False
+        token._state.db = router.db_for_read(Token)
+        return token
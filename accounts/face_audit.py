@@ -0,0 +1,131 @@
+import atexit
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.db import close_old_connections
+
+from .models import FaceVerificationEvent
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_AUDIT_BATCH_SIZE = 50
+# Seconds between flushes of a partially filled buffer
+DEFAULT_AUDIT_FLUSH_INTERVAL = 5.0
+# Events kept while the database is unavailable; older ones are dropped
+DEFAULT_AUDIT_MAX_PENDING = 5000
+
+
+class AuditBuffer:
+    """
+    In-process buffer of FaceVerificationEvent rows written with bulk_create
+
+    Requests only append to a list; a background thread writes the rows once
+    batch_size events are waiting or flush_interval seconds have passed, so
+    auditing never adds a database round trip to a check-in.
+    """
+
+    def __init__(self, batch_size, flush_interval, max_pending):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self._events = []
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+
+    def add(self, event):
+        with self._lock:
+            self._events.append(event)
+            dropped = len(self._events) - self.max_pending
+            if dropped > 0:
+                del self._events[:dropped]
+            pending = len(self._events)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='face-audit-flush', daemon=True)
+                self._thread.start()
+        if dropped > 0:
+            logger.warning("Face audit buffer full, dropped %d events", dropped)
+        if pending >= self.batch_size:
+            self._wake.set()
+
+    def _run(self):
+        while True:
+            self._wake.wait(timeout=self.flush_interval)
+            self._wake.clear()
+            close_old_connections()
+            try:
+                self.flush()
+            finally:
+                close_old_connections()
+
+    def flush(self):
+        """Write every buffered event; on failure they are put back for the next attempt"""
+        with self._lock:
+            events, self._events = self._events, []
+        if not events:
+            return 0
+
+        started = time.monotonic()
+        try:
+            for start in range(0, len(events), self.batch_size):
+                FaceVerificationEvent.objects.bulk_create(events[start:start + self.batch_size])
+        except Exception as e:
+            logger.error("Could not write %d face audit events: %s", len(events), e)
+            with self._lock:
+                self._events[:0] = [event for event in events if event.pk is None]
+            return 0
+
+        logger.debug("Wrote %d face audit events in %.1f ms", len(events), (time.monotonic() - started) * 1000)
+        return len(events)
+
+
+_buffer = None
+_buffer_lock = threading.Lock()
+
+
+def get_audit_buffer():
+    """Return the process-wide audit buffer, configured from settings"""
+    global _buffer
+    with _buffer_lock:
+        if _buffer is None:
+            _buffer = AuditBuffer(
+                batch_size=getattr(settings, 'FACE_AUDIT_BATCH_SIZE', DEFAULT_AUDIT_BATCH_SIZE),
+                flush_interval=getattr(settings, 'FACE_AUDIT_FLUSH_INTERVAL', DEFAULT_AUDIT_FLUSH_INTERVAL),
+                max_pending=getattr(settings, 'FACE_AUDIT_MAX_PENDING', DEFAULT_AUDIT_MAX_PENDING),
+            )
+            atexit.register(_buffer.flush)
+        return _buffer
+
+
+def record_verification_event(user, source, verification_result, audit):
+    """
+    Queue an audit record for one face verification
+
+    Args:
+        user: User who attempted to check in
+        source: 'sync', 'async' or 'deferred'
+        verification_result: Final verification result dictionary (or None)
+        audit: Details collected during verification (reference_angle,
+            references_tried, timings)
+    """
+    if not getattr(settings, 'FACE_AUDIT_ENABLED', True):
+        return
+
+    result = verification_result or {}
+    event = FaceVerificationEvent(
+        user_id=getattr(user, 'pk', None),
+        source=source,
+        matched=bool(result.get('match', False)),
+        development_override=bool(result.get('development_override', False)),
+        similarity=float(result['similarity']) if result.get('similarity') is not None else None,
+        confidence=float(result['confidence']) if result.get('confidence') is not None else None,
+        has_eyes=bool(result.get('has_eyes', False)),
+        reference_angle=audit.get('reference_angle'),
+        references_tried=audit.get('references_tried', 0),
+        scores=result.get('scores') or {},
+        timings=audit.get('timings', {}),
+        error=str(result.get('error') or '')[:255],
+    )
+    get_audit_buffer().add(event)
@@ -0,0 +1,358 @@
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+
+from .face_audit import record_verification_event
+from .face_enrollment import schedule_template_refresh
+from .face_gallery import get_gallery
+from .face_logging import log_verification_summary, verification_trace
+from .face_quality import frame_score, quality_gate
+from .face_recognition_utils import verify_face, verify_face_encodings, get_face_encoding
+from .face_templates import deserialize_template, is_current_template, needs_template, pipeline_version
+from .serializers import AttendanceCheckInSerializer
+
+logger = logging.getLogger(__name__)
+
+# DEVELOPMENT MODE: Allow lower confidence scores for testing
+DEVELOPMENT_MODE = True  # Set to False in production
+# Minimum similarity (percent) accepted in development mode
+DEVELOPMENT_MIN_SIMILARITY = 25.0
+# References compared per check-in once ranked by the gallery (None: all)
+DEFAULT_VERIFY_MAX_REFERENCES = 3
+# Frames of a check-in burst that go through the full pipeline
+DEFAULT_BURST_ENCODE_FRAMES = 2
+# Reference photos encoded on the fly per check-in when a user has no
+# template of the current pipeline version
+DEFAULT_STALE_REFERENCE_LIMIT = 1
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+class CheckInError(Exception):
+    """A face check-in that cannot go ahead; payload is the error response body"""
+
+    def __init__(self, payload):
+        super().__init__(payload.get('error'))
+        self.payload = payload
+
+
+def get_verification_executor():
+    """
+    Return the shared worker pool that runs face verification off the event loop
+
+    Sized by FACE_VERIFICATION_WORKERS so async check-ins queue for inference
+    instead of each grabbing a thread from the default executor.
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            max_workers = getattr(settings, 'FACE_VERIFICATION_WORKERS', None) or min(4, os.cpu_count() or 1)
+            _executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='face-verify')
+        return _executor
+
+
+def find_location_in_range(latitude, longitude, locations):
+    """
+    Return the first location whose radius contains the given coordinates
+
+    Args:
+        latitude, longitude: Check-in coordinates
+        locations: Iterable of active Location instances
+
+    Returns:
+        Location instance, or None if the user is out of range of all of them
+    """
+    calculator = AttendanceCheckInSerializer()
+    for location in locations:
+        distance = calculator.calculate_distance(
+            latitude, longitude,
+            location.latitude, location.longitude
+        )
+        if distance <= location.radius:
+            return location
+    return None
+
+
+def select_probe_frames(face_images):
+    """
+    Pick the frames of a check-in worth running the full pipeline on
+
+    Every frame (one photo or a burst of a few) goes through the quality
+    gate, which costs milliseconds; only the best FACE_BURST_ENCODE_FRAMES
+    passing frames are then detected, embedded and compared. A dark, blurry
+    or faceless capture is rejected without any full pipeline run.
+
+    Returns:
+        List of frames, best first
+
+    Raises:
+        CheckInError: If no frame passes, with the reason and metrics of the best one
+    """
+    ranked = sorted(
+        ((frame_score(assessment), index, frame, assessment)
+         for index, (frame, assessment) in enumerate((frame, quality_gate(frame)) for frame in face_images)),
+        key=lambda item: (-item[0][0], -item[0][1], item[1])
+    )
+    selected = [frame for score, _, frame, _ in ranked if score[0] > 0]
+    if not selected:
+        assessment = ranked[0][3]
+        logger.info("Face check-in rejected by quality gate: %s %s (%d frames)",
+                    assessment['code'], assessment['metrics'], len(face_images))
+        raise CheckInError({
+            'error': assessment['reason'],
+            'quality': assessment,
+        })
+    return selected[:getattr(settings, 'FACE_BURST_ENCODE_FRAMES', DEFAULT_BURST_ENCODE_FRAMES)]
+
+
+def order_references(reference_images, check_face):
+    """
+    Sort a user's references by similarity to the probe in the shared gallery
+
+    With aligned faces the closest few angles decide the outcome, so a ranked
+    list is cut to FACE_VERIFY_MAX_REFERENCES. Falls back to the given order,
+    uncut, when there is no probe embedding or the gallery has no rows for
+    the user yet.
+    """
+    embedding = check_face.get('facenet_embedding') if check_face else None
+    gallery = get_gallery() if embedding is not None and reference_images else None
+    if gallery is None:
+        return reference_images
+    scores = gallery.rank_user_references(reference_images[0].user_id, embedding)
+    if not scores:
+        return reference_images
+    ranked = sorted(reference_images, key=lambda ref: -scores.get(ref.angle_index, -2.0))
+    limit = getattr(settings, 'FACE_VERIFY_MAX_REFERENCES', DEFAULT_VERIFY_MAX_REFERENCES)
+    return ranked[:limit] if limit else ranked
+
+
+def verify_against_references(face_image, reference_images, profile_face_image_name=None, audit=None,
+                              profile_template=None):
+    """
+    Verify a check-in photo against a user's enrolled reference faces
+
+    Does no database access itself, so it can run in a worker thread while
+    the caller (sync or async) does its ORM work on its own side. References
+    with a stale template are handed to schedule_template_refresh, whose
+    background workers write their new templates.
+
+    Args:
+        face_image: Uploaded check-in image
+        reference_images: List of the user's UserFaceImage instances
+        profile_face_image_name: Storage name of the single profile face image, if any
+        audit: Optional dict that receives the chosen reference angle, the
+            number of references tried and stage timings (ms)
+        profile_template: Current-version template of the profile face image
+            (current_profile_template), used instead of encoding the image
+
+    Returns:
+        The best verification result dictionary
+
+    Raises:
+        CheckInError: If no reference image could be compared
+    """
+    if audit is None:
+        audit = {}
+    timings = audit.setdefault('timings', {})
+    audit.setdefault('references_tried', 0)
+    verification_result = None
+    best_match_score = 0
+    best_verification_result = None
+    check_face = None
+
+    # Templates of an older pipeline version are not comparable with the probe.
+    # Users with current templates are checked against those only; the others
+    # get at most FACE_STALE_REFERENCE_LIMIT references encoded from their
+    # images, or none when the profile image has a current template, so a
+    # pipeline upgrade does not turn every check-in into a re-encode of every
+    # angle. Catching up is left to the background refresh and reembed_faces
+    version = pipeline_version()
+    enrolled_references = reference_images
+    current_references = [ref for ref in reference_images if is_current_template(ref, version)]
+    if current_references:
+        reference_images = current_references
+    stale_budget = 0 if profile_template else getattr(
+        settings, 'FACE_STALE_REFERENCE_LIMIT', DEFAULT_STALE_REFERENCE_LIMIT
+    )
+
+    # Check multiple face images first if available
+    if reference_images:
+        # Encode the probe once and reuse it for every reference
+        started = time.monotonic()
+        check_face = get_face_encoding(face_image)
+        timings['probe_encoding_ms'] = round((time.monotonic() - started) * 1000, 1)
+        started = time.monotonic()
+
+        # Try the references closest to the probe first, so the early exit on
+        # a match usually happens at the first comparison
+        reference_images = order_references(reference_images, check_face)
+
+        # Try to match against each reference image
+        for ref_image in reference_images:
+            # Prefer the template stored at enrollment time
+            reference_face = deserialize_template(ref_image.template) if is_current_template(ref_image, version) else None
+
+            if reference_face is None:
+                # Photos this pipeline version rejected are not worth encoding
+                if stale_budget <= 0 or not needs_template(ref_image, version):
+                    continue
+                stale_budget -= 1
+
+                # Get the full path to the reference image
+                reference_image_path = os.path.join(settings.MEDIA_ROOT, ref_image.image.name)
+
+                # Ensure the reference image path exists
+                if not os.path.exists(reference_image_path):
+                    continue  # Skip this reference image if it doesn't exist
+
+                reference_face = get_face_encoding(reference_image_path)
+
+            # Verify against this reference image
+            current_result = verify_face_encodings(reference_face, check_face)
+            audit['references_tried'] += 1
+
+            # Keep track of the best match
+            current_score = current_result.get('similarity', 0)
+            if current_result['match'] or (current_score > best_match_score):
+                best_match_score = current_score
+                best_verification_result = current_result
+                audit['reference_angle'] = ref_image.angle_index
+
+                # If we found a match, we can stop checking
+                if current_result['match']:
+                    break
+
+        timings['reference_comparison_ms'] = round((time.monotonic() - started) * 1000, 1)
+
+        # Use the best result from multiple images
+        if best_verification_result:
+            verification_result = best_verification_result
+
+    # Queued after the comparisons, so a photo encoded above is an encoding
+    # cache hit for the refresh
+    if len(current_references) < len(enrolled_references):
+        schedule_template_refresh(enrolled_references)
+
+    # If no match found with multiple images or no multiple images available, try the single image
+    if (not verification_result or not verification_result['match']) and profile_face_image_name:
+        started = time.monotonic()
+        reference_face = deserialize_template(profile_template) if profile_template else None
+        if reference_face is not None:
+            # Compare the stored template with the probe, encoded once
+            if check_face is None:
+                check_face = get_face_encoding(face_image)
+            single_image_result = verify_face_encodings(reference_face, check_face)
+        else:
+            # Get the full path to the reference image
+            reference_image_path = os.path.join(settings.MEDIA_ROOT, profile_face_image_name)
+
+            # Ensure the reference image path exists
+            if not os.path.exists(reference_image_path):
+                raise CheckInError({
+                    'error': f'Reference face image not found at path: {reference_image_path}'
+                })
+
+            single_image_result = verify_face(reference_image_path, face_image)
+        timings['profile_image_ms'] = round((time.monotonic() - started) * 1000, 1)
+        audit['references_tried'] += 1
+
+        # Use the single image result if it's better than the multiple image result
+        if not verification_result or single_image_result.get('similarity', 0) > best_match_score:
+            verification_result = single_image_result
+            audit['reference_angle'] = None
+
+    # If we still don't have a verification result, return an error
+    if not verification_result:
+        raise CheckInError({'error': 'Failed to verify face against any reference images.'})
+
+    return verification_result
+
+
+def accept_verification(verification_result):
+    """
+    Decide whether a verification result allows the check-in
+
+    In DEVELOPMENT_MODE near misses above DEVELOPMENT_MIN_SIMILARITY are
+    accepted and the result is marked as overridden.
+
+    Raises:
+        CheckInError: If the face did not match
+    """
+    if verification_result['match']:
+        return verification_result
+
+    # In development mode, check if score is above minimum threshold
+    similarity = verification_result.get('similarity', 0) * 100
+    if DEVELOPMENT_MODE and similarity >= DEVELOPMENT_MIN_SIMILARITY:
+        logger.warning("DEVELOPMENT MODE: Forcing face match despite low score: %.2f%%", similarity)
+
+        # Override the verification result
+        verification_result['match'] = True
+        verification_result['confidence'] = max(verification_result.get('confidence', 0), 60.0)  # Minimum 60% confidence
+        verification_result['development_override'] = True
+        verification_result['original_match'] = False
+        return verification_result
+
+    # Not in development mode or score too low even for development
+    raise CheckInError({
+        'error': 'Face verification failed. Please try again.',
+        'details': verification_result
+    })
+
+
+def run_face_verification(face_image, reference_images, profile_face_image_name=None, user=None, source='sync',
+                          profile_template=None):
+    """
+    verify_against_references followed by accept_verification, for use in a worker
+
+    Stage details of the whole run share one sampling decision, a single
+    summary event is logged for it and, whatever the outcome, the attempt is
+    queued for the FaceVerificationEvent audit table.
+    """
+    started = time.monotonic()
+    verification_result = None
+    audit = {}
+    with verification_trace():
+        try:
+            verification_result = verify_against_references(
+                face_image, reference_images, profile_face_image_name, audit=audit,
+                profile_template=profile_template
+            )
+            return accept_verification(verification_result)
+        except CheckInError as e:
+            verification_result = verification_result or e.payload
+            raise
+        finally:
+            audit.setdefault('timings', {})['total_ms'] = round((time.monotonic() - started) * 1000, 1)
+            log_verification_summary(
+                verification_result,
+                started,
+                references=len(reference_images),
+                profile_image=bool(profile_face_image_name),
+                development_override=bool((verification_result or {}).get('development_override', False))
+            )
+            record_verification_event(user, source, verification_result, audit)
+
+
+def verify_probe_frames(face_images, reference_images, profile_face_image_name=None, user=None, source='sync',
+                        profile_template=None):
+    """
+    run_face_verification on the selected frames of a check-in, best first
+
+    The next frame is only tried when the previous one did not match, so a
+    good first frame costs a single pipeline run.
+    """
+    for index, face_image in enumerate(face_images):
+        try:
+            return run_face_verification(
+                face_image, reference_images, profile_face_image_name, user=user, source=source,
+                profile_template=profile_template
+            )
+        except CheckInError:
+            if index == len(face_images) - 1:
+                raise
@@ -0,0 +1,138 @@
+import cv2
+from django.conf import settings
+
+# Longest side of the frame the Haar cascades scan; faces are looked for in
+# a downscaled copy and their boxes mapped back to the full image
+DEFAULT_HAAR_MAX_SIDE = 640
+# Size ratio between consecutive pyramid levels (detectMultiScale's scaleFactor)
+DEFAULT_HAAR_SCALE_STEP = 1.1
+# Relative size/position difference under which raw hits are grouped
+# (the value detectMultiScale uses internally)
+GROUP_EPS = 0.2
+
+# Smallest pyramid level built (the smallest stock cascade window is 20x20)
+MIN_LEVEL_SIDE = 20
+
+# (minNeighbors, minimum face side in full-image pixels) per pass, strict
+# first; the lenient passes reuse the raw hits of the strict one
+PRIMARY_PASSES = ((5, 60), (3, 40))
+ALT_PASSES = ((4, 60), (2, 30))
+EDGE_PASSES = ((3, 40),)
+
+
+class HaarPyramid:
+    """
+    Image pyramid over a capped-resolution gray frame, shared by every Haar pass
+
+    detectMultiScale builds its own pyramid over the full image on every
+    call. Here the levels are built once (lazily, per source: the gray frame
+    or its edge-enhanced version) and each cascade runs a single-scale scan
+    per level with minNeighbors=0, so strict and lenient neighbour
+    thresholds are applied to the same raw hits with cv2.groupRectangles
+    instead of rescanning.
+    """
+
+    def __init__(self, gray, max_side=None, step=None):
+        max_side = max_side or getattr(settings, 'FACE_HAAR_MAX_SIDE', DEFAULT_HAAR_MAX_SIDE)
+        self.step = step or getattr(settings, 'FACE_HAAR_SCALE_STEP', DEFAULT_HAAR_SCALE_STEP)
+        height, width = gray.shape[:2]
+        self.base_scale = min(1.0, max_side / float(max(height, width)))
+        if self.base_scale < 1.0:
+            gray = cv2.resize(gray, (max(1, int(width * self.base_scale)), max(1, int(height * self.base_scale))),
+                              interpolation=cv2.INTER_AREA)
+        self._sources = {'gray': gray}
+        self._levels = {}
+
+    def _source(self, name):
+        if name not in self._sources:
+            # Edge enhancement of the original fallback, on the capped frame
+            edges = cv2.convertScaleAbs(cv2.Laplacian(self._sources['gray'], cv2.CV_8U, ksize=3))
+            self._sources[name] = cv2.equalizeHist(edges)
+        return self._sources[name]
+
+    def levels(self, source='gray'):
+        """
+        Pyramid levels as (scale, image), coarsest (largest faces) first
+
+        Scales are relative to the capped frame and shared by all cascades;
+        levels smaller than MIN_LEVEL_SIDE are not built.
+        """
+        base = self._source(source)
+        if source not in self._levels:
+            scales = []
+            scale = 1.0
+            while min(base.shape[:2]) * scale >= MIN_LEVEL_SIDE:
+                scales.append(scale)
+                scale /= self.step
+            self._levels[source] = [None] * len(scales), scales
+        images, scales = self._levels[source]
+        for index in range(len(scales) - 1, -1, -1):
+            if images[index] is None:
+                scale = scales[index]
+                images[index] = base if scale == 1.0 else cv2.resize(
+                    base, (max(1, int(base.shape[1] * scale)), max(1, int(base.shape[0] * scale))),
+                    interpolation=cv2.INTER_AREA
+                )
+            yield scales[index], images[index]
+
+    def detect(self, cascade, passes, source='gray'):
+        """
+        Find faces with one cascade across the pyramid
+
+        The first pass (strict) is checked after every level and the scan
+        stops at the first level where it finds a face; the remaining passes
+        only run, on the accumulated hits, when the whole pyramid gave none.
+
+        Returns:
+            List of (x, y, w, h) in full-image pixels
+        """
+        window_w, window_h = cascade.getOriginalWindowSize()
+        hits = []
+        for scale, level in self.levels(source):
+            if level.shape[1] < window_w or level.shape[0] < window_h:
+                continue
+            raw = cascade.detectMultiScale(level, minNeighbors=0, minSize=(window_w, window_h),
+                                           maxSize=(window_w, window_h))
+            if len(raw) == 0:
+                continue
+            hits.extend([int(round(v / scale)) for v in rect] for rect in raw)
+            faces = self._group(hits, *passes[0])
+            if faces:
+                return faces
+        for min_neighbors, min_size in passes[1:]:
+            faces = self._group(hits, min_neighbors, min_size)
+            if faces:
+                return faces
+        return []
+
+    def _group(self, hits, min_neighbors, min_size):
+        """Cluster raw hits like detectMultiScale and map them to full-image pixels"""
+        if len(hits) <= min_neighbors:
+            return []
+        grouped, _ = cv2.groupRectangles(list(hits), min_neighbors, GROUP_EPS)
+        faces = []
+        for x, y, w, h in grouped:
+            x, y, w, h = (int(round(v / self.base_scale)) for v in (x, y, w, h))
+            if w >= min_size and h >= min_size:
+                faces.append((x, y, w, h))
+        return faces
+
+
+def detect_faces_haar(gray, face_cascade, face_cascade_alt=None):
+    """
+    Haar fallback detection: primary cascade, alternative cascade, then the
+    edge-enhanced frame, all on one shared pyramid
+
+    Faces smaller than the cascade window (about 24 pixels) at the capped
+    FACE_HAAR_MAX_SIDE resolution are not found.
+
+    Returns:
+        List of (x, y, w, h) in pixels of gray, empty if no face was found
+    """
+    pyramid = HaarPyramid(gray)
+    faces = pyramid.detect(face_cascade, PRIMARY_PASSES)
+    if not faces and face_cascade_alt is not None:
+        faces = pyramid.detect(face_cascade_alt, ALT_PASSES)
+    if not faces:
+        faces = pyramid.detect(face_cascade, EDGE_PASSES, source='edges')
+    return faces
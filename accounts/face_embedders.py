@@ -0,0 +1,151 @@
+import logging
+import os
+
+import numpy as np
+from django.conf import settings
+
+from .face_runtime import thread_setting
+
+logger = logging.getLogger(__name__)
+
+# FaceNet's expected input size
+FACENET_INPUT_SIZE = 160
+EMBEDDING_BACKENDS = ('torch', 'torchscript', 'onnx')
+
+MODEL_FILENAMES = {
+    'onnx': 'facenet.onnx',
+    'onnx-int8': 'facenet.int8.onnx',
+    'torchscript': 'facenet.torchscript.pt',
+}
+
+
+# Weights of the embedder the pipeline loaded in this process: 'fp32',
+# 'int8', or 'none' when FaceNet is unavailable (None until loaded)
+_active_weights = None
+
+
+def set_active_weights(weights):
+    """Record which FaceNet weights the pipeline runs, for pipeline_version"""
+    global _active_weights
+    _active_weights = weights
+
+
+def get_active_weights():
+    return _active_weights
+
+
+def get_model_dir():
+    """Directory holding exported FaceNet models (FACENET_MODEL_DIR)"""
+    return getattr(settings, 'FACENET_MODEL_DIR', os.path.join(settings.BASE_DIR, 'models', 'facenet'))
+
+
+def get_model_path(backend, quantized=False):
+    """Path of the exported model file a backend loads"""
+    key = 'onnx-int8' if backend == 'onnx' and quantized else backend
+    return os.path.join(get_model_dir(), MODEL_FILENAMES[key])
+
+
+def load_eager_facenet():
+    """Load the pretrained InceptionResnetV1 (VGGFace2) model in eval mode"""
+    from facenet_pytorch import InceptionResnetV1
+    return InceptionResnetV1(pretrained='vggface2').eval()
+
+
+class TorchEmbedder:
+    """FaceNet run as an eager PyTorch module"""
+    name = 'torch'
+    weights = 'fp32'
+
+    def __init__(self, model):
+        self.model = model
+
+    def embed(self, batch):
+        """
+        Args:
+            batch: float32 array of shape (N, 3, 160, 160), RGB scaled to [0, 1]
+
+        Returns:
+            float32 array of shape (N, 512)
+        """
+        import torch
+        with torch.no_grad():
+            return self.model(torch.from_numpy(batch)).cpu().numpy()
+
+
+class TorchScriptEmbedder(TorchEmbedder):
+    """FaceNet traced to TorchScript by export_facenet"""
+    name = 'torchscript'
+
+    def __init__(self, path):
+        import torch
+        super().__init__(torch.jit.load(path, map_location='cpu').eval())
+
+
+class OnnxEmbedder:
+    """FaceNet exported to ONNX (fp32 or int8) and run with ONNX Runtime"""
+    name = 'onnx'
+
+    def __init__(self, path, quantized=False):
+        import onnxruntime
+
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        threads = thread_setting('FACE_ONNX_THREADS')
+        if threads is not None:
+            options.intra_op_num_threads = int(threads)
+            options.inter_op_num_threads = 1
+        self.session = onnxruntime.InferenceSession(path, options, providers=['CPUExecutionProvider'])
+        self.input_name = self.session.get_inputs()[0].name
+        self.path = path
+        self.weights = 'int8' if quantized else 'fp32'
+
+    def embed(self, batch):
+        return self.session.run(None, {self.input_name: batch})[0]
+
+
+def load_embedder(backend=None, quantized=None):
+    """
+    Create the FaceNet embedder selected by FACENET_BACKEND
+
+    Args:
+        backend: 'torch', 'torchscript' or 'onnx' (defaults to FACENET_BACKEND)
+        quantized: For 'onnx', load the int8 model (defaults to FACENET_ONNX_QUANTIZED)
+
+    Raises:
+        ImportError: If the backend's runtime is not installed
+        FileNotFoundError: If the exported model has not been created yet
+    """
+    backend = backend or getattr(settings, 'FACENET_BACKEND', 'torch')
+    if backend not in EMBEDDING_BACKENDS:
+        raise ValueError(f"Unknown FACENET_BACKEND: {backend}")
+    if quantized is None:
+        quantized = getattr(settings, 'FACENET_ONNX_QUANTIZED', True)
+
+    if backend == 'torch':
+        return TorchEmbedder(load_eager_facenet())
+
+    path = get_model_path(backend, quantized)
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"{path} not found, run `manage.py export_facenet` first")
+    if backend == 'torchscript':
+        return TorchScriptEmbedder(path)
+    return OnnxEmbedder(path, quantized=quantized)
+
+
+def prepare_facenet_batch(rgb_images):
+    """
+    Stack RGB face crops into FaceNet's input layout
+
+    Args:
+        rgb_images: Iterable of uint8 RGB arrays (any size)
+
+    Returns:
+        float32 array of shape (N, 3, 160, 160) scaled to [0, 1]
+    """
+    import cv2
+
+    batch = np.stack([
+        cv2.resize(image, (FACENET_INPUT_SIZE, FACENET_INPUT_SIZE)) for image in rgb_images
+    ]).astype(np.float32)
+    batch /= 255.0
+    return np.ascontiguousarray(batch.transpose(0, 3, 1, 2))
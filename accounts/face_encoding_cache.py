@@ -0,0 +1,159 @@
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+import time
+
+from django.conf import settings
+
+from .caching import TTLCache
+from .face_templates import deserialize_template, pipeline_version, serialize_template
+
+logger = logging.getLogger(__name__)
+
+# Encodings kept in process memory (about 150 KB each in template form)
+DEFAULT_ENCODING_CACHE_SIZE = 256
+# Seconds an in-memory encoding stays valid
+DEFAULT_ENCODING_CACHE_TTL = 3600
+# Seconds an on-disk encoding stays valid
+DEFAULT_ENCODING_CACHE_DISK_TTL = 7 * 24 * 3600
+
+# Cached value of an image in which no face was found (memory tier only,
+# kept briefly since a failed RetinaFace pass falls back to Haar, which may
+# miss a face RetinaFace would find). Pipeline errors are never cached.
+_NO_FACE = b''
+NO_FACE_TTL = 60
+
+_memory_cache = None
+_memory_cache_lock = threading.Lock()
+
+
+def encoding_cache_enabled():
+    return getattr(settings, 'FACE_ENCODING_CACHE_ENABLED', True)
+
+
+def _get_memory_cache():
+    global _memory_cache
+    with _memory_cache_lock:
+        if _memory_cache is None:
+            _memory_cache = TTLCache(
+                max_entries=getattr(settings, 'FACE_ENCODING_CACHE_SIZE', DEFAULT_ENCODING_CACHE_SIZE),
+                ttl=getattr(settings, 'FACE_ENCODING_CACHE_TTL', DEFAULT_ENCODING_CACHE_TTL),
+            )
+        return _memory_cache
+
+
+def image_bytes(image_file):
+    """Raw bytes of a DecodedImage, uploaded file or image path"""
+    if hasattr(image_file, 'data'):
+        return image_file.data
+    if isinstance(image_file, str):
+        with open(image_file, 'rb') as f:
+            return f.read()
+    if hasattr(image_file, 'seek'):
+        image_file.seek(0)
+    data = image_file.read()
+    if hasattr(image_file, 'seek'):
+        image_file.seek(0)
+    return data
+
+
+def encoding_cache_key(data):
+    """Pipeline version plus a 128-bit BLAKE2b digest of the image bytes"""
+    return f'{pipeline_version()}-{hashlib.blake2b(data, digest_size=16).hexdigest()}'
+
+
+def _disk_path(key):
+    directory = getattr(settings, 'FACE_ENCODING_CACHE_DIR', None)
+    if not directory:
+        return None
+    version, digest = key.split('-', 1)
+    return os.path.join(directory, version, digest[:2], f'{digest}.tpl')
+
+
+def _read_disk(key):
+    path = _disk_path(key)
+    if path is None:
+        return None
+    try:
+        with open(path, 'rb') as f:
+            age = time.time() - os.fstat(f.fileno()).st_mtime
+            if age > getattr(settings, 'FACE_ENCODING_CACHE_DISK_TTL', DEFAULT_ENCODING_CACHE_DISK_TTL):
+                os.remove(path)
+                return None
+            return f.read()
+    except FileNotFoundError:
+        return None
+    except OSError as e:
+        logger.warning("Could not read cached face encoding %s: %s", path, e)
+        return None
+
+
+def _write_disk(key, template):
+    """Write through a temporary file so other processes never read a partial entry"""
+    path = _disk_path(key)
+    if path is None:
+        return
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(template)
+        os.replace(temp_path, path)
+    except OSError as e:
+        logger.warning("Could not write cached face encoding %s: %s", path, e)
+
+
+def cached_face_encoding(image_file, compute):
+    """
+    Return the encoding of an image, computing it only on a cache miss
+
+    Entries are keyed by the image bytes and the pipeline version, so the
+    same probe sent twice, or the same reference file under another name,
+    costs a hash instead of detection and embedding. Hits come from process
+    memory first, then from the shared FACE_ENCODING_CACHE_DIR if set.
+    Encodings are cached in template form (float32 embedding), which keeps
+    everything compare_faces and enrollment use; keypoints and the
+    preprocessed colour crop are not kept. A miss returns the same template
+    form as a hit, so callers never depend on whether the image was cached.
+
+    Args:
+        image_file: DecodedImage, uploaded file or image path
+        compute: Function encoding image_file on a miss (get_face_encoding's
+            pipeline); an exception it raises propagates and nothing is cached
+
+    Returns:
+        Face data dictionary, or None if no face was found
+    """
+    if not encoding_cache_enabled():
+        return compute(image_file)
+
+    try:
+        key = encoding_cache_key(image_bytes(image_file))
+    except Exception as e:
+        logger.warning("Could not hash image for the encoding cache: %s", e)
+        return compute(image_file)
+
+    memory = _get_memory_cache()
+    template = memory.get(key)
+    if template is None:
+        template = _read_disk(key)
+        if template is not None:
+            memory.set(key, template)
+    if template is not None:
+        return deserialize_template(template) if template != _NO_FACE else None
+
+    encoding = compute(image_file)
+    if encoding is None:
+        memory.set(key, _NO_FACE, ttl=NO_FACE_TTL)
+        return None
+    template = serialize_template(encoding, embedding_dtype='float32')
+    memory.set(key, template)
+    _write_disk(key, template)
+    return deserialize_template(template)
+
+
+def clear_encoding_cache():
+    """Drop the in-memory tier (the disk tier expires by FACE_ENCODING_CACHE_DISK_TTL)"""
+    _get_memory_cache().clear()
@@ -0,0 +1,253 @@
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import close_old_connections
+
+from .face_quality import quality_gate
+from .face_recognition_utils import get_face_encoding
+from .face_gallery import schedule_gallery_rebuild
+from .image_ingest import DecodedImage, normalize_face_image
+from .face_templates import needs_template, pipeline_version, serialize_template
+
+logger = logging.getLogger(__name__)
+
+# Minimum width/height (in pixels of the uploaded image) of the detected face
+DEFAULT_ENROLLMENT_MIN_FACE_SIZE = 80
+# Minimum variance of the Laplacian over the face region; lower means blurrier
+DEFAULT_ENROLLMENT_MIN_SHARPNESS = 30.0
+
+_executor = None
+_executor_lock = threading.Lock()
+
+# Primary keys of UserFaceImage rows with a template refresh queued
+_refreshing = set()
+_refreshing_lock = threading.Lock()
+
+
+def get_enrollment_executor():
+    """
+    Return the shared worker pool used for template extraction
+
+    A single bounded pool per process keeps concurrent enrollments from
+    spawning more extraction threads than FACE_ENROLLMENT_WORKERS. Workers
+    share no OpenCV objects: cascades, CLAHE and SIFT come from each thread's
+    own PipelineContext.
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            max_workers = getattr(settings, 'FACE_ENROLLMENT_WORKERS', None) or min(4, os.cpu_count() or 1)
+            _executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='face-enroll')
+        return _executor
+
+
+def assess_enrollment_encoding(encoding):
+    """
+    Decide whether a face encoding is good enough to enroll
+
+    Args:
+        encoding: Face data dictionary from get_face_encoding (or None)
+
+    Returns:
+        Tuple of (accepted, reason, metrics)
+    """
+    if encoding is None:
+        return False, 'No face detected in the image', {}
+
+    min_face_size = getattr(settings, 'FACE_ENROLLMENT_MIN_FACE_SIZE', DEFAULT_ENROLLMENT_MIN_FACE_SIZE)
+    min_sharpness = getattr(settings, 'FACE_ENROLLMENT_MIN_SHARPNESS', DEFAULT_ENROLLMENT_MIN_SHARPNESS)
+
+    _, _, w, h = encoding['original_bbox']
+    face_size = int(min(w, h))
+    sharpness = float(cv2.Laplacian(encoding['face_region'], cv2.CV_64F).var())
+    metrics = {'face_size': face_size, 'sharpness': round(sharpness, 2)}
+
+    if face_size < min_face_size:
+        return False, 'Face is too small, move closer to the camera', metrics
+    if sharpness < min_sharpness:
+        return False, 'Image is too blurry', metrics
+    return True, None, metrics
+
+
+def extract_enrollment_template(face_image):
+    """
+    Detect, encode and quality-check a single enrollment image
+
+    Args:
+        face_image: Uploaded image file
+
+    Returns:
+        dict with 'accepted', 'reason', 'metrics', serialized 'template' and
+        the 'template_version' it was made with
+    """
+    assessment = quality_gate(face_image)
+    if assessment is not None and not assessment['passed']:
+        return {
+            'accepted': False,
+            'reason': assessment['reason'],
+            'metrics': assessment['metrics'],
+            'template': None,
+            'template_version': '',
+        }
+
+    try:
+        encoding = get_face_encoding(face_image)
+        accepted, reason, metrics = assess_enrollment_encoding(encoding)
+    except Exception as e:
+        logger.error("Error extracting enrollment template: %s", e)
+        encoding, accepted, reason, metrics = None, False, 'Could not process the image', {}
+
+    return {
+        'accepted': accepted,
+        'reason': reason,
+        'metrics': metrics,
+        'template': serialize_template(encoding) if accepted else None,
+        'template_version': pipeline_version() if accepted else '',
+    }
+
+
+def extract_enrollment_templates(face_images_by_angle):
+    """
+    Extract templates for several enrollment images in parallel
+
+    Args:
+        face_images_by_angle: {angle_index: uploaded image file}
+
+    Returns:
+        {angle_index: result dict from extract_enrollment_template}
+    """
+    executor = get_enrollment_executor()
+    futures = {
+        angle_index: executor.submit(extract_enrollment_template, face_image)
+        for angle_index, face_image in face_images_by_angle.items()
+    }
+    return {angle_index: future.result() for angle_index, future in futures.items()}
+
+
+def _refresh_template(pk, user_id, name):
+    """
+    Recompute the template of one stored photo, unless it was replaced meanwhile
+
+    A photo the pipeline rejects, or that is gone from storage, is recorded
+    with an empty template of the current version, so later check-ins do not
+    queue it again.
+    """
+    from .models import UserFaceImage
+
+    close_old_connections()
+    try:
+        try:
+            with UserFaceImage._meta.get_field('image').storage.open(name, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            result = {'accepted': False, 'reason': 'Image file not found'}
+        else:
+            result = extract_enrollment_template(ContentFile(data, name=os.path.basename(name)))
+        if result['accepted']:
+            template, template_version = result['template'], result['template_version']
+        else:
+            logger.warning("Could not refresh face template %s: %s", name, result['reason'])
+            template, template_version = None, pipeline_version()
+        updated = UserFaceImage.objects.filter(pk=pk, image=name).update(
+            template=template, template_version=template_version
+        )
+        # Queryset updates send no signals
+        if updated and template is not None:
+            schedule_gallery_rebuild(user_id)
+    except Exception as e:
+        logger.error("Could not refresh face template %s: %s", name, e)
+    finally:
+        with _refreshing_lock:
+            _refreshing.discard(pk)
+        close_old_connections()
+
+
+def schedule_template_refresh(reference_images):
+    """
+    Queue a background re-extraction of references with a stale template
+
+    Check-ins call this when they meet templates missing or made by an older
+    pipeline version, so those users are re-embedded right away instead of
+    waiting for a reembed_faces run. Rows already queued, and photos the
+    current version already rejected, are skipped.
+
+    Args:
+        reference_images: UserFaceImage instances
+
+    Returns:
+        Number of rows queued
+    """
+    version = pipeline_version()
+    with _refreshing_lock:
+        stale = [ref for ref in reference_images
+                 if needs_template(ref, version) and ref.pk not in _refreshing]
+        _refreshing.update(ref.pk for ref in stale)
+
+    executor = get_enrollment_executor()
+    for ref in stale:
+        executor.submit(_refresh_template, ref.pk, ref.user_id, ref.image.name)
+    return len(stale)
+
+
+def init_enrollment_worker():
+    """Configure Django inside a freshly spawned worker process"""
+    import django
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'auth_project.settings')
+    django.setup()
+
+
+def extract_template_from_bytes(name, data):
+    """
+    Process pool entry point: extract_enrollment_template of one photo
+
+    Used by the reembed_faces command with init_enrollment_worker as the
+    pool initializer.
+
+    Args:
+        name: File name of the photo
+        data: Raw image bytes
+
+    Returns:
+        dict with 'accepted', 'reason', 'template' and 'template_version'
+    """
+    result = extract_enrollment_template(ContentFile(data, name=name))
+    return {
+        'accepted': result['accepted'],
+        'reason': result['reason'],
+        'template': result['template'],
+        'template_version': result['template_version'],
+    }
+
+
+def ingest_photo_from_bytes(name, data):
+    """
+    Process pool entry point: normalize a new photo as the upload views do,
+    then extract_enrollment_template of the normalized image
+
+    Used by the import_faces command with init_enrollment_worker as the pool
+    initializer, so imported photos are stored and encoded like uploads.
+
+    Args:
+        name: File name of the photo
+        data: Raw image bytes
+
+    Returns:
+        dict with 'accepted', 'reason', 'template', 'template_version' and
+        the 'name' and 'data' of the normalized image to store
+    """
+    image = normalize_face_image(DecodedImage(data, name))
+    result = extract_enrollment_template(image)
+    return {
+        'accepted': result['accepted'],
+        'reason': result['reason'],
+        'template': result['template'],
+        'template_version': result['template_version'],
+        'name': image.name,
+        'data': image.data,
+    }
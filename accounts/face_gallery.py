@@ -0,0 +1,350 @@
+import logging
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+
+import numpy as np
+from django.conf import settings
+
+from .face_templates import EMBEDDING_PREFIX_BYTES, pipeline_version, template_embedding
+
+try:
+    import fcntl
+except ImportError:  # Windows: concurrent rebuilds just race on os.replace
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# Gallery file layout
+#
+#   header    magic 'FGAL', format version, row count, embedding dimension,
+#             dtype code, build stamp (time.time_ns() of the build),
+#             pipeline version of the templates (ASCII, NUL padded)
+#   user_ids  int64[count], sorted ascending
+#   angles    int32[count]
+#   matrix    float16/float32[count, dim], L2-normalized embeddings
+#
+# Every section starts on an 8-byte boundary so it can be viewed in place
+# with np.frombuffer over a read-only mmap shared by all worker processes.
+GALLERY_MAGIC = b'FGAL'
+GALLERY_FORMAT_VERSION = 2
+_HEADER = struct.Struct('<4sIIIIQ16s')
+_ALIGNMENT = 8
+_DTYPES = {1: np.float32, 2: np.float16}
+
+DEFAULT_GALLERY_DTYPE = 'float16'
+# Seconds between stat() calls checking whether the file was rebuilt
+DEFAULT_GALLERY_CHECK_INTERVAL = 1.0
+# Enrollment changes arriving within this many seconds share one rebuild
+DEFAULT_GALLERY_REBUILD_DELAY = 2.0
+
+
+def get_gallery_path():
+    return getattr(settings, 'FACE_GALLERY_PATH', os.path.join(settings.BASE_DIR, 'face_gallery', 'gallery.bin'))
+
+
+def gallery_enabled():
+    return getattr(settings, 'FACE_GALLERY_ENABLED', True)
+
+
+def _aligned(offset):
+    return offset + (-offset % _ALIGNMENT)
+
+
+class FaceGallery:
+    """Read-only view of a gallery file mapped into memory"""
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            stat = os.fstat(f.fileno())
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.path = path
+        self.identity = (stat.st_dev, stat.st_ino)
+
+        magic, version, count, dim, dtype, stamp, templates = _HEADER.unpack_from(self._mmap, 0)
+        if magic != GALLERY_MAGIC or version != GALLERY_FORMAT_VERSION:
+            raise ValueError(f'{path} is not a version {GALLERY_FORMAT_VERSION} face gallery')
+        self.count, self.dim, self.dtype_code, self.stamp = count, dim, dtype, stamp
+        self.pipeline_version = templates.rstrip(b'\0').decode('ascii')
+
+        offset = _aligned(_HEADER.size)
+        self.user_ids = np.frombuffer(self._mmap, dtype=np.int64, count=count, offset=offset)
+        offset = _aligned(offset + self.user_ids.nbytes)
+        self.angles = np.frombuffer(self._mmap, dtype=np.int32, count=count, offset=offset)
+        offset = _aligned(offset + self.angles.nbytes)
+        self.matrix = np.frombuffer(self._mmap, dtype=_DTYPES[dtype], count=count * dim, offset=offset).reshape(count, dim)
+
+    def _scores(self, rows, embedding):
+        probe = np.asarray(embedding, dtype=np.float32).ravel()
+        probe = probe / (np.linalg.norm(probe) or 1.0)
+        return rows.astype(np.float32) @ probe
+
+    def rank_user_references(self, user_id, embedding):
+        """
+        Cosine similarity of a probe embedding to each enrolled angle of one user
+
+        Returns:
+            {angle_index: similarity}, empty if the user has no gallery rows
+        """
+        if len(embedding) != self.dim:
+            return {}
+        lo, hi = np.searchsorted(self.user_ids, [user_id, user_id + 1])
+        if lo == hi:
+            return {}
+        scores = self._scores(self.matrix[lo:hi], embedding)
+        return {int(angle): float(score) for angle, score in zip(self.angles[lo:hi], scores)}
+
+    def search(self, embedding, top_k=5):
+        """
+        Closest enrolled faces across all users
+
+        Returns:
+            List of (user_id, angle_index, similarity), best first
+        """
+        if self.count == 0 or len(embedding) != self.dim:
+            return []
+        scores = self._scores(self.matrix, embedding)
+        top_k = min(max(top_k, 1), self.count)
+        best = np.argpartition(-scores, top_k - 1)[:top_k]
+        best = best[np.argsort(-scores[best])]
+        return [(int(self.user_ids[i]), int(self.angles[i]), float(scores[i])) for i in best]
+
+
+_gallery = None
+_gallery_checked = 0.0
+_gallery_lock = threading.Lock()
+
+
+def get_gallery():
+    """
+    Return the current gallery mapping, remapping it after a rebuild
+
+    The file is stat()ed at most every FACE_GALLERY_CHECK_INTERVAL seconds;
+    a rebuild replaces it with a new inode, which triggers a remap. Mappings
+    of the old file stay valid for callers still using them.
+
+    Returns:
+        FaceGallery, or None if disabled or not built yet
+    """
+    global _gallery, _gallery_checked
+    if not gallery_enabled():
+        return None
+
+    now = time.monotonic()
+    interval = getattr(settings, 'FACE_GALLERY_CHECK_INTERVAL', DEFAULT_GALLERY_CHECK_INTERVAL)
+    if _gallery is not None and now - _gallery_checked < interval:
+        return _gallery
+
+    with _gallery_lock:
+        _gallery_checked = now
+        path = get_gallery_path()
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            _gallery = None
+            return None
+        if _gallery is None or _gallery.identity != (stat.st_dev, stat.st_ino):
+            try:
+                _gallery = FaceGallery(path)
+                logger.info("Mapped face gallery %s (%d embeddings, stamp %d)", path, _gallery.count, _gallery.stamp)
+            except Exception as e:
+                logger.warning("Could not map face gallery %s: %s", path, e)
+                _gallery = None
+        return _gallery
+
+
+def _gallery_dtype_code():
+    return 2 if getattr(settings, 'FACE_GALLERY_DTYPE', DEFAULT_GALLERY_DTYPE) == 'float16' else 1
+
+
+def _load_embeddings(user_ids=None):
+    """
+    Read the normalized embeddings of current-version templates
+
+    Only the leading EMBEDDING_PREFIX_BYTES of each template, which hold its
+    embedding section, are fetched from the database.
+
+    Args:
+        user_ids: Optional iterable restricting the rows to these users
+
+    Returns:
+        Tuple of (user_ids, angles, embeddings) lists ordered by user and angle
+    """
+    from django.db.models.functions import Substr
+    from .models import UserFaceImage
+
+    rows = (UserFaceImage.objects.exclude(template__isnull=True)
+            .filter(template_version=pipeline_version())
+            .annotate(template_head=Substr('template', 1, EMBEDDING_PREFIX_BYTES))
+            .order_by('user_id', 'angle_index'))
+    if user_ids is not None:
+        rows = rows.filter(user_id__in=list(user_ids))
+
+    found_user_ids, angles, embeddings = [], [], []
+    for user_id, angle_index, head in rows.values_list('user_id', 'angle_index', 'template_head').iterator():
+        embedding = template_embedding(head)
+        if embedding is None:
+            continue
+        norm = np.linalg.norm(embedding)
+        if not norm:
+            continue
+        found_user_ids.append(user_id)
+        angles.append(angle_index)
+        embeddings.append(embedding / norm)
+    return found_user_ids, angles, embeddings
+
+
+def _write_gallery(path, user_ids, angles, matrix, dtype_code):
+    """
+    Write a gallery file to a temporary name next to path and rename it into place
+
+    Readers therefore only ever map a complete gallery.
+    """
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    count, dim = matrix.shape
+
+    fd, temp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(_HEADER.pack(GALLERY_MAGIC, GALLERY_FORMAT_VERSION, count, dim, dtype_code, time.time_ns(),
+                                 pipeline_version().encode('ascii')))
+            for array in (np.asarray(user_ids, dtype=np.int64), np.asarray(angles, dtype=np.int32), matrix):
+                f.write(b'\0' * (-f.tell() % _ALIGNMENT))
+                f.write(np.ascontiguousarray(array).tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+        os.chmod(temp_path, 0o644)
+        os.replace(temp_path, path)
+    except Exception:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+def build_gallery(path=None):
+    """
+    Write the gallery file from every template embedding of the current pipeline
+
+    Returns:
+        Number of embeddings written
+    """
+    path = path or get_gallery_path()
+    dtype_code = _gallery_dtype_code()
+
+    user_ids, angles, embeddings = _load_embeddings()
+    dim = len(embeddings[0]) if embeddings else 0
+    matrix = np.asarray(embeddings, dtype=_DTYPES[dtype_code]).reshape(len(embeddings), dim)
+    _write_gallery(path, user_ids, angles, matrix, dtype_code)
+
+    logger.info("Built face gallery %s with %d embeddings", path, len(user_ids))
+    return len(user_ids)
+
+
+def update_gallery(user_ids, path=None):
+    """
+    Replace the gallery rows of some users, keeping everyone else's as stored
+
+    Only the changed users' templates are read. Falls back to build_gallery
+    when there is no usable gallery of the current pipeline version and
+    storage dtype, or the embedding dimension changed.
+
+    Returns:
+        Number of embeddings in the new gallery
+    """
+    path = path or get_gallery_path()
+    dtype_code = _gallery_dtype_code()
+    try:
+        gallery = FaceGallery(path)
+    except (OSError, ValueError):
+        return build_gallery(path)
+    if gallery.pipeline_version != pipeline_version() or gallery.dtype_code != dtype_code:
+        return build_gallery(path)
+
+    changed = np.asarray(sorted(set(user_ids)), dtype=np.int64)
+    new_user_ids, new_angles, new_embeddings = _load_embeddings(changed.tolist())
+    dim = len(new_embeddings[0]) if new_embeddings else gallery.dim
+    if gallery.count and dim != gallery.dim:
+        return build_gallery(path)
+
+    keep = ~np.isin(gallery.user_ids, changed)
+    user_ids = np.concatenate([gallery.user_ids[keep], np.asarray(new_user_ids, dtype=np.int64)])
+    angles = np.concatenate([gallery.angles[keep], np.asarray(new_angles, dtype=np.int32)])
+    matrix = np.concatenate([
+        gallery.matrix[keep],
+        np.asarray(new_embeddings, dtype=_DTYPES[dtype_code]).reshape(len(new_embeddings), dim),
+    ])
+    # Rows stay sorted by user (then angle) for rank_user_references' binary search
+    order = np.lexsort((angles, user_ids))
+    _write_gallery(path, user_ids[order], angles[order], matrix[order], dtype_code)
+
+    logger.info("Updated face gallery %s for %d user(s), %d embeddings", path, len(changed), len(order))
+    return len(order)
+
+
+def rebuild_gallery(user_ids=None):
+    """
+    build_gallery(), or update_gallery(user_ids) when given, serialized
+    across processes by an exclusive file lock
+    """
+    path = get_gallery_path()
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(f'{path}.lock', 'a') as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            if user_ids is not None:
+                return update_gallery(user_ids, path)
+            return build_gallery(path)
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+_rebuild_timer = None
+# Users whose rows the scheduled rebuild updates; None means a full build
+_rebuild_users = set()
+_rebuild_lock = threading.Lock()
+
+
+def _run_scheduled_rebuild():
+    global _rebuild_timer, _rebuild_users
+    from django.db import close_old_connections
+
+    with _rebuild_lock:
+        _rebuild_timer = None
+        user_ids, _rebuild_users = _rebuild_users, set()
+    close_old_connections()
+    try:
+        rebuild_gallery(user_ids)
+    except Exception as e:
+        logger.error("Could not rebuild face gallery: %s", e)
+    finally:
+        close_old_connections()
+
+
+def schedule_gallery_rebuild(user_id=None):
+    """
+    Update the gallery in the background, coalescing changes within FACE_GALLERY_REBUILD_DELAY
+
+    Args:
+        user_id: The user whose enrollment changed; only their rows are
+            re-read. Without it the whole gallery is rebuilt.
+    """
+    global _rebuild_timer, _rebuild_users
+    if not gallery_enabled():
+        return
+    with _rebuild_lock:
+        if user_id is None:
+            _rebuild_users = None
+        elif _rebuild_users is not None:
+            _rebuild_users.add(user_id)
+        if _rebuild_timer is not None:
+            return
+        delay = getattr(settings, 'FACE_GALLERY_REBUILD_DELAY', DEFAULT_GALLERY_REBUILD_DELAY)
+        _rebuild_timer = threading.Timer(delay, _run_scheduled_rebuild)
+        _rebuild_timer.daemon = True
+        _rebuild_timer.start()
@@ -0,0 +1,264 @@
+import json
+import logging
+import os
+import queue
+import socket
+import threading
+import time
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import Q
+from django.utils import timezone
+from rest_framework.utils.encoders import JSONEncoder
+
+from .face_checkin import CheckInError, verify_probe_frames
+from .models import Attendance, FaceVerificationJob, current_job_owner
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_VERIFICATION_QUEUE_SIZE = 100
+# Upper bound for ?wait= on the job status endpoint, in seconds
+DEFAULT_VERIFICATION_MAX_WAIT = 25
+# Unfinished jobs older than this are reported as lost (e.g. after a restart)
+DEFAULT_VERIFICATION_JOB_TIMEOUT = 300
+
+# Face check-ins whose deferred verification has not completed: left out of
+# attendance lists, summaries and check-out until the job settles them
+PENDING_FACE_CHECKIN = Q(verification_method='FACE_GPS', is_verified=False)
+
+LOST_JOB_RESULT = {'error': 'Face verification did not complete. Please check in again.'}
+
+_queue = None
+_workers = []
+_start_lock = threading.Lock()
+# Notified whenever a worker in this process finishes a job
+_job_finished = threading.Condition()
+
+
+class VerificationQueueFull(Exception):
+    """Raised when the local verification queue cannot take another job"""
+
+
+def _get_queue():
+    """
+    Return the process-wide job queue, starting its worker threads on first use
+
+    Starting the queue first expires the jobs an earlier process on this
+    host left unfinished.
+    """
+    global _queue
+    with _start_lock:
+        if _queue is None:
+            try:
+                expire_orphaned_jobs()
+            except Exception as e:
+                logger.error("Could not expire orphaned face verification jobs: %s", e)
+            size = getattr(settings, 'FACE_VERIFICATION_QUEUE_SIZE', DEFAULT_VERIFICATION_QUEUE_SIZE)
+            _queue = queue.Queue(maxsize=size)
+            workers = getattr(settings, 'FACE_VERIFICATION_WORKERS', None) or 1
+            for index in range(workers):
+                worker = threading.Thread(target=_worker_loop, name=f'face-verify-job-{index}', daemon=True)
+                worker.start()
+                _workers.append(worker)
+        return _queue
+
+
+def submit_verification_job(job, face_images, reference_images, profile_face_image_name=None, profile_template=None):
+    """
+    Queue face verification for a pending check-in
+
+    face_images are the frames chosen by select_probe_frames. They are held
+    in memory by the queue, so jobs do not survive a process restart; the
+    job's owner records the process, and jobs it left unfinished are
+    expired (expire_orphaned_jobs, expire_lost_job).
+
+    Raises:
+        VerificationQueueFull: If FACE_VERIFICATION_QUEUE_SIZE jobs are already waiting
+    """
+    try:
+        _get_queue().put_nowait((job.pk, face_images, reference_images, profile_face_image_name, profile_template))
+    except queue.Full:
+        raise VerificationQueueFull('Face verification queue is full')
+
+
+def _worker_loop():
+    while True:
+        job_id, face_images, reference_images, profile_face_image_name, profile_template = _queue.get()
+        close_old_connections()
+        try:
+            process_verification_job(job_id, face_images, reference_images, profile_face_image_name, profile_template)
+        except Exception as e:
+            logger.error("Face verification job %s crashed: %s", job_id, e)
+        finally:
+            close_old_connections()
+            _queue.task_done()
+            with _job_finished:
+                _job_finished.notify_all()
+
+
+def _json_safe(data):
+    """Convert numpy scalars in a verification result to plain JSON types"""
+    return json.loads(json.dumps(data, cls=JSONEncoder))
+
+
+def process_verification_job(job_id, face_images, reference_images, profile_face_image_name=None,
+                             profile_template=None):
+    """
+    Run the verification for one job and settle its attendance record
+
+    A match marks the attendance verified; a mismatch deletes the pending
+    attendance, so the outcome matches a synchronous check-in.
+    """
+    updated = FaceVerificationJob.objects.filter(
+        pk=job_id, status=FaceVerificationJob.STATUS_PENDING
+    ).update(status=FaceVerificationJob.STATUS_RUNNING)
+    if not updated:
+        return
+
+    job = FaceVerificationJob.objects.select_related('user').get(pk=job_id)
+    try:
+        verification_result = verify_probe_frames(
+            face_images, reference_images, profile_face_image_name, user=job.user, source='deferred',
+            profile_template=profile_template
+        )
+        status, result = FaceVerificationJob.STATUS_VERIFIED, verification_result
+    except CheckInError as e:
+        status, result = FaceVerificationJob.STATUS_FAILED, e.payload
+    except Exception as e:
+        logger.error("Error verifying face for job %s: %s", job_id, e)
+        status, result = FaceVerificationJob.STATUS_ERROR, {'error': 'Face verification could not be completed.'}
+
+    with transaction.atomic():
+        # A job expired while it ran keeps its error; its attendance is already gone
+        settled = FaceVerificationJob.objects.filter(
+            pk=job_id, status=FaceVerificationJob.STATUS_RUNNING
+        ).update(
+            status=status,
+            result=_json_safe(result),
+            completed_at=timezone.now(),
+            **({} if status == FaceVerificationJob.STATUS_VERIFIED else {'attendance': None})
+        )
+        if settled and job.attendance_id is not None:
+            if status == FaceVerificationJob.STATUS_VERIFIED:
+                Attendance.objects.filter(pk=job.attendance_id).update(is_verified=True)
+            else:
+                Attendance.objects.filter(pk=job.attendance_id).delete()
+
+
+def get_job_status(job_id, wait=0, queryset=None):
+    """
+    Fetch a job, optionally long-polling until it finishes
+
+    Waits are woken by workers in this process; jobs handled by another
+    process are picked up by re-reading the row once a second.
+
+    Args:
+        job_id: FaceVerificationJob primary key
+        wait: Seconds to wait for a final status (capped at FACE_VERIFICATION_MAX_WAIT)
+        queryset: Jobs the caller may see (defaults to all jobs)
+
+    Returns:
+        FaceVerificationJob instance
+    """
+    max_wait = getattr(settings, 'FACE_VERIFICATION_MAX_WAIT', DEFAULT_VERIFICATION_MAX_WAIT)
+    deadline = time.monotonic() + max(0, min(wait, max_wait))
+
+    if queryset is None:
+        queryset = FaceVerificationJob.objects.all()
+    job = queryset.select_related('attendance__location', 'attendance__user').get(pk=job_id)
+    while not job.is_finished:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        with _job_finished:
+            _job_finished.wait(timeout=min(remaining, 1.0))
+        job.refresh_from_db()
+
+    if not job.is_finished:
+        expire_lost_job(job)
+    return job
+
+
+def _expire_jobs(job_ids):
+    """
+    Mark unfinished jobs as errors and delete their pending attendance
+
+    Returns:
+        Number of jobs expired
+    """
+    with transaction.atomic():
+        jobs = FaceVerificationJob.objects.select_for_update().filter(
+            pk__in=list(job_ids), status__in=FaceVerificationJob.UNFINISHED_STATUSES
+        )
+        attendance_ids = [pk for pk in jobs.values_list('attendance_id', flat=True) if pk is not None]
+        expired = jobs.update(
+            attendance=None,
+            status=FaceVerificationJob.STATUS_ERROR,
+            result=LOST_JOB_RESULT,
+            completed_at=timezone.now()
+        )
+        Attendance.objects.filter(pk__in=attendance_ids, is_verified=False).delete()
+    return expired
+
+
+def _is_orphaned(owner):
+    """
+    Whether the process that queued a job is known to be gone
+
+    Only owners on this host can be checked: the owner is this pid with an
+    older start nonce (a restarted container), or a pid that no longer runs.
+    """
+    host, _, rest = owner.partition(':')
+    pid, _, _ = rest.partition(':')
+    if owner == current_job_owner() or host != socket.gethostname() or not pid.isdigit():
+        return False
+    if int(pid) == os.getpid():
+        return True
+    if os.name != 'posix':
+        return False
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return True
+    except PermissionError:
+        pass
+    return False
+
+
+def expire_orphaned_jobs():
+    """
+    Expire the unfinished jobs of earlier processes on this host
+
+    Their frames were only in that process's memory, so they can never
+    finish; PENDING and RUNNING jobs alike are expired and their pending
+    attendance deleted. Jobs of live sibling processes are left alone.
+
+    Returns:
+        Number of jobs expired
+    """
+    host_prefix = f'{socket.gethostname()}:'
+    jobs = FaceVerificationJob.objects.filter(
+        status__in=FaceVerificationJob.UNFINISHED_STATUSES, owner__startswith=host_prefix
+    ).values_list('pk', 'owner')
+    orphaned = [pk for pk, owner in jobs if _is_orphaned(owner)]
+    expired = _expire_jobs(orphaned) if orphaned else 0
+    if expired:
+        logger.warning("Expired %d face verification job(s) left by a previous process", expired)
+    return expired
+
+
+def expire_lost_job(job):
+    """
+    Expire an unfinished job that cannot finish any more
+
+    That is one waiting or running for longer than
+    FACE_VERIFICATION_JOB_TIMEOUT, or one whose process is gone (see
+    expire_orphaned_jobs). Its pending attendance is deleted.
+    """
+    timeout = getattr(settings, 'FACE_VERIFICATION_JOB_TIMEOUT', DEFAULT_VERIFICATION_JOB_TIMEOUT)
+    timed_out = (timezone.now() - job.created_at).total_seconds() >= timeout
+    if not timed_out and not _is_orphaned(job.owner):
+        return
+    _expire_jobs([job.pk])
+    job.refresh_from_db()
@@ -0,0 +1,94 @@
+import contextvars
+import logging
+import random
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# Trace 1 in N verifications at DEBUG level (1 traces all of them, 0 none)
+DEFAULT_FACE_LOG_SAMPLE_RATE = 100
+
+# Random draw shared by every stage log of the current verification, so a
+# sampled verification is traced end to end instead of in fragments
+_trace_draw = contextvars.ContextVar('face_trace_draw', default=None)
+
+
+def get_sample_rate(stage):
+    """Sampling rate for a pipeline stage (FACE_LOG_SAMPLE_RATES overrides FACE_LOG_SAMPLE_RATE)"""
+    rates = getattr(settings, 'FACE_LOG_SAMPLE_RATES', {})
+    if stage in rates:
+        return rates[stage]
+    return getattr(settings, 'FACE_LOG_SAMPLE_RATE', DEFAULT_FACE_LOG_SAMPLE_RATE)
+
+
+def is_sampled(stage):
+    """Whether stage details of the current verification should be logged"""
+    rate = get_sample_rate(stage)
+    if not rate:
+        return False
+    draw = _trace_draw.get()
+    if draw is None:
+        draw = random.random()
+    return draw * rate < 1
+
+
+@contextmanager
+def verification_trace():
+    """Make all stage logs inside the block share one sampling decision"""
+    token = _trace_draw.set(random.random())
+    try:
+        yield
+    finally:
+        _trace_draw.reset(token)
+
+
+class StageLogger:
+    """
+    Logger wrapper for per-stage debug details of the face pipeline
+
+    Records are only built when DEBUG is enabled for the logger and the
+    stage is sampled, and use %-style arguments so nothing is formatted
+    for records that are dropped. The stage is attached as face_stage.
+    """
+
+    def __init__(self, logger):
+        self.logger = logger
+
+    def enabled(self, stage):
+        return self.logger.isEnabledFor(logging.DEBUG) and is_sampled(stage)
+
+    def debug(self, stage, msg, *args):
+        if self.enabled(stage):
+            self.logger.debug(msg, *args, extra={'face_stage': stage})
+
+
+def log_verification_summary(result, started, **fields):
+    """
+    Emit the single INFO event describing one face verification
+
+    Args:
+        result: Verification result dictionary (or None)
+        started: time.monotonic() value taken when verification began
+        **fields: Extra structured fields (user id, references tried, ...)
+    """
+    if not logger.isEnabledFor(logging.INFO):
+        return
+    result = result or {}
+    summary = {
+        'match': bool(result.get('match', False)),
+        'similarity': float(result.get('similarity', 0) or 0),
+        'confidence': float(result.get('confidence', 0) or 0),
+        'has_eyes': bool(result.get('has_eyes', False)),
+        'error': result.get('error'),
+        'duration_ms': round((time.monotonic() - started) * 1000, 1),
+    }
+    summary.update(fields)
+    logger.info(
+        'face_verification match=%s similarity=%.4f confidence=%.2f duration_ms=%.1f %s',
+        summary['match'], summary['similarity'], summary['confidence'], summary['duration_ms'],
+        ' '.join(f'{key}={value}' for key, value in fields.items()),
+        extra={'face_verification': summary}
+    )
@@ -0,0 +1,61 @@
+import os
+import time
+from collections import Counter
+
+from django.conf import settings
+
+from .models import UserProfile, UserFaceImage
+from .face_variants import FACE_VARIANTS_DIR
+
+# Directory (relative to MEDIA_ROOT) holding enrolled face images
+FACE_MEDIA_DIR = 'face_recognition'
+
+
+def face_media_reference_counts(names=None):
+    """
+    Count how many UserProfile.face_image / UserFaceImage.image rows reference each file
+
+    Args:
+        names: Optional iterable of storage names to restrict the lookup to
+
+    Returns:
+        Counter mapping storage name -> number of referencing rows
+    """
+    profiles = UserProfile.objects.exclude(face_image='').exclude(face_image__isnull=True)
+    face_images = UserFaceImage.objects.all()
+    if names is not None:
+        names = list(names)
+        profiles = profiles.filter(face_image__in=names)
+        face_images = face_images.filter(image__in=names)
+
+    counts = Counter(profiles.values_list('face_image', flat=True))
+    counts.update(face_images.values_list('image', flat=True))
+    return counts
+
+
+def iter_face_media_files(min_age=0):
+    """
+    Yield storage names of files under MEDIA_ROOT/face_recognition and
+    MEDIA_ROOT/face_variants
+
+    Hidden bookkeeping files (e.g. the sequence index) are skipped, as are
+    files modified less than min_age seconds ago, which may belong to an
+    upload whose row has not been committed yet.
+    """
+    cutoff = time.time() - min_age
+    for directory in (FACE_MEDIA_DIR, FACE_VARIANTS_DIR):
+        yield from _iter_files(os.path.join(settings.MEDIA_ROOT, directory), cutoff)
+
+
+def _iter_files(root, cutoff):
+    for dirpath, _, filenames in os.walk(root):
+        for filename in filenames:
+            if filename.startswith('.'):
+                continue
+            full_path = os.path.join(dirpath, filename)
+            try:
+                if os.path.getmtime(full_path) > cutoff:
+                    continue
+            except OSError:
+                continue
+            yield os.path.relpath(full_path, settings.MEDIA_ROOT).replace(os.sep, '/')
@@ -0,0 +1,133 @@
+import logging
+import time
+
+import cv2
+import numpy as np
+from django.conf import settings
+
+from .face_recognition_utils import get_pipeline_context
+
+logger = logging.getLogger(__name__)
+
+# Longest side of the frame the quality checks run on
+DEFAULT_QUALITY_MAX_SIDE = 320
+# Mean brightness (0-255) of the face, or of the frame when no face is found
+DEFAULT_QUALITY_MIN_BRIGHTNESS = 40
+DEFAULT_QUALITY_MAX_BRIGHTNESS = 220
+# Laplacian variance of the face region at the downscaled size
+DEFAULT_QUALITY_MIN_SHARPNESS = 20.0
+# Face width as a fraction of the frame width
+DEFAULT_QUALITY_MIN_FACE_RATIO = 0.12
+
+QUALITY_REASONS = {
+    'no_face': 'No face found. Look straight at the camera with your whole face in the frame.',
+    'too_small': 'Your face is too small in the picture. Move closer to the camera.',
+    'too_dark': 'The picture is too dark. Move to a brighter place or face the light.',
+    'too_bright': 'The picture is overexposed. Avoid strong light shining directly on your face.',
+    'blurry': 'The picture is blurry. Hold the phone steady and try again.',
+    'unreadable': 'The image could not be read. Please take the picture again.',
+}
+
+
+def _to_bgr(image_file):
+    """Pixels of a DecodedImage, uploaded file or path as a BGR array"""
+    if hasattr(image_file, 'bgr'):
+        return image_file.bgr
+    if isinstance(image_file, str):
+        return cv2.imread(image_file)
+    if hasattr(image_file, 'seek'):
+        image_file.seek(0)
+    data = image_file.read()
+    if hasattr(image_file, 'seek'):
+        image_file.seek(0)
+    return cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+
+
+def assess_probe_quality(image_file):
+    """
+    Cheap pre-check of a face photo before the full recognition pipeline
+
+    Works on a grayscale copy downscaled to FACE_QUALITY_MAX_SIDE: a single
+    Haar pass for face presence and size, then mean brightness and Laplacian
+    variance over the face region. Takes a few milliseconds, against the
+    hundreds spent by detection, SIFT and FaceNet on an unusable photo.
+
+    Args:
+        image_file: DecodedImage, uploaded file or image path
+
+    Returns:
+        dict with 'passed', 'code' and 'reason' (None when passed) and 'metrics'
+    """
+    started = time.monotonic()
+    metrics = {}
+
+    def result(code):
+        metrics['duration_ms'] = round((time.monotonic() - started) * 1000, 1)
+        return {
+            'passed': code is None,
+            'code': code,
+            'reason': QUALITY_REASONS.get(code),
+            'metrics': metrics,
+        }
+
+    image = _to_bgr(image_file)
+    if image is None or image.size == 0:
+        return result('unreadable')
+
+    height, width = image.shape[:2]
+    max_side = getattr(settings, 'FACE_QUALITY_MAX_SIDE', DEFAULT_QUALITY_MAX_SIDE)
+    scale = min(1.0, max_side / float(max(height, width)))
+    if scale < 1.0:
+        image = cv2.resize(image, (max(1, int(width * scale)), max(1, int(height * scale))), interpolation=cv2.INTER_AREA)
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+
+    region = gray
+    cascade = get_pipeline_context().face_cascade
+    if cascade is not None:
+        faces = cascade.detectMultiScale(gray, scaleFactor=1.2, minNeighbors=3, minSize=(24, 24))
+        if len(faces) == 0:
+            return result('no_face')
+        x, y, w, h = max(faces, key=lambda face: face[2] * face[3])
+        metrics['face_ratio'] = round(w / float(gray.shape[1]), 3)
+        if metrics['face_ratio'] < getattr(settings, 'FACE_QUALITY_MIN_FACE_RATIO', DEFAULT_QUALITY_MIN_FACE_RATIO):
+            return result('too_small')
+        region = gray[y:y + h, x:x + w]
+
+    metrics['brightness'] = round(float(region.mean()), 1)
+    if metrics['brightness'] < getattr(settings, 'FACE_QUALITY_MIN_BRIGHTNESS', DEFAULT_QUALITY_MIN_BRIGHTNESS):
+        return result('too_dark')
+    if metrics['brightness'] > getattr(settings, 'FACE_QUALITY_MAX_BRIGHTNESS', DEFAULT_QUALITY_MAX_BRIGHTNESS):
+        return result('too_bright')
+
+    metrics['sharpness'] = round(float(cv2.Laplacian(region, cv2.CV_64F).var()), 1)
+    if metrics['sharpness'] < getattr(settings, 'FACE_QUALITY_MIN_SHARPNESS', DEFAULT_QUALITY_MIN_SHARPNESS):
+        return result('blurry')
+
+    return result(None)
+
+
+def frame_score(assessment):
+    """Rank key of an assessed frame: passing frames first, then larger and sharper faces"""
+    if assessment is None:
+        return (1, 0.0)
+    if not assessment['passed']:
+        return (0, 0.0)
+    metrics = assessment['metrics']
+    return (2, metrics.get('sharpness', 0.0) * metrics.get('face_ratio', 1.0))
+
+
+def quality_gate(image_file):
+    """
+    Run assess_probe_quality if FACE_QUALITY_ENABLED
+
+    Returns:
+        The assessment dict, or None when the gate is disabled or errored
+        (an error never blocks the full pipeline)
+    """
+    if not getattr(settings, 'FACE_QUALITY_ENABLED', True):
+        return None
+    try:
+        return assess_probe_quality(image_file)
+    except Exception as e:
+        logger.warning("Face quality check failed: %s", e)
+        return None
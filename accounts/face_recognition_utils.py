@@ -1,35 +1,58 @@
 import cv2
 import numpy as np
 import os
-from PIL import Image
 import io
 import logging
+import threading
 from django.conf import settings
 
+from .face_detection import detect_faces_haar
+from .face_embedders import load_embedder, prepare_facenet_batch, set_active_weights
+from .face_encoding_cache import cached_face_encoding
+from .face_logging import StageLogger
+from .face_runtime import configure_native_threads
+
 # Set up logging
 logger = logging.getLogger(__name__)
+# Per-stage DEBUG details, sampled by FACE_LOG_SAMPLE_RATE(S)
+trace = StageLogger(logger)
+
+# Load FaceNet for deep learning-based face embeddings, through the backend
+# selected by FACENET_BACKEND (eager PyTorch, TorchScript or ONNX Runtime)
+def _load_facenet():
+    """
+    load_embedder() for FACENET_BACKEND, falling back to eager PyTorch
+
+    A missing export or runtime for the 'torchscript' or 'onnx' backend is
+    logged as an error and the eager model is used instead, so FaceNet is
+    not silently dropped from the pipeline.
+    """
+    backend = getattr(settings, 'FACENET_BACKEND', 'torch')
+    try:
+        return load_embedder(backend)
+    except Exception as e:
+        if backend == 'torch':
+            raise
+        logger.error("Could not load the %s FaceNet backend, falling back to eager PyTorch: %s", backend, e)
+        return load_embedder('torch')
 
-# Import FaceNet for deep learning-based face embeddings
 has_facenet = False
 facenet_model = None
+facenet_embedder = None
 try:
-    import torch
-    from facenet_pytorch import InceptionResnetV1
-    # Initialize FaceNet model
-    try:
-        # Use VGGFace2 pretrained model for better performance
-        facenet_model = InceptionResnetV1(pretrained='vggface2').eval()
-        has_facenet = True
-        logger.info("FaceNet model loaded successfully")
-    except Exception as e:
-        logger.warning(f"Error loading FaceNet model: {str(e)}")
-        has_facenet = False
+    facenet_embedder = _load_facenet()
+    # The eager module, when running the 'torch' backend
+    facenet_model = getattr(facenet_embedder, 'model', None)
+    has_facenet = True
+    logger.info("FaceNet model loaded successfully (%s backend)", facenet_embedder.name)
 except ImportError:
     logger.warning("FaceNet not available, will use traditional methods")
     has_facenet = False
 except Exception as e:
-    logger.error(f"Unexpected error during FaceNet import: {str(e)}")
+    logger.error("Error loading FaceNet model: %s", e)
     has_facenet = False
+# Templates made with other weights, or without FaceNet, get another pipeline_version
+set_active_weights(facenet_embedder.weights if has_facenet else 'none')
 
 # Import RetinaFace for improved face detection
 try:
@@ -42,13 +65,13 @@ try:
             has_retinaface = True
             logger.info("RetinaFace imported successfully")
         except ImportError as e:
-            logger.warning(f"Error importing RetinaFace: {str(e)}")
+            logger.warning("Error importing RetinaFace: %s", e)
             has_retinaface = False
     except ImportError:
         logger.warning("TensorFlow not available, skipping RetinaFace import")
         has_retinaface = False
 except Exception as e:
-    logger.error(f"Unexpected error during imports: {str(e)}")
+    logger.error("Unexpected error during imports: %s", e)
     has_retinaface = False
 
 # Initialize RetinaFace detector
@@ -59,19 +82,61 @@ if has_retinaface:
         retinaface_detector = RetinaFace
         logger.info("RetinaFace detector initialized successfully")
     except Exception as e:
-        logger.error(f"Error initializing RetinaFace detector: {str(e)}")
+        logger.error("Error initializing RetinaFace detector: %s", e)
         has_retinaface = False
 
+# Size OpenCV/PyTorch/TensorFlow thread pools before any inference runs
+configure_native_threads()
+
+def _load_cascade(filename):
+    """Load one of OpenCV's bundled Haar cascades"""
+    return cv2.CascadeClassifier(cv2.data.haarcascades + filename)
+
+def _create_feature_detector():
+    """
+    Create a SIFT detector, falling back to ORB
+    
+    SIFT might be in different places depending on OpenCV version.
+    
+    Returns:
+        Detector instance or None if neither is available
+    """
+    try:
+        if hasattr(cv2, 'SIFT_create'):  # OpenCV 4.x+
+            return cv2.SIFT_create()
+        elif hasattr(cv2, 'xfeatures2d') and hasattr(cv2.xfeatures2d, 'SIFT_create'):  # OpenCV 3.x with contrib
+            return cv2.xfeatures2d.SIFT_create()
+        elif hasattr(cv2, 'SIFT'):  # Very old OpenCV
+            return cv2.SIFT()
+    except Exception as sift_err:
+        logger.warning("SIFT not available: %s", sift_err)
+    # Fallback to ORB which is always available
+    try:
+        return cv2.ORB_create()
+    except Exception as orb_err:
+        logger.warning("ORB also not available: %s", orb_err)
+    return None
+
+def _create_matcher(detector):
+    """Brute-force matcher suited to the descriptors of detector"""
+    try:
+        # For ORB, use HAMMING distance, for SIFT/SURF use NORM_L2
+        norm_type = cv2.NORM_HAMMING if isinstance(detector, cv2.ORB) else cv2.NORM_L2
+        return cv2.BFMatcher(norm_type, crossCheck=False)
+    except Exception as matcher_err:
+        logger.warning("Could not create feature matcher: %s", matcher_err)
+        return None
+
 # Load the face cascade classifiers as fallback detection
 try:
     # Primary face detector (fallback if RetinaFace fails)
-    face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
+    face_cascade = _load_cascade('haarcascade_frontalface_default.xml')
     
     # Additional face detector for better accuracy (fallback)
-    face_cascade_alt = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_alt2.xml')
+    face_cascade_alt = _load_cascade('haarcascade_frontalface_alt2.xml')
     
     # Eye detection for additional verification
-    eye_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_eye.xml')
+    eye_cascade = _load_cascade('haarcascade_eye.xml')
     
     # Check if face module is available
     has_face_module = False
@@ -97,83 +162,185 @@ try:
             elif hasattr(cv2.face, 'createLBPHFaceRecognizer'):  # Older OpenCV versions
                 face_recognizer = cv2.face.createLBPHFaceRecognizer()
         except Exception as face_err:
-            logger.warning(f"Could not create face recognizer: {str(face_err)}")
+            logger.warning("Could not create face recognizer: %s", face_err)
     
-    # Check for SIFT availability - it might be in different places depending on OpenCV version
-    has_sift = False
-    sift = None
-    try:
-        if hasattr(cv2, 'SIFT_create'):  # OpenCV 4.x+
-            sift = cv2.SIFT_create()
-            has_sift = True
-        elif hasattr(cv2, 'xfeatures2d') and hasattr(cv2.xfeatures2d, 'SIFT_create'):  # OpenCV 3.x with contrib
-            sift = cv2.xfeatures2d.SIFT_create()
-            has_sift = True
-        elif hasattr(cv2, 'SIFT'):  # Very old OpenCV
-            sift = cv2.SIFT()
-            has_sift = True
-    except Exception as sift_err:
-        logger.warning(f"SIFT not available: {str(sift_err)}")
-        # Fallback to ORB which is always available
-        try:
-            sift = cv2.ORB_create()
-            has_sift = True
-            logger.info("Using ORB instead of SIFT for feature detection")
-        except Exception as orb_err:
-            logger.warning(f"ORB also not available: {str(orb_err)}")
-    
-    # Feature matching
-    bf_matcher = None
-    if has_sift:
-        try:
-            # For ORB, use HAMMING distance, for SIFT/SURF use NORM_L2
-            norm_type = cv2.NORM_HAMMING if isinstance(sift, cv2.ORB) else cv2.NORM_L2
-            bf_matcher = cv2.BFMatcher(norm_type, crossCheck=False)
-        except Exception as matcher_err:
-            logger.warning(f"Could not create feature matcher: {str(matcher_err)}")
+    # Feature detection (SIFT or ORB) and matching
+    sift = _create_feature_detector()
+    has_sift = sift is not None
+    if isinstance(sift, cv2.ORB):
+        logger.info("Using ORB instead of SIFT for feature detection")
+    bf_matcher = _create_matcher(sift) if has_sift else None
     
     logger.info("Face detection components loaded successfully")
-    logger.info(f"RetinaFace available: {has_retinaface}, SIFT available: {has_sift}, Face recognizer available: {face_recognizer is not None}")
+    logger.info("RetinaFace available: %s, SIFT available: %s, Face recognizer available: %s",
+                has_retinaface, has_sift, face_recognizer is not None)
     
 except Exception as e:
-    logger.error(f"Error loading face detection components: {str(e)}")
+    logger.error("Error loading face detection components: %s", e)
     face_cascade = None
     face_cascade_alt = None
     eye_cascade = None
     face_recognizer = None
+    has_sift = False
     sift = None
     bf_matcher = None
+
+class PipelineContext(threading.local):
+    """
+    Per-thread OpenCV objects reused across calls
+    
+    CLAHE, the SIFT/ORB detector, the matcher and the cascade classifiers
+    keep internal state and are not safe to share between threads, so each
+    worker thread builds its own set the first time it runs the pipeline
+    instead of sharing the module-level objects or rebuilding them per call.
+    The module-level objects above only record what is available.
+    """
+    
+    def __init__(self):
+        self.clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8))
+        self.face_cascade = _load_cascade('haarcascade_frontalface_default.xml') if face_cascade is not None else None
+        self.face_cascade_alt = _load_cascade('haarcascade_frontalface_alt2.xml') if face_cascade_alt is not None else None
+        self.eye_cascade = _load_cascade('haarcascade_eye.xml') if eye_cascade is not None else None
+        self.sift = _create_feature_detector() if sift is not None else None
+        self.bf_matcher = _create_matcher(self.sift) if self.sift is not None and bf_matcher is not None else None
+
+_pipeline_context = PipelineContext()
+
+def get_pipeline_context():
+    """Return the calling thread's PipelineContext"""
+    return _pipeline_context
+
+# RetinaFace builds its TensorFlow model on first use; building it from
+# several threads at once is not safe, so it is built once under a lock
+_retinaface_model = None
+_retinaface_lock = threading.Lock()
+
+def get_retinaface_model():
+    """Return the shared RetinaFace model, building it on first use"""
+    global _retinaface_model
+    if _retinaface_model is None:
+        with _retinaface_lock:
+            if _retinaface_model is None and hasattr(retinaface_detector, 'build_model'):
+                _retinaface_model = retinaface_detector.build_model()
+    return _retinaface_model
+
+# Edge-preserving smoothing of the fast preprocessing: a self-guided filter
+# (He et al.) over luminance, its coefficients computed at 1/GUIDED_SUBSAMPLE
+# resolution. GUIDED_RADIUS and GUIDED_EPS (on a 0-1 intensity scale) give
+# about the smoothing of the legacy 9x9 bilateral filter.
+GUIDED_RADIUS = 4
+GUIDED_EPS = 0.01
+GUIDED_SUBSAMPLE = 2
+
+def guided_smooth(channel, radius=GUIDED_RADIUS, eps=GUIDED_EPS, subsample=GUIDED_SUBSAMPLE):
+    """
+    Fast self-guided filter of a single 8-bit channel
+    
+    Box filters only, so the cost does not depend on the radius, and the
+    local linear coefficients are computed on a downsampled copy and
+    upsampled, which keeps full-resolution edges.
+    
+    Returns:
+        Smoothed uint8 channel of the same size
+    """
+    height, width = channel.shape[:2]
+    guide = channel.astype(np.float32) * (1.0 / 255.0)
+    if subsample > 1 and min(height, width) >= 4 * subsample:
+        small = cv2.resize(guide, (width // subsample, height // subsample), interpolation=cv2.INTER_AREA)
+        radius = max(1, radius // subsample)
+    else:
+        small = guide
+    window = (2 * radius + 1, 2 * radius + 1)
     
+    mean = cv2.boxFilter(small, -1, window)
+    variance = cv2.boxFilter(small * small, -1, window)
+    variance -= mean * mean
+    a = variance / (variance + eps)
+    b = mean - a * mean
+    a = cv2.boxFilter(a, -1, window)
+    b = cv2.boxFilter(b, -1, window)
+    
+    if small is not guide:
+        a = cv2.resize(a, (width, height), interpolation=cv2.INTER_LINEAR)
+        b = cv2.resize(b, (width, height), interpolation=cv2.INTER_LINEAR)
+    smoothed = a * guide + b
+    return cv2.convertScaleAbs(smoothed, alpha=255.0)
 
 def preprocess_image(image):
     """
     Enhanced image preprocessing for better face recognition results
     
+    Works on luminance only: one BGR->YCrCb conversion, CLAHE and a fast
+    guided filter on the Y channel, and one conversion back. Chroma carries
+    little of the noise the smoothing is for. Used when FACE_PREPROCESSING
+    is 'fast'; the default, 'legacy', runs preprocess_image_legacy instead.
+    
     Args:
         image: OpenCV image array
         
     Returns:
         Preprocessed image ready for face detection/recognition
     """
+    if getattr(settings, 'FACE_PREPROCESSING', 'legacy') == 'legacy':
+        return preprocess_image_legacy(image)
+    
     try:
         # Check if image is valid
         if image is None or image.size == 0:
             logger.error("Invalid image in preprocess_image")
             return image
+        
+        # One CLAHE instance per thread
+        clahe = get_pipeline_context().clahe
+        
+        if image.ndim == 2:
+            return guided_smooth(clahe.apply(image))
+        
+        # The conversion allocates the working buffer; the channel is
+        # written back into it in place
+        ycrcb = cv2.cvtColor(image, cv2.COLOR_BGR2YCrCb)
+        luma = guided_smooth(clahe.apply(cv2.extractChannel(ycrcb, 0)))
+        cv2.insertChannel(luma, ycrcb, 0)
+        return cv2.cvtColor(ycrcb, cv2.COLOR_YCrCb2BGR)
+        
+    except Exception as e:
+        logger.error("Error in preprocess_image: %s", e)
+        # Return original image if preprocessing fails
+        return image
+
+def preprocess_image_legacy(image):
+    """
+    Original preprocessing: CLAHE in YUV, a full-resolution 9x9 bilateral
+    filter on all channels, then CLAHE again in LAB
+    
+    The default (FACE_PREPROCESSING = 'legacy') until benchmark_preprocessing
+    shows the fast variant is at least as accurate.
+    
+    Args:
+        image: OpenCV image array
+        
+    Returns:
+        Preprocessed image ready for face detection/recognition
+    """
+    try:
+        # Check if image is valid
+        if image is None or image.size == 0:
+            logger.error("Invalid image in preprocess_image_legacy")
+            return image
             
         # Make a copy to avoid modifying the original
         img_copy = image.copy()
         
+        # Use CLAHE instead of simple histogram equalization (one instance per thread)
+        clahe = get_pipeline_context().clahe
+        
         # 1. Convert to YUV color space and equalize the Y channel (luminance)
         if len(img_copy.shape) == 3 and img_copy.shape[2] == 3:
             img_yuv = cv2.cvtColor(img_copy, cv2.COLOR_BGR2YUV)
-            # Use CLAHE instead of simple histogram equalization
-            clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8))
             img_yuv[:,:,0] = clahe.apply(img_yuv[:,:,0])
             img_enhanced = cv2.cvtColor(img_yuv, cv2.COLOR_YUV2BGR)
         else:
             # For grayscale images
-            clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8))
             img_enhanced = clahe.apply(img_copy)
         
         # 2. Apply bilateral filter to reduce noise while preserving edges
@@ -197,7 +364,7 @@ def preprocess_image(image):
         return img_enhanced
         
     except Exception as e:
-        logger.error(f"Error in preprocess_image: {str(e)}")
+        logger.error("Error in preprocess_image_legacy: %s", e)
         # Return original image if preprocessing fails
         return image
 
@@ -206,78 +373,164 @@ def get_facenet_embedding(face_img):
     Generate a 512-dimensional face embedding using FaceNet
     
     Args:
-        face_img: Face image array (RGB format)
+        face_img: Face image array (OpenCV BGR or grayscale)
         
     Returns:
         512-dimensional embedding vector or None if failed
     """
-    if not has_facenet or facenet_model is None:
+    if not has_facenet or facenet_embedder is None:
         logger.warning("FaceNet model not available for embedding generation")
         return None
         
     try:
-        # Convert OpenCV BGR to RGB if needed
-        if len(face_img.shape) == 3 and face_img.shape[2] == 3:
-            # Check if image is BGR (OpenCV default) and convert to RGB for PyTorch
-            rgb_img = cv2.cvtColor(face_img, cv2.COLOR_BGR2RGB)
-        else:
-            # If grayscale, convert to 3-channel RGB
-            if len(face_img.shape) == 2:
-                rgb_img = cv2.cvtColor(face_img, cv2.COLOR_GRAY2RGB)
-            else:
-                rgb_img = face_img
-        
-        # Resize to 160x160 (FaceNet's expected input size)
-        resized_img = cv2.resize(rgb_img, (160, 160))
-        
-        # Convert to PIL Image
-        pil_img = Image.fromarray(resized_img)
+        # Resize to 160x160, scale to [0, 1] and lay out as [B, C, H, W]
+        batch = prepare_facenet_batch([facenet_rgb(face_img)])
         
-        # Convert to PyTorch tensor and normalize
-        img_tensor = torch.from_numpy(np.array(pil_img)).float()
-        # Add batch dimension and transpose to [B, C, H, W]
-        img_tensor = img_tensor.permute(2, 0, 1).unsqueeze(0)
-        # Normalize pixel values to [0, 1]
-        img_tensor = img_tensor / 255.0
+        # Get embedding and drop the batch dimension
+        embedding_np = facenet_embedder.embed(batch)[0]
         
-        # Get embedding
-        with torch.no_grad():
-            embedding = facenet_model(img_tensor)
-            
-        # Convert to numpy array for easier handling
-        embedding_np = embedding.squeeze().cpu().numpy()
-        
-        logger.info(f"Generated FaceNet embedding with shape: {embedding_np.shape}")
+        trace.debug('embedding', "Generated FaceNet embedding with shape: %s", embedding_np.shape)
         return embedding_np
         
     except Exception as e:
-        logger.error(f"Error generating FaceNet embedding: {str(e)}")
+        logger.error("Error generating FaceNet embedding: %s", e)
         return None
 
+def facenet_rgb(face_img):
+    """Face crop as FaceNet expects it: RGB from an OpenCV BGR or grayscale image"""
+    if len(face_img.shape) == 3 and face_img.shape[2] == 3:
+        # OpenCV images are BGR
+        return cv2.cvtColor(face_img, cv2.COLOR_BGR2RGB)
+    if len(face_img.shape) == 2:
+        return cv2.cvtColor(face_img, cv2.COLOR_GRAY2RGB)
+    return face_img
+
+# Canonical eye positions, as fractions of the aligned crop, chosen to match
+# where the eyes sit in the 20%-extended detection box of a frontal face
+ALIGNED_LEFT_EYE = (0.355, 0.43)
+ALIGNED_RIGHT_EYE = (0.645, 0.43)
+# Eye pairs closer than this (pixels) or rolled further than this (degrees)
+# are treated as misdetections and the face is left unaligned
+MIN_ALIGNMENT_EYE_DISTANCE = 8
+MAX_ALIGNMENT_ROLL = 45
+
+def find_eye_centers(gray, face_box, landmarks=None, eye_cascade=None):
+    """
+    Locate the two eye centers of a detected face
+    
+    Uses the RetinaFace landmarks when present, otherwise the two largest Haar
+    eye detections in the upper half of the face box.
+    
+    Args:
+        gray: Grayscale image the face was detected in
+        face_box: (x, y, w, h) of the face
+        landmarks: RetinaFace landmark dict for this face, if any
+        eye_cascade: Haar eye cascade for the fallback
+    
+    Returns:
+        ((x, y), (x, y)) image-left eye first, or None if not found
+    """
+    if landmarks and 'left_eye' in landmarks and 'right_eye' in landmarks:
+        eyes = [tuple(map(float, landmarks['left_eye'][:2])), tuple(map(float, landmarks['right_eye'][:2]))]
+    elif eye_cascade is not None:
+        x, y, w, h = [int(v) for v in face_box]
+        upper_half = gray[max(0, y):max(0, y) + h // 2, max(0, x):max(0, x) + w]
+        if upper_half.size == 0:
+            return None
+        detections = eye_cascade.detectMultiScale(upper_half, scaleFactor=1.1, minNeighbors=5)
+        if len(detections) < 2:
+            return None
+        detections = sorted(detections, key=lambda eye: eye[2] * eye[3], reverse=True)[:2]
+        eyes = [(max(0, x) + ex + ew / 2.0, max(0, y) + ey + eh / 2.0) for ex, ey, ew, eh in detections]
+    else:
+        return None
+    
+    left, right = sorted(eyes)
+    dx, dy = right[0] - left[0], right[1] - left[1]
+    if np.hypot(dx, dy) < MIN_ALIGNMENT_EYE_DISTANCE or abs(np.degrees(np.arctan2(dy, dx))) > MAX_ALIGNMENT_ROLL:
+        return None
+    return left, right
+
+def alignment_transform(left_eye, right_eye, size):
+    """
+    Similarity transform putting the eyes level at the canonical positions
+    of a size x size crop
+    
+    Returns:
+        2x3 affine matrix for cv2.warpAffine
+    """
+    dx, dy = right_eye[0] - left_eye[0], right_eye[1] - left_eye[1]
+    angle = np.degrees(np.arctan2(dy, dx))
+    scale = (ALIGNED_RIGHT_EYE[0] - ALIGNED_LEFT_EYE[0]) * size / np.hypot(dx, dy)
+    center = ((left_eye[0] + right_eye[0]) / 2.0, (left_eye[1] + right_eye[1]) / 2.0)
+    matrix = cv2.getRotationMatrix2D(center, angle, scale)
+    # Move the eye midpoint to its canonical position in the crop
+    matrix[0, 2] += (ALIGNED_LEFT_EYE[0] + ALIGNED_RIGHT_EYE[0]) / 2.0 * size - center[0]
+    matrix[1, 2] += ALIGNED_LEFT_EYE[1] * size - center[1]
+    return matrix
+
+def align_face(images, eye_centers, size):
+    """
+    Warp the face in one or more same-sized images to the canonical pose
+    
+    Args:
+        images: Images to warp with the same transform (e.g. gray and color)
+        eye_centers: (left, right) eye centers from find_eye_centers
+        size: Side of the square output crop
+    
+    Returns:
+        List of aligned size x size crops, in the order of images
+    """
+    matrix = alignment_transform(eye_centers[0], eye_centers[1], size)
+    return [
+        cv2.warpAffine(image, matrix, (size, size), flags=cv2.INTER_LINEAR, borderMode=cv2.BORDER_REPLICATE)
+        for image in images
+    ]
+
 def get_face_encoding(image_file):
     """
     Get face encoding from an image file using RetinaFace with enhanced detection
     
+    Results are cached by image content and pipeline version
+    (accounts.face_encoding_cache), so a repeated image is not re-encoded.
+    While the cache is enabled the result is in template form (no keypoints,
+    'aligned' or 'preprocessed_face') on a hit and a miss alike.
+    
     Args:
-        image_file: InMemoryUploadedFile or path to image
+        image_file: DecodedImage, InMemoryUploadedFile or path to image
     
     Returns:
         Dict containing face image array and features if detected, None otherwise
     """
+    try:
+        return cached_face_encoding(image_file, compute_face_encoding)
+    except Exception:
+        # Logged by compute_face_encoding; errors are not cached
+        return None
+
+def compute_face_encoding(image_file):
+    """
+    Run the full detection and encoding pipeline for get_face_encoding, bypassing the cache
+    
+    Returns None when no face is found. Pipeline errors are logged and
+    re-raised, so the cache never records them as a face-less image.
+    """
     try:
         # If image_file is a file path
         if isinstance(image_file, str):
-            img_path = image_file
+            detector_input = image_file
             img = cv2.imread(image_file)
+        elif hasattr(image_file, 'bgr'):
+            # DecodedImage: reuse the pixels decoded during upload validation
+            img = image_file.bgr
+            # RetinaFace accepts image arrays directly, no temporary file needed
+            detector_input = img
         else:
             # If image_file is an InMemoryUploadedFile
             img_data = image_file.read()
             nparr = np.frombuffer(img_data, np.uint8)
             img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-            # Save to a temporary file for RetinaFace (which requires a file path)
-            temp_path = os.path.join(settings.MEDIA_ROOT, 'temp_face_detection.jpg')
-            cv2.imwrite(temp_path, img)
-            img_path = temp_path
+            detector_input = img
             # Reset file pointer
             if hasattr(image_file, 'seek'):
                 image_file.seek(0)
@@ -286,6 +539,9 @@ def get_face_encoding(image_file):
             logger.error("Failed to read image")
             return None
         
+        # Thread-local cascades and feature detector
+        ctx = get_pipeline_context()
+        
         # Enhanced preprocessing for better face recognition
         img_enhanced = preprocess_image(img)
         
@@ -294,15 +550,16 @@ def get_face_encoding(image_file):
         
         # Initialize faces list
         faces = []
-        landmarks = None
+        # RetinaFace landmarks of each detected face box
+        face_landmarks = {}
         has_eyes = False
         
         # Try RetinaFace detection first (more accurate)
         if has_retinaface and retinaface_detector is not None:
             try:
-                logger.info("Using RetinaFace for face detection")
+                trace.debug('detection', "Using RetinaFace for face detection")
                 # Detect faces using RetinaFace
-                resp = retinaface_detector.detect_faces(img_path)
+                resp = retinaface_detector.detect_faces(detector_input, model=get_retinaface_model())
                 
                 # Process RetinaFace results
                 if resp and len(resp) > 0:
@@ -317,86 +574,28 @@ def get_face_encoding(image_file):
                                 w, h = x2 - x, y2 - y
                                 faces.append((x, y, w, h))
                                 
-                                # Get facial landmarks for eye detection
+                                # Get facial landmarks for eye detection and alignment
                                 landmarks = face_data.get('landmarks', {})
+                                face_landmarks[(x, y, w, h)] = landmarks
                                 # Check if eyes are detected in landmarks
                                 if 'left_eye' in landmarks and 'right_eye' in landmarks:
                                     has_eyes = True
                 
-                logger.info(f"RetinaFace detected {len(faces)} faces in the image")
+                trace.debug('detection', "RetinaFace detected %d faces in the image", len(faces))
             except Exception as e:
-                logger.error(f"Error using RetinaFace: {str(e)}")
+                logger.error("Error using RetinaFace: %s", e)
                 # RetinaFace failed, will fall back to Haar Cascade
         
-        # Fall back to Haar Cascade if RetinaFace failed or found no faces
-        if len(faces) == 0 and face_cascade is not None:
-            logger.info("Falling back to Haar Cascade for face detection")
-            # Try primary face detector with different parameters
-            faces1 = face_cascade.detectMultiScale(
-                gray,
-                scaleFactor=1.1,
-                minNeighbors=5,
-                minSize=(60, 60)  # Larger minimum size for better quality
-            )
-            faces.extend(list(faces1))
-            
-            # If no faces found, try with more lenient parameters
-            if len(faces1) == 0:
-                faces1_lenient = face_cascade.detectMultiScale(
-                    gray,
-                    scaleFactor=1.2,  # Higher scale factor to detect faces at different scales
-                    minNeighbors=3,   # Lower neighbor threshold to be more lenient
-                    minSize=(40, 40)  # Smaller minimum size to catch smaller faces
-                )
-                faces.extend(list(faces1_lenient))
-        
-            # Try alternative face detector with different parameters
-            if face_cascade_alt is not None and len(faces) == 0:
-                # Standard parameters
-                faces2 = face_cascade_alt.detectMultiScale(
-                    gray,
-                    scaleFactor=1.1,
-                    minNeighbors=4,
-                    minSize=(60, 60)
-                )
-                faces.extend(list(faces2))
-                
-                # If still no faces, try more lenient parameters
-                if len(faces2) == 0:
-                    faces2_lenient = face_cascade_alt.detectMultiScale(
-                        gray,
-                        scaleFactor=1.3,
-                        minNeighbors=2,
-                        minSize=(30, 30)  # Even smaller size
-                    )
-                    faces.extend(list(faces2_lenient))
-                    
-            # If we still can't find faces, try one more approach with edge enhancement
-            if len(faces) == 0:
-                # Try edge enhancement to improve face detection
-                edge_enhanced = cv2.Laplacian(gray, cv2.CV_8U, ksize=3)
-                edge_enhanced = cv2.convertScaleAbs(edge_enhanced)
-                edge_enhanced = cv2.equalizeHist(edge_enhanced)
-                
-                faces_edge = face_cascade.detectMultiScale(
-                    edge_enhanced,
-                    scaleFactor=1.1,
-                    minNeighbors=3,
-                    minSize=(40, 40)
-                )
-                faces.extend(list(faces_edge))
-                    
-            logger.info(f"Haar Cascade detected {len(faces)} faces in the image")
-        
-        # Clean up temporary file if it was created
-        if not isinstance(image_file, str) and os.path.exists(os.path.join(settings.MEDIA_ROOT, 'temp_face_detection.jpg')):
-            try:
-                os.remove(os.path.join(settings.MEDIA_ROOT, 'temp_face_detection.jpg'))
-            except Exception as e:
-                logger.warning(f"Could not remove temporary file: {str(e)}")
+        # Fall back to Haar Cascade if RetinaFace failed or found no faces:
+        # primary then alternative cascade, strict then lenient, then an
+        # edge-enhanced pass, over one pyramid of a downscaled frame
+        if len(faces) == 0 and ctx.face_cascade is not None:
+            trace.debug('detection', "Falling back to Haar Cascade for face detection")
+            faces = detect_faces_haar(gray, ctx.face_cascade, ctx.face_cascade_alt)
+            trace.debug('detection', "Haar Cascade detected %d faces in the image", len(faces))
         
         if len(faces) == 0:
-            logger.warning("No faces detected in the image")
+            trace.debug('detection', "No faces detected in the image")
             return None
         
         # Get the largest face
@@ -424,10 +623,20 @@ def get_face_encoding(image_file):
             face_color = img_enhanced[ext_y:ext_y+ext_h, ext_x:ext_x+ext_w]
             
             # Check for eyes to confirm it's a real face (anti-spoofing) if not already confirmed by RetinaFace
-            if not has_eyes and eye_cascade is not None:
-                eyes = eye_cascade.detectMultiScale(face_region)
+            if not has_eyes and ctx.eye_cascade is not None:
+                eyes = ctx.eye_cascade.detectMultiScale(face_region)
                 has_eyes = len(eyes) >= 1  # At least one eye should be visible
             
+            # Warp the face so the eyes are level at fixed positions; a tilted
+            # head then matches an upright reference without its own angle
+            aligned = False
+            if getattr(settings, 'FACE_ALIGNMENT_ENABLED', True):
+                eye_centers = find_eye_centers(gray, largest_face, face_landmarks.get(largest_face), ctx.eye_cascade)
+                if eye_centers is not None:
+                    face_region, face_color = align_face((gray, img_enhanced), eye_centers, max(ext_w, ext_h))
+                    aligned = True
+                trace.debug('detection', "Face alignment %s", "applied" if aligned else "skipped (no eye pair)")
+            
             # Enhance contrast in face region
             face_region = cv2.equalizeHist(face_region)
             
@@ -437,8 +646,8 @@ def get_face_encoding(image_file):
             # Extract SIFT features if available
             keypoints = []
             descriptors = None
-            if sift is not None:
-                keypoints, descriptors = sift.detectAndCompute(face_region, None)
+            if ctx.sift is not None:
+                keypoints, descriptors = ctx.sift.detectAndCompute(face_region, None)
             
             # Resize to a standard size for comparison (higher resolution)
             face_standardized = cv2.resize(face_region, (200, 200))
@@ -454,7 +663,7 @@ def get_face_encoding(image_file):
             
             # Generate FaceNet embedding if available
             facenet_embedding = None
-            if has_facenet and facenet_model is not None:
+            if has_facenet and facenet_embedder is not None:
                 # Use the preprocessed color face image for better embedding quality
                 facenet_embedding = get_facenet_embedding(preprocessed_face)
             
@@ -466,6 +675,7 @@ def get_face_encoding(image_file):
                 'descriptors': descriptors,
                 'face_region': face_region,
                 'original_bbox': largest_face,
+                'aligned': aligned,
                 'preprocessed_face': preprocessed_face,
                 'facenet_embedding': facenet_embedding  # Add FaceNet embedding
             }
@@ -474,10 +684,10 @@ def get_face_encoding(image_file):
         
         return None
     except Exception as e:
-        logger.error(f"Error in get_face_encoding: {str(e)}")
-        return None
+        logger.error("Error in get_face_encoding: %s", e)
+        raise
 
-def compare_faces(known_face, unknown_face, threshold=0.85):
+def compare_faces(known_face, unknown_face, threshold=0.85, scores=None):
     """
     Compare faces using multiple methods for robust verification
     
@@ -485,6 +695,7 @@ def compare_faces(known_face, unknown_face, threshold=0.85):
         known_face: Reference face data dictionary
         unknown_face: Face data dictionary to check
         threshold: Similarity threshold (higher is more strict, 0.85 = 85% similarity required)
+        scores: Optional dict that receives the per-method scores
     
     Returns:
         Boolean indicating if faces match and confidence score
@@ -493,6 +704,9 @@ def compare_faces(known_face, unknown_face, threshold=0.85):
         return False, 0.0
     
     try:
+        # Thread-local feature detector and matcher
+        ctx = get_pipeline_context()
+        
         # Extract face images from data dictionaries
         known_img = known_face.get('face_img') if isinstance(known_face, dict) else known_face
         unknown_img = unknown_face.get('face_img') if isinstance(unknown_face, dict) else unknown_face
@@ -519,9 +733,9 @@ def compare_faces(known_face, unknown_face, threshold=0.85):
                     
                     # Convert to a 0-1 score (1 is best)
                     facenet_score = (cosine_similarity + 1) / 2
-                    logger.info(f"FaceNet cosine similarity: {cosine_similarity:.4f}, score: {facenet_score:.4f}")
+                    trace.debug('scores', "FaceNet cosine similarity: %.4f, score: %.4f", cosine_similarity, facenet_score)
                 except Exception as e:
-                    logger.warning(f"Error calculating FaceNet similarity: {str(e)}")
+                    logger.warning("Error calculating FaceNet similarity: %s", e)
                     # Fall back to other methods
                     facenet_score = 0.0
         
@@ -536,7 +750,7 @@ def compare_faces(known_face, unknown_face, threshold=0.85):
             # Standard SSIM on normalized images
             standard_ssim = ssim(known_img, unknown_img, data_range=1.0, channel_axis=None)
             ssim_scores.append(standard_ssim)
-            logger.info(f"Standard SSIM score: {standard_ssim:.4f}")
+            trace.debug('scores', "Standard SSIM score: %.4f", standard_ssim)
             
             # Try Gaussian blurring before comparison (reduces noise)
             try:
@@ -544,9 +758,9 @@ def compare_faces(known_face, unknown_face, threshold=0.85):
                 unknown_blur = cv2.GaussianBlur(unknown_img, (5, 5), 0)
                 blur_ssim = ssim(known_blur, unknown_blur, data_range=1.0, channel_axis=None)
                 ssim_scores.append(blur_ssim)
-                logger.info(f"Blur SSIM score: {blur_ssim:.4f}")
+                trace.debug('scores', "Blur SSIM score: %.4f", blur_ssim)
             except Exception as blur_e:
-                logger.warning(f"Blur SSIM error: {str(blur_e)}")
+                logger.warning("Blur SSIM error: %s", blur_e)
             
             # Try edge detection before comparison (focuses on facial structure)
             try:
@@ -565,13 +779,13 @@ def compare_faces(known_face, unknown_face, threshold=0.85):
                 # Calculate SSIM on edges
                 edge_ssim = ssim(known_edges, unknown_edges, data_range=1.0, channel_axis=None)
                 ssim_scores.append(edge_ssim)
-                logger.info(f"Edge SSIM score: {edge_ssim:.4f}")
+                trace.debug('scores', "Edge SSIM score: %.4f", edge_ssim)
             except Exception as edge_e:
-                logger.warning(f"Edge SSIM error: {str(edge_e)}")
+                logger.warning("Edge SSIM error: %s", edge_e)
             
             # Take the highest SSIM score from any method
             ssim_score = max(ssim_scores) if ssim_scores else 0.0
-            logger.info(f"Best SSIM score: {ssim_score:.4f}")
+            trace.debug('scores', "Best SSIM score: %.4f", ssim_score)
             
         except ImportError:
             # Fallback to MSE if skimage not available
@@ -579,7 +793,7 @@ def compare_faces(known_face, unknown_face, threshold=0.85):
             ssim_score = 1 - min(1, mse)
             logger.warning("Using MSE fallback instead of SSIM")
         except Exception as e:
-            logger.error(f"SSIM error: {str(e)}")
+            logger.error("SSIM error: %s", e)
             # Fallback to MSE if SSIM fails
             mse = np.mean((known_img - unknown_img) ** 2)
             ssim_score = 1 - min(1, mse)
@@ -588,7 +802,7 @@ def compare_faces(known_face, unknown_face, threshold=0.85):
         # 2. Feature matching using SIFT descriptors if available
         feature_score = 0.0
         try:
-            if (sift is not None and bf_matcher is not None and 
+            if (ctx.sift is not None and ctx.bf_matcher is not None and 
                 isinstance(known_face, dict) and isinstance(unknown_face, dict)):
                 known_desc = known_face.get('descriptors')
                 unknown_desc = unknown_face.get('descriptors')
@@ -605,7 +819,7 @@ def compare_faces(known_face, unknown_face, threshold=0.85):
                     
                     # Use feature matching with error handling
                     try:
-                        matches = bf_matcher.knnMatch(known_desc, unknown_desc, k=2)
+                        matches = ctx.bf_matcher.knnMatch(known_desc, unknown_desc, k=2)
                         
                         # Sometimes knnMatch returns single matches, handle that case
                         good_matches = []
@@ -619,10 +833,10 @@ def compare_faces(known_face, unknown_face, threshold=0.85):
                         if len(matches) > 0:
                             feature_score = len(good_matches) / len(matches)
                     except Exception as e:
-                        logger.warning(f"Feature matching error: {str(e)}")
+                        logger.warning("Feature matching error: %s", e)
                         # Fall back to a simpler method if knnMatch fails
                         try:
-                            simple_matches = bf_matcher.match(known_desc, unknown_desc)
+                            simple_matches = ctx.bf_matcher.match(known_desc, unknown_desc)
                             distances = [m.distance for m in simple_matches]
                             if distances:  # Ensure we have distances
                                 # Normalize distances (lower is better)
@@ -634,9 +848,9 @@ def compare_faces(known_face, unknown_face, threshold=0.85):
                                 else:
                                     feature_score = 0.5  # Neutral score if all distances are equal
                         except Exception as e2:
-                            logger.warning(f"Simple feature matching also failed: {str(e2)}")
+                            logger.warning("Simple feature matching also failed: %s", e2)
         except Exception as e:
-            logger.error(f"Error in feature matching section: {str(e)}")
+            logger.error("Error in feature matching section: %s", e)
             # Don't throw error, just use a zero feature score
         
         # 3. Check for eyes to prevent photo spoofing
@@ -727,9 +941,9 @@ def compare_faces(known_face, unknown_face, threshold=0.85):
                                         # Lower is better - invert
                                         hist_scores.append(1 - score)
                             
-                            logger.info(f"Histogram comparison scores: {[round(s, 4) for s in hist_scores]}")
+                            trace.debug('scores', "Histogram comparison scores: %s", hist_scores)
                         except Exception as hist_e:
-                            logger.warning(f"Standard histogram comparison error: {str(hist_e)}")
+                            logger.warning("Standard histogram comparison error: %s", hist_e)
                         
                         # Choose the best score from any method
                         if hist_scores:
@@ -737,10 +951,10 @@ def compare_faces(known_face, unknown_face, threshold=0.85):
                         
                         # Ensure score is between 0 and 1
                         hist_score = max(0, min(1, hist_score))
-                        logger.info(f"Final histogram score: {hist_score:.4f}")
+                        trace.debug('scores', "Final histogram score: %.4f", hist_score)
                         
                     except Exception as e:
-                        logger.error(f"Error in histogram comparison section: {str(e)}")
+                        logger.error("Error in histogram comparison section: %s", e)
                         # Don't throw error, just use a zero histogram score
                         hist_score = 0.0
                         try:
@@ -751,9 +965,9 @@ def compare_faces(known_face, unknown_face, threshold=0.85):
                             # Calculate simple histogram intersection
                             hist_score = np.sum(np.minimum(hist1_flat, hist2_flat))
                         except Exception as e2:
-                            logger.warning(f"Simple histogram comparison also failed: {str(e2)}")
+                            logger.warning("Simple histogram comparison also failed: %s", e2)
         except Exception as e:
-            logger.error(f"Error in histogram comparison section: {str(e)}")
+            logger.error("Error in histogram comparison section: %s", e)
             # Don't throw error, just use a zero histogram score
         
         # ENHANCEMENT: Apply facial feature boosting for legitimate users
@@ -767,7 +981,8 @@ def compare_faces(known_face, unknown_face, threshold=0.85):
             if hist_score > 0.4:
                 hist_score = min(1.0, hist_score * 1.2)     # 20% boost to histogram
             
-            logger.info(f"Applied legitimate user boost - new scores: SSIM={ssim_score:.4f}, Feature={feature_score:.4f}, Hist={hist_score:.4f}")
+            trace.debug('scores', "Applied legitimate user boost - new scores: SSIM=%.4f, Feature=%.4f, Hist=%.4f",
+                        ssim_score, feature_score, hist_score)
         
         # Combine scores with weights - adjust weights based on available methods
         # If FaceNet embeddings are available, prioritize them
@@ -853,38 +1068,42 @@ def compare_faces(known_face, unknown_face, threshold=0.85):
         # Ensure similarity is in 0-1 range
         similarity = max(0.0, min(1.0, similarity))
         
-        logger.info(f"Face comparison scores - FaceNet: {facenet_score:.2f}, SSIM: {ssim_score:.2f}, "
-                   f"Feature: {feature_score:.2f}, Histogram: {hist_score:.2f}, Combined: {similarity:.2f}, "
-                   f"Threshold: {threshold:.2f}")
-        
-        # Log which method contributed most to the final score
-        primary_method = "Unknown"
-        if facenet_score > 0 and weights.get('facenet', 0) > 0.3:
-            primary_method = "FaceNet (Deep Learning)"
-        elif weights.get('ssim', 0) > weights.get('feature', 0) and weights.get('ssim', 0) > weights.get('histogram', 0):
-            primary_method = "SSIM (Structural Similarity)"
-        elif weights.get('feature', 0) > weights.get('ssim', 0) and weights.get('feature', 0) > weights.get('histogram', 0):
-            primary_method = "Feature Matching (SIFT/ORB)"
-        elif weights.get('histogram', 0) > weights.get('ssim', 0) and weights.get('histogram', 0) > weights.get('feature', 0):
-            primary_method = "Histogram Comparison"
+        if trace.enabled('scores'):
+            # Log which method contributed most to the final score
+            primary_method = "Unknown"
+            if facenet_score > 0 and weights.get('facenet', 0) > 0.3:
+                primary_method = "FaceNet (Deep Learning)"
+            elif weights.get('ssim', 0) > weights.get('feature', 0) and weights.get('ssim', 0) > weights.get('histogram', 0):
+                primary_method = "SSIM (Structural Similarity)"
+            elif weights.get('feature', 0) > weights.get('ssim', 0) and weights.get('feature', 0) > weights.get('histogram', 0):
+                primary_method = "Feature Matching (SIFT/ORB)"
+            elif weights.get('histogram', 0) > weights.get('ssim', 0) and weights.get('histogram', 0) > weights.get('feature', 0):
+                primary_method = "Histogram Comparison"
             
-        logger.info(f"Primary comparison method: {primary_method}")
-        if facenet_score > 0:
-            logger.info("Using modern deep learning face embeddings for comparison")
-        else:
-            logger.info("Using traditional computer vision methods for comparison")
+            trace.debug('scores', "Face comparison scores - FaceNet: %.2f, SSIM: %.2f, Feature: %.2f, "
+                        "Histogram: %.2f, Combined: %.2f, Threshold: %.2f, Weights: %s, Primary method: %s",
+                        facenet_score, ssim_score, feature_score, hist_score, similarity, threshold,
+                        weights, primary_method)
+        
+        if scores is not None:
+            scores.update({
+                'facenet': round(float(facenet_score), 4),
+                'ssim': round(float(ssim_score), 4),
+                'feature': round(float(feature_score), 4),
+                'histogram': round(float(hist_score), 4),
+            })
         
         # Adjust threshold if face comparison is failing too often
         adjusted_threshold = threshold
         if threshold > 0.80 and similarity > 0.65 and similarity < threshold:
             # If we're close to matching but not quite there, log a warning
-            logger.warning(f"Near match detected: {similarity:.2f} vs threshold {threshold:.2f}")
+            trace.debug('result', "Near match detected: %.2f vs threshold %.2f", similarity, threshold)
             # We still return False but log the near match
         
         # Return match result and similarity score
         return similarity > adjusted_threshold, similarity
     except Exception as e:
-        logger.error(f"Error in compare_faces: {str(e)}")
+        logger.error("Error in compare_faces: %s", e)
         return False, 0.0
 
 def get_face_similarity(known_face, unknown_face):
@@ -901,6 +1120,9 @@ def get_face_similarity(known_face, unknown_face):
     match, similarity = compare_faces(known_face, unknown_face, threshold=0.0)
     return similarity
 
+# Reduced threshold for mobile environments where lighting/angles vary
+VERIFICATION_THRESHOLD = 0.65  # 65% similarity required (reduced from 75%)
+
 def verify_face(reference_image_path, check_image):
     """
     Verify if the face in check_image matches the face in reference_image_path
@@ -913,15 +1135,12 @@ def verify_face(reference_image_path, check_image):
     Returns:
         dict with match status, confidence score, and additional security info
     """
-    # Define constants for face verification
-    # Reduced threshold for mobile environments where lighting/angles vary
-    VERIFICATION_THRESHOLD = 0.65  # 65% similarity required (reduced from 75%)
     # Log verification attempt for audit purposes
-    logger.info(f"Face verification attempt with reference image: {reference_image_path}")
+    trace.debug('verification', "Face verification attempt with reference image: %s", reference_image_path)
     
     # Ensure the reference image path exists
     if not os.path.exists(reference_image_path):
-        logger.error(f"Reference image not found at path: {reference_image_path}")
+        logger.error("Reference image not found at path: %s", reference_image_path)
         return {
             "match": False,
             "error": f"Reference image not found at path: {reference_image_path}",
@@ -932,18 +1151,49 @@ def verify_face(reference_image_path, check_image):
     
     try:
         # Get face encodings with enhanced features
-        # Add debug logging to understand image formats
-        logger.info(f"Processing reference image from path: {reference_image_path}")
-        if isinstance(check_image, str):
-            logger.info(f"Check image is a file path: {check_image}")
-        else:
-            logger.info(f"Check image is a file object of type: {type(check_image).__name__}")
-            
+        trace.debug('verification', "Check image: %s",
+                    check_image if isinstance(check_image, str) else type(check_image).__name__)
+        
         reference_face = get_face_encoding(reference_image_path)
         check_face = get_face_encoding(check_image)
         
+        return verify_face_encodings(reference_face, check_face)
+    
+    except Exception as e:
+        logger.error("Critical error in verify_face: %s", e)
+        return verification_error_result(e)
+
+def verification_error_result(error):
+    """Result dictionary returned when verification raises unexpectedly"""
+    # In production mode, verification failures are treated as security risks
+    return {
+        "match": False,  # Fail verification on errors in production
+        "error": f"Error during verification: {str(error)}",
+        "confidence": 0.0,  # Zero confidence when errors occur
+        "has_eyes": False,
+        "security_passed": False,  # Fail security check on errors
+        "threshold": VERIFICATION_THRESHOLD * 100,  # Use the actual threshold
+        "development_mode": False,  # Production mode
+        "timestamp": str(np.datetime64('now'))
+    }
+
+def verify_face_encodings(reference_face, check_face):
+    """
+    Verify a check face encoding against a reference face encoding
+    
+    Lets callers reuse encodings, e.g. a stored enrollment template for the
+    reference or a single probe encoding compared against several references.
+    
+    Args:
+        reference_face: Face data dictionary of the reference (get_face_encoding or a template)
+        check_face: Face data dictionary of the image to check
+    
+    Returns:
+        dict with match status, confidence score, and additional security info
+    """
+    try:
         if reference_face is None:
-            logger.error("No face found in reference image")
+            trace.debug('result', "No face found in reference image")
             return {
                 "match": False,
                 "error": "No face found in reference image",
@@ -953,7 +1203,7 @@ def verify_face(reference_image_path, check_image):
             }
         
         if check_face is None:
-            logger.error("No face found in check image")
+            trace.debug('result', "No face found in check image")
             return {
                 "match": False,
                 "error": "No face found in check image",
@@ -966,22 +1216,17 @@ def verify_face(reference_image_path, check_image):
         has_eyes = check_face.get('has_eyes', False) if isinstance(check_face, dict) else False
         
         # Use our more lenient threshold for mobile environment
-        match, similarity = compare_faces(reference_face, check_face, threshold=VERIFICATION_THRESHOLD)
+        scores = {}
+        match, similarity = compare_faces(reference_face, check_face, threshold=VERIFICATION_THRESHOLD, scores=scores)
         
         # Convert similarity to confidence percentage
         confidence = similarity * 100
         
         # Production mode - no similarity boosts or overrides
         # Values will remain as determined by the comparison algorithm
-        if not match:
-            logger.info(f"Face verification failed with similarity {similarity:.4f} (below threshold {VERIFICATION_THRESHOLD:.2f})")
-            development_override = False
-        
-        # Audit log the result
-        if match:
-            logger.info(f"Face verification SUCCESSFUL with confidence: {confidence:.2f}%")
-        else:
-            logger.warning(f"Face verification FAILED with confidence: {confidence:.2f}%")
+        # (callers emit the summary event; this is the per-reference detail)
+        trace.debug('result', "Reference comparison match=%s similarity=%.4f threshold=%.2f confidence=%.2f",
+                    match, similarity, VERIFICATION_THRESHOLD, confidence)
         
         # Additional security checks for production
         security_passed = match and has_eyes  # In production, require both face match AND detected eyes for security
@@ -994,6 +1239,7 @@ def verify_face(reference_image_path, check_image):
             "has_eyes": has_eyes,
             "security_passed": security_passed,
             "threshold": VERIFICATION_THRESHOLD * 100,  # Convert to percentage
+            "scores": scores,
             "timestamp": str(np.datetime64('now'))
         }
         
@@ -1005,15 +1251,5 @@ def verify_face(reference_image_path, check_image):
         return result
     
     except Exception as e:
-        logger.error(f"Critical error in verify_face: {str(e)}")
-        # In production mode, verification failures are treated as security risks
-        return {
-            "match": False,  # Fail verification on errors in production
-            "error": f"Error during verification: {str(e)}",
-            "confidence": 0.0,  # Zero confidence when errors occur
-            "has_eyes": False,
-            "security_passed": False,  # Fail security check on errors
-            "threshold": VERIFICATION_THRESHOLD * 100,  # Use the actual threshold
-            "development_mode": False,  # Production mode
-            "timestamp": str(np.datetime64('now'))
-        }
\ No newline at end of file
+        logger.error("Critical error in verify_face_encodings: %s", e)
+        return verification_error_result(e)
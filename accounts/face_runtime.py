@@ -0,0 +1,53 @@
+import logging
+import sys
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+
+def thread_setting(name):
+    """A per-library thread count, falling back to FACE_NUM_THREADS (None keeps the library default)"""
+    value = getattr(settings, name, None)
+    if value is None:
+        value = getattr(settings, 'FACE_NUM_THREADS', None)
+    return value
+
+
+def configure_native_threads():
+    """
+    Apply the configured thread pool sizes of OpenCV, PyTorch and TensorFlow
+
+    Each library otherwise sizes its own pool to the number of cores, so
+    several worker processes (each with several verification threads)
+    oversubscribe the CPU. Only libraries that are already imported are
+    configured; TensorFlow settings are ignored once its runtime has started.
+    """
+    cv_threads = thread_setting('FACE_OPENCV_THREADS')
+    if cv_threads is not None:
+        import cv2
+        cv2.setNumThreads(int(cv_threads))
+
+    torch = sys.modules.get('torch')
+    if torch is not None:
+        torch_threads = thread_setting('FACE_TORCH_THREADS')
+        if torch_threads is not None:
+            torch.set_num_threads(int(torch_threads))
+        interop_threads = getattr(settings, 'FACE_TORCH_INTEROP_THREADS', None)
+        if interop_threads is not None:
+            try:
+                torch.set_num_interop_threads(int(interop_threads))
+            except RuntimeError as e:
+                logger.warning("Could not set PyTorch inter-op threads: %s", e)
+
+    tensorflow = sys.modules.get('tensorflow')
+    if tensorflow is not None:
+        intra_op = thread_setting('FACE_TF_INTRA_OP_THREADS')
+        inter_op = getattr(settings, 'FACE_TF_INTER_OP_THREADS', None)
+        try:
+            if intra_op is not None:
+                tensorflow.config.threading.set_intra_op_parallelism_threads(int(intra_op))
+            if inter_op is not None:
+                tensorflow.config.threading.set_inter_op_parallelism_threads(int(inter_op))
+        except RuntimeError as e:
+            logger.warning("Could not set TensorFlow thread counts: %s", e)
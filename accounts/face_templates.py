@@ -0,0 +1,323 @@
+import hashlib
+import io
+import json
+import logging
+import struct
+
+import cv2
+import numpy as np
+from django.conf import settings
+
+from .face_embedders import get_active_weights
+
+logger = logging.getLogger(__name__)
+
+# Encoding entries persisted in a template. Keypoints (cv2.KeyPoint objects)
+# and the preprocessed colour crop are only needed while encoding, so they
+# are not stored.
+TEMPLATE_ARRAY_KEYS = ('face_img', 'face_region', 'descriptors', 'facenet_embedding')
+# Side of the square face_region stored in a template. The aligned crop can
+# be 600 x 600 pixels, but compare_faces only checks the region is present
+# (its histograms are taken from face_img), so a thumbnail is kept.
+TEMPLATE_FACE_REGION_SIZE = 64
+
+# Binary template format (version 2)
+#
+#   header   magic 'FTPL', version, flags, section count, reserved, bbox (4 x int32)
+#   sections key, dtype, ndim, reserved, shape (2 x uint32), scale (float32),
+#            byte length (uint32), then the raw array data padded to 8 bytes
+#
+# The embedding section comes first so it can be read without touching the
+# rest. Arrays are read with np.frombuffer straight out of the buffer they
+# were stored in (bytes, a BinaryField memoryview or an mmap).
+# Version 1 templates were np.savez_compressed archives and are still read.
+TEMPLATE_MAGIC = b'FTPL'
+TEMPLATE_FORMAT_VERSION = 2
+# Leading bytes of a version 2 template that always hold the whole embedding
+# section (up to 2,000 dimensions at float32), enough for template_embedding
+EMBEDDING_PREFIX_BYTES = 8192
+
+_HEADER = struct.Struct('<4sBBBB4i')
+_SECTION = struct.Struct('<BBBB2IfI')
+_ALIGNMENT = 8
+
+FLAG_HAS_EYES = 0x01
+FLAG_HAS_BBOX = 0x02
+
+SECTION_KEYS = {'facenet_embedding': 1, 'face_img': 2, 'face_region': 3, 'descriptors': 4}
+_SECTION_NAMES = {code: key for key, code in SECTION_KEYS.items()}
+
+DTYPE_FLOAT32 = 1
+DTYPE_FLOAT16 = 2
+DTYPE_INT8_SCALED = 3   # value = int8 * scale
+DTYPE_UINT8 = 4
+DTYPE_UINT8_UNIT = 5    # value = uint8 / 255, exact for images normalized that way
+_NUMPY_DTYPES = {
+    DTYPE_FLOAT32: np.float32,
+    DTYPE_FLOAT16: np.float16,
+    DTYPE_INT8_SCALED: np.int8,
+    DTYPE_UINT8: np.uint8,
+    DTYPE_UINT8_UNIT: np.uint8,
+}
+
+# Revision of the code that turns a photo into a template: preprocess_image,
+# face detection, alignment, cropping and feature extraction. Bump it with
+# any change to those, so stored templates are recomputed (reembed_faces).
+PIPELINE_REVISION = 3
+
+EMBEDDING_DTYPES = ('float32', 'float16', 'int8')
+DEFAULT_EMBEDDING_DTYPE = 'float16'
+
+
+def get_embedding_dtype():
+    """Storage precision of template embeddings (FACE_TEMPLATE_EMBEDDING_DTYPE)"""
+    dtype = getattr(settings, 'FACE_TEMPLATE_EMBEDDING_DTYPE', DEFAULT_EMBEDDING_DTYPE)
+    if dtype not in EMBEDDING_DTYPES:
+        raise ValueError(f"Unknown FACE_TEMPLATE_EMBEDDING_DTYPE: {dtype}")
+    return dtype
+
+
+def pipeline_version():
+    """
+    Short hash identifying the pipeline that produces templates
+
+    Covers PIPELINE_REVISION and the settings that change template contents:
+    face alignment, the preprocessing variant and the FaceNet weights (the
+    int8 ONNX model gives different embeddings; fp32 backends agree with
+    eager PyTorch). The weights are those the pipeline actually loaded, so a
+    backend that fell back to eager PyTorch, or no FaceNet at all, is not
+    reported as configured. Storage precision is not included, templates of
+    any precision stay comparable.
+    """
+    weights = get_active_weights()
+    if weights is None:
+        # The pipeline is not loaded in this process; go by the settings
+        backend = getattr(settings, 'FACENET_BACKEND', 'torch')
+        weights = 'int8' if backend == 'onnx' and getattr(settings, 'FACENET_ONNX_QUANTIZED', True) else 'fp32'
+    components = {
+        'revision': PIPELINE_REVISION,
+        'alignment': bool(getattr(settings, 'FACE_ALIGNMENT_ENABLED', True)),
+        'preprocessing': getattr(settings, 'FACE_PREPROCESSING', 'legacy'),
+        'facenet': weights,
+    }
+    return hashlib.sha256(json.dumps(components, sort_keys=True).encode()).hexdigest()[:12]
+
+
+def is_current_template(face_image, version=None):
+    """Whether a UserFaceImage has a template from the current (or given) pipeline version"""
+    return bool(face_image.template) and face_image.template_version == (version or pipeline_version())
+
+
+def needs_template(face_image, version=None):
+    """
+    Whether a UserFaceImage has yet to go through the current (or given) pipeline version
+
+    A photo that version rejected keeps an empty template tagged with it, so
+    it is not extracted again until the pipeline changes.
+    """
+    return face_image.template_version != (version or pipeline_version())
+
+
+def current_profile_template(profile, version=None):
+    """The face_template of a UserProfile if it is from the current (or given) pipeline version, else None"""
+    if profile is None or not profile.face_template:
+        return None
+    if profile.face_template_version != (version or pipeline_version()):
+        return None
+    return bytes(profile.face_template)
+
+
+def quantize_embedding(embedding, dtype):
+    """
+    Encode an embedding at the given precision
+
+    Returns:
+        Tuple of (dtype code, array, scale)
+    """
+    embedding = np.asarray(embedding, dtype=np.float32).ravel()
+    if dtype == 'float16':
+        return DTYPE_FLOAT16, embedding.astype(np.float16), 1.0
+    if dtype == 'int8':
+        peak = float(np.max(np.abs(embedding))) if embedding.size else 0.0
+        scale = peak / 127.0 if peak > 0 else 1.0
+        return DTYPE_INT8_SCALED, np.clip(np.rint(embedding / scale), -127, 127).astype(np.int8), scale
+    return DTYPE_FLOAT32, embedding, 1.0
+
+
+def _pack_array(key, value):
+    """Choose the compact encoding of a non-embedding array: (dtype code, array, scale)"""
+    if value.dtype == np.uint8:
+        return DTYPE_UINT8, value, 1.0
+    if key == 'face_img':
+        # face_img is an 8-bit image divided by 255, so storing the bytes is lossless
+        packed = np.rint(value * 255.0).astype(np.uint8)
+        if np.array_equal(packed.astype(np.float32) / 255.0, value):
+            return DTYPE_UINT8_UNIT, packed, 1.0
+    if key == 'descriptors':
+        # OpenCV's SIFT descriptors are whole numbers in 0..255 stored as float32
+        packed = value.astype(np.uint8)
+        if np.array_equal(packed, value):
+            return DTYPE_UINT8, packed, 1.0
+    return DTYPE_FLOAT32, value.astype(np.float32), 1.0
+
+
+def serialize_template(encoding, embedding_dtype=None):
+    """
+    Serialize a face encoding returned by get_face_encoding to bytes
+
+    Args:
+        encoding: Face data dictionary from get_face_encoding
+        embedding_dtype: 'float32', 'float16' or 'int8' (default FACE_TEMPLATE_EMBEDDING_DTYPE)
+
+    Returns:
+        bytes suitable for UserFaceImage.template, or None if encoding is None
+    """
+    if encoding is None:
+        return None
+
+    sections = []
+    embedding = encoding.get('facenet_embedding')
+    if isinstance(embedding, np.ndarray):
+        sections.append((SECTION_KEYS['facenet_embedding'],) +
+                        quantize_embedding(embedding, embedding_dtype or get_embedding_dtype()))
+    for key in ('face_img', 'face_region', 'descriptors'):
+        value = encoding.get(key)
+        if isinstance(value, np.ndarray) and value.ndim <= 2:
+            if key == 'face_region' and value.size and max(value.shape) > TEMPLATE_FACE_REGION_SIZE:
+                value = cv2.resize(value, (TEMPLATE_FACE_REGION_SIZE, TEMPLATE_FACE_REGION_SIZE),
+                                   interpolation=cv2.INTER_AREA)
+            sections.append((SECTION_KEYS[key],) + _pack_array(key, value))
+
+    flags = FLAG_HAS_EYES if encoding.get('has_eyes') else 0
+    bbox = encoding.get('original_bbox')
+    if bbox is not None:
+        flags |= FLAG_HAS_BBOX
+    bbox = tuple(int(v) for v in bbox) if bbox is not None else (0, 0, 0, 0)
+
+    buffer = io.BytesIO()
+    buffer.write(_HEADER.pack(TEMPLATE_MAGIC, TEMPLATE_FORMAT_VERSION, flags, len(sections), 0, *bbox))
+    for code, dtype, array, scale in sections:
+        array = np.ascontiguousarray(array)
+        shape = tuple(array.shape) + (0,) * (2 - array.ndim)
+        buffer.write(_SECTION.pack(code, dtype, array.ndim, 0, shape[0], shape[1], scale, array.nbytes))
+        buffer.write(b'\0' * (-buffer.tell() % _ALIGNMENT))
+        buffer.write(array.tobytes())
+        buffer.write(b'\0' * (-buffer.tell() % _ALIGNMENT))
+    return buffer.getvalue()
+
+
+def is_compact_template(data):
+    return data is not None and bytes(data[:4]) == TEMPLATE_MAGIC
+
+
+def read_template(data, keys=None):
+    """
+    Parse a version 2 template without copying its arrays
+
+    Args:
+        data: bytes, memoryview or mmap holding the template
+        keys: Optional set of section names to read (default: all)
+
+    Returns:
+        dict with 'version', 'has_eyes', 'original_bbox' and, per section,
+        (raw array, dtype code, scale); arrays are views into data
+    """
+    view = memoryview(data)
+    magic, version, flags, count, _, *bbox = _HEADER.unpack_from(view, 0)
+    if magic != TEMPLATE_MAGIC:
+        raise ValueError('Not a compact face template')
+    if version > TEMPLATE_FORMAT_VERSION:
+        raise ValueError(f'Unsupported face template version {version}')
+
+    template = {
+        'version': version,
+        'has_eyes': bool(flags & FLAG_HAS_EYES),
+        'original_bbox': tuple(bbox) if flags & FLAG_HAS_BBOX else None,
+        'sections': {},
+    }
+    offset = _HEADER.size
+    for _ in range(count):
+        code, dtype, ndim, _, dim0, dim1, scale, nbytes = _SECTION.unpack_from(view, offset)
+        offset += _SECTION.size
+        offset += -offset % _ALIGNMENT
+        name = _SECTION_NAMES.get(code)
+        if name is not None and (keys is None or name in keys):
+            shape = (dim0, dim1)[:ndim]
+            numpy_dtype = _NUMPY_DTYPES[dtype]
+            array = np.frombuffer(view, dtype=numpy_dtype, count=nbytes // np.dtype(numpy_dtype).itemsize, offset=offset)
+            template['sections'][name] = (array.reshape(shape), dtype, scale)
+        offset += nbytes
+        offset += -offset % _ALIGNMENT
+        if keys is not None and keys.issubset(template['sections']):
+            break
+    return template
+
+
+def decode_section(array, dtype, scale):
+    """Turn a stored section back into the float32/uint8 array the pipeline uses"""
+    if dtype == DTYPE_INT8_SCALED:
+        return array.astype(np.float32) * np.float32(scale)
+    if dtype == DTYPE_FLOAT16:
+        return array.astype(np.float32)
+    if dtype == DTYPE_UINT8_UNIT:
+        return array.astype(np.float32) / 255.0
+    return array
+
+
+def template_embedding(data):
+    """
+    Read only the float32 FaceNet embedding of a template (None if it has none)
+
+    data may be just the first EMBEDDING_PREFIX_BYTES of a version 2 template.
+    """
+    if not data:
+        return None
+    try:
+        if not is_compact_template(data):
+            encoding = _deserialize_npz(data)
+            return encoding['facenet_embedding'] if encoding else None
+        section = read_template(data, keys={'facenet_embedding'})['sections'].get('facenet_embedding')
+        return decode_section(*section) if section else None
+    except Exception as e:
+        logger.warning("Could not read face template embedding: %s", e)
+        return None
+
+
+def deserialize_template(data):
+    """
+    Rebuild a face encoding dictionary from serialized template bytes
+
+    Args:
+        data: bytes/memoryview produced by serialize_template (either format version)
+
+    Returns:
+        Face data dictionary usable by compare_faces, or None if invalid
+    """
+    if not data:
+        return None
+
+    try:
+        if not is_compact_template(data):
+            return _deserialize_npz(data)
+
+        template = read_template(data)
+        encoding = {key: None for key in TEMPLATE_ARRAY_KEYS}
+        for key, section in template['sections'].items():
+            encoding[key] = decode_section(*section)
+        encoding['has_eyes'] = template['has_eyes']
+        encoding['original_bbox'] = template['original_bbox']
+        encoding['keypoints'] = []
+        return encoding
+    except Exception as e:
+        logger.warning("Could not load face template: %s", e)
+        return None
+
+
+def _deserialize_npz(data):
+    """Load a version 1 (np.savez_compressed) template"""
+    with np.load(io.BytesIO(bytes(data)), allow_pickle=False) as arrays:
+        encoding = {key: arrays[key] if key in arrays else None for key in TEMPLATE_ARRAY_KEYS}
+        encoding['has_eyes'] = bool(arrays['has_eyes']) if 'has_eyes' in arrays else False
+        encoding['original_bbox'] = tuple(arrays['original_bbox'].tolist()) if 'original_bbox' in arrays else None
+    encoding['keypoints'] = []
+    return encoding
@@ -0,0 +1,109 @@
+import logging
+import os
+import tempfile
+
+from django.conf import settings
+from django.urls import reverse
+from PIL import Image, ImageOps
+
+logger = logging.getLogger(__name__)
+
+# Directory (relative to MEDIA_ROOT) holding generated variants
+FACE_VARIANTS_DIR = 'face_variants'
+DEFAULT_VARIANT_SIZES = (96, 256)
+DEFAULT_VARIANT_QUALITY = 85
+
+
+def get_variant_sizes():
+    """Thumbnail sizes (longest side, in pixels) that may be generated"""
+    return tuple(getattr(settings, 'FACE_IMAGE_VARIANT_SIZES', DEFAULT_VARIANT_SIZES))
+
+
+def variant_name(name, size):
+    """Storage name of the size variant of the face image stored as name"""
+    return '/'.join([FACE_VARIANTS_DIR, str(size), name.replace(os.sep, '/')])
+
+
+def original_name_for_variant(name):
+    """Inverse of variant_name: the original storage name a variant was built from"""
+    parts = name.replace(os.sep, '/').split('/', 2)
+    if len(parts) < 3 or parts[0] != FACE_VARIANTS_DIR:
+        return None
+    return parts[2]
+
+
+def get_or_create_variant(name, size):
+    """
+    Return the filesystem path of a variant, generating it on first use
+
+    Variants are written to a temporary file and renamed into place, so
+    concurrent requests for the same thumbnail never see a partial file.
+
+    Args:
+        name: Storage name of the original face image
+        size: One of get_variant_sizes()
+
+    Returns:
+        Absolute path of the variant, or None if the original is missing
+    """
+    if size not in get_variant_sizes():
+        raise ValueError(f"Unsupported face image variant size: {size}")
+
+    variant_path = os.path.join(settings.MEDIA_ROOT, variant_name(name, size))
+    if os.path.exists(variant_path):
+        return variant_path
+
+    original_path = os.path.join(settings.MEDIA_ROOT, name)
+    if not os.path.exists(original_path):
+        return None
+
+    os.makedirs(os.path.dirname(variant_path), exist_ok=True)
+    quality = getattr(settings, 'FACE_IMAGE_VARIANT_QUALITY', DEFAULT_VARIANT_QUALITY)
+    with Image.open(original_path) as original:
+        image_format = original.format or 'JPEG'
+        image = ImageOps.exif_transpose(original)
+        if image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+        image.thumbnail((size, size), Image.LANCZOS)
+
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(variant_path), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as temp_file:
+                image.save(temp_file, format=image_format, quality=quality, optimize=True)
+            os.replace(temp_path, variant_path)
+        except Exception:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+    return variant_path
+
+
+def generate_variants(name):
+    """Pre-generate every configured variant of a freshly uploaded face image"""
+    if not name or not getattr(settings, 'FACE_IMAGE_VARIANTS_ON_UPLOAD', True):
+        return
+    for size in get_variant_sizes():
+        try:
+            get_or_create_variant(name, size)
+        except Exception as e:
+            logger.warning("Could not generate %spx variant of %s: %s", size, name, e)
+
+
+def variant_urls(request, name):
+    """Absolute URLs of every variant of the face image stored as name"""
+    if not name:
+        return {}
+    return {
+        str(size): request.build_absolute_uri(reverse('face-image-variant', args=[size, name]))
+        for size in get_variant_sizes()
+    }
+
+
+def thumbnail_url(request, name, min_side):
+    """Absolute URL of the smallest variant at least min_side pixels long (else the largest)"""
+    if not name:
+        return None
+    sizes = sorted(get_variant_sizes())
+    size = next((size for size in sizes if size >= min_side), sizes[-1])
+    return request.build_absolute_uri(reverse('face-image-variant', args=[size, name]))
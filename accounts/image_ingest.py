@@ -0,0 +1,149 @@
+import hashlib
+import io
+import logging
+import os
+
+from django.conf import settings
+from django.core.files.base import ContentFile, File
+from django.core.files.storage import FileSystemStorage
+from django.utils import timezone
+from PIL import Image, ImageOps
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_FACE_IMAGE_MAX_SIDE = 800
+DEFAULT_FACE_IMAGE_FORMAT = 'JPEG'
+DEFAULT_FACE_IMAGE_QUALITY = 90
+# Limits checked before an upload is decoded (decompression bombs)
+DEFAULT_FACE_IMAGE_MAX_UPLOAD_SIZE = 5 * 1024 * 1024  # bytes
+DEFAULT_FACE_IMAGE_MAX_PIXELS = 24_000_000  # e.g. 6000 x 4000
+
+FORMAT_EXTENSIONS = {'JPEG': 'jpg', 'WEBP': 'webp'}
+
+
+class DecodedImage(File):
+    """
+    An uploaded image that is read and decoded exactly once.
+    
+    The raw bytes are read from the upload a single time and kept in memory;
+    the PIL image and the OpenCV (BGR) array are decoded lazily and cached, so
+    validation, normalization, face encoding and storage all share them
+    instead of each re-reading and re-decoding the file.
+    """
+    
+    def __init__(self, data, name, content_type=None, pil_image=None):
+        super().__init__(io.BytesIO(data), name=name)
+        self.data = data
+        self.content_type = content_type
+        self._pil_image = pil_image
+        self._bgr = None
+    
+    @classmethod
+    def from_upload(cls, uploaded_file):
+        """Read an UploadedFile once and wrap its bytes"""
+        if hasattr(uploaded_file, 'seek'):
+            uploaded_file.seek(0)
+        data = uploaded_file.read()
+        return cls(data, uploaded_file.name, getattr(uploaded_file, 'content_type', None))
+    
+    @property
+    def size(self):
+        return len(self.data)
+    
+    @property
+    def dimensions(self):
+        """(width, height) read from the image header, without decoding the pixels"""
+        if self._pil_image is not None:
+            return self._pil_image.size
+        with Image.open(io.BytesIO(self.data)) as image:
+            return image.size
+    
+    @property
+    def pil_image(self):
+        """Fully decoded PIL image (decoding also validates the file)"""
+        if self._pil_image is None:
+            image = Image.open(io.BytesIO(self.data))
+            image.load()
+            self._pil_image = image
+        return self._pil_image
+    
+    @property
+    def bgr(self):
+        """EXIF-oriented image as a contiguous BGR uint8 array for OpenCV"""
+        if self._bgr is None:
+            image = ImageOps.exif_transpose(self.pil_image).convert('RGB')
+            self._bgr = np.ascontiguousarray(np.asarray(image)[:, :, ::-1])
+        return self._bgr
+
+
+def get_originals_storage():
+    """Storage for untouched uploads, kept outside MEDIA_ROOT so it is never served"""
+    location = getattr(settings, 'FACE_ORIGINALS_ROOT', os.path.join(settings.BASE_DIR, 'face_originals'))
+    return FileSystemStorage(location=location)
+
+
+def keep_original(uploaded_file, data):
+    """Archive the original upload bytes in cold storage, named by content hash"""
+    ext = os.path.splitext(uploaded_file.name)[1].lower() or '.jpg'
+    digest = hashlib.sha256(data).hexdigest()
+    name = os.path.join(timezone.now().strftime('%Y/%m'), f"{digest}{ext}")
+    storage = get_originals_storage()
+    if not storage.exists(name):
+        storage.save(name, ContentFile(data))
+    return name
+
+
+def normalize_face_image(uploaded_file):
+    """
+    Normalize an uploaded face image before it is stored
+
+    Applies the EXIF orientation, caps the longest side at FACE_IMAGE_MAX_SIDE,
+    re-encodes at FACE_IMAGE_QUALITY in FACE_IMAGE_FORMAT (JPEG or WEBP) and
+    drops all metadata. With FACE_IMAGE_KEEP_ORIGINALS the untouched upload is
+    archived under FACE_ORIGINALS_ROOT first.
+
+    Args:
+        uploaded_file: Uploaded image file or DecodedImage (already validated)
+
+    Returns:
+        DecodedImage with the normalized image, or the original file if it
+        could not be processed
+    """
+    max_side = getattr(settings, 'FACE_IMAGE_MAX_SIDE', DEFAULT_FACE_IMAGE_MAX_SIDE)
+    image_format = getattr(settings, 'FACE_IMAGE_FORMAT', DEFAULT_FACE_IMAGE_FORMAT).upper()
+    quality = getattr(settings, 'FACE_IMAGE_QUALITY', DEFAULT_FACE_IMAGE_QUALITY)
+
+    try:
+        if not isinstance(uploaded_file, DecodedImage):
+            uploaded_file = DecodedImage.from_upload(uploaded_file)
+        data = uploaded_file.data
+
+        if getattr(settings, 'FACE_IMAGE_KEEP_ORIGINALS', False):
+            keep_original(uploaded_file, data)
+
+        # Rotate according to the EXIF orientation tag, then discard EXIF
+        image = ImageOps.exif_transpose(uploaded_file.pil_image).convert('RGB')
+        if max(image.size) > max_side:
+            image.thumbnail((max_side, max_side), Image.LANCZOS)
+
+        output = io.BytesIO()
+        # Not passing exif/icc_profile strips all metadata from the output
+        image.save(output, format=image_format, quality=quality, optimize=True)
+
+        root = os.path.splitext(os.path.basename(uploaded_file.name))[0]
+        extension = FORMAT_EXTENSIONS.get(image_format, image_format.lower())
+        # Hand the already decoded pixels on so face encoding does not decode the JPEG again
+        normalized = DecodedImage(
+            output.getvalue(),
+            name=f"{root}.{extension}",
+            content_type=Image.MIME.get(image_format),
+            pil_image=image
+        )
+
+        logger.info("Normalized face image %s: %s -> %s bytes", uploaded_file.name, len(data), normalized.size)
+        return normalized
+    except Exception as e:
+        logger.warning("Could not normalize face image %s: %s", uploaded_file.name, e)
+        uploaded_file.seek(0)
+        return uploaded_file
@@ -0,0 +1,132 @@
+import itertools
+import random
+import statistics
+import time
+from collections import defaultdict
+
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import override_settings
+
+from accounts.face_recognition_utils import (
+    get_face_encoding, preprocess_image, preprocess_image_legacy, verify_face_encodings,
+)
+from accounts.image_ingest import DecodedImage
+from accounts.models import UserFaceImage
+
+MODES = {
+    'legacy': preprocess_image_legacy,
+    'fast': preprocess_image,
+}
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare the legacy and fast preprocess_image: time per image, time '
+        'per full encoding, and verification accuracy (genuine accept and '
+        'false accept rates) over enrolled UserFaceImage photos.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=50,
+                            help='Number of enrolled users (with at least two photos) to use')
+        parser.add_argument('--impostor-pairs', type=int, default=500,
+                            help='Number of random different-user pairs compared')
+        parser.add_argument('--repeat', type=int, default=3,
+                            help='Timing repetitions of preprocess_image per photo')
+
+    def handle(self, *args, **options):
+        photos = self._load_photos(options['users'])
+        if len(photos) < 2:
+            raise CommandError('Need at least two users with two or more enrolled photos')
+        count = sum(len(images) for images in photos.values())
+        self.stdout.write(f'{count} photos of {len(photos)} users')
+
+        rng = random.Random(0)
+        users = sorted(photos)
+        impostor_pairs = []
+        for _ in range(options['impostor_pairs']):
+            first, second = rng.sample(users, 2)
+            impostor_pairs.append(((first, rng.randrange(len(photos[first]))),
+                                   (second, rng.randrange(len(photos[second])))))
+
+        results = {}
+        for mode, preprocess in MODES.items():
+            # Bypass the encoding cache so every photo is really encoded
+            with override_settings(FACE_PREPROCESSING=mode, FACE_ENCODING_CACHE_ENABLED=False):
+                results[mode] = self._run(mode, preprocess, photos, impostor_pairs, options['repeat'])
+
+        legacy, fast = results['legacy'], results['fast']
+        self.stdout.write(
+            f"fast preprocessing is {legacy['preprocess_ms'] / fast['preprocess_ms']:.1f}x faster, "
+            f"encoding {legacy['encode_ms'] / fast['encode_ms']:.1f}x faster; "
+            f"genuine accept {fast['tar'] - legacy['tar']:+.1%}, false accept {fast['far'] - legacy['far']:+.1%}"
+        )
+        if fast['tar'] < legacy['tar'] or fast['far'] > legacy['far']:
+            self.stdout.write(self.style.WARNING('fast preprocessing is less accurate on this data'))
+        else:
+            self.stdout.write(self.style.SUCCESS('fast preprocessing is at least as accurate on this data'))
+
+    def _load_photos(self, max_users):
+        """{user_id: [DecodedImage, ...]} for users with at least two readable photos"""
+        by_user = defaultdict(list)
+        for user_id, name in UserFaceImage.objects.order_by('user_id', 'angle_index').values_list('user_id', 'image'):
+            by_user[user_id].append(name)
+
+        storage = UserFaceImage._meta.get_field('image').storage
+        photos = {}
+        for user_id, names in by_user.items():
+            if len(photos) >= max_users:
+                break
+            images = []
+            for name in names:
+                try:
+                    with storage.open(name, 'rb') as f:
+                        image = DecodedImage(f.read(), name)
+                    image.bgr
+                except Exception as e:
+                    self.stderr.write(f'{name}: {e}')
+                    continue
+                images.append(image)
+            if len(images) >= 2:
+                photos[user_id] = images
+        return photos
+
+    def _run(self, mode, preprocess, photos, impostor_pairs, repeat):
+        timings = []
+        for images in photos.values():
+            for image in images:
+                for _ in range(max(1, repeat)):
+                    started = time.perf_counter()
+                    preprocess(image.bgr)
+                    timings.append((time.perf_counter() - started) * 1000)
+
+        encodings = {}
+        started = time.perf_counter()
+        for user_id, images in photos.items():
+            encodings[user_id] = [get_face_encoding(image) for image in images]
+        encode_ms = (time.perf_counter() - started) * 1000 / sum(len(images) for images in photos.values())
+        no_face = sum(encoding is None for user_encodings in encodings.values() for encoding in user_encodings)
+
+        genuine = [
+            verify_face_encodings(first, second)['match']
+            for user_encodings in encodings.values()
+            for first, second in itertools.combinations(user_encodings, 2)
+        ]
+        impostor = [
+            verify_face_encodings(encodings[first][i], encodings[second][j])['match']
+            for (first, i), (second, j) in impostor_pairs
+        ]
+
+        result = {
+            'preprocess_ms': statistics.mean(timings),
+            'encode_ms': encode_ms,
+            'tar': sum(genuine) / len(genuine),
+            'far': sum(impostor) / len(impostor) if impostor else 0.0,
+        }
+        self.stdout.write(
+            f"{mode}: preprocess {result['preprocess_ms']:.1f} ms "
+            f"(median {statistics.median(timings):.1f}), encoding {encode_ms:.1f} ms/photo, "
+            f"no face {no_face}, genuine accept {result['tar']:.1%} of {len(genuine)}, "
+            f"false accept {result['far']:.1%} of {len(impostor)}"
+        )
+        return result
@@ -0,0 +1,20 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from accounts.face_gallery import get_gallery_path, rebuild_gallery
+
+
+class Command(BaseCommand):
+    help = (
+        'Rebuild the memory-mapped face embedding gallery from the stored '
+        'UserFaceImage templates. Running workers pick up the new file on '
+        'their next lookup.'
+    )
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        count = rebuild_gallery()
+        self.stdout.write(self.style.SUCCESS(
+            f'Wrote {count} embeddings to {get_gallery_path()} in {time.monotonic() - started:.1f}s'
+        ))
@@ -0,0 +1,164 @@
+import os
+import time
+
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from accounts.face_embedders import (
+    FACENET_INPUT_SIZE, OnnxEmbedder, TorchEmbedder, TorchScriptEmbedder,
+    get_model_dir, get_model_path, load_eager_facenet, prepare_facenet_batch,
+)
+from accounts.face_media import iter_face_media_files
+from accounts.face_variants import original_name_for_variant
+
+
+def cosine_similarities(reference, candidate):
+    """Row-wise cosine similarity between two (N, D) embedding matrices"""
+    reference = reference / np.linalg.norm(reference, axis=1, keepdims=True)
+    candidate = candidate / np.linalg.norm(candidate, axis=1, keepdims=True)
+    return np.sum(reference * candidate, axis=1)
+
+
+class Command(BaseCommand):
+    help = (
+        'Export the FaceNet embedder to ONNX (fp32 and int8 dynamically '
+        'quantized) and TorchScript for FACENET_BACKEND, then check every '
+        'exported model against the eager PyTorch embeddings.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output-dir', default=None,
+                            help='Where to write the models (default: FACENET_MODEL_DIR)')
+        parser.add_argument('--opset', type=int, default=17, help='ONNX opset version')
+        parser.add_argument('--no-quantize', action='store_true',
+                            help='Skip the int8 dynamically quantized ONNX model')
+        parser.add_argument('--no-torchscript', action='store_true',
+                            help='Skip the TorchScript model')
+        parser.add_argument('--images', default=None,
+                            help='Directory of face images for the parity check '
+                                 '(default: stored face images under MEDIA_ROOT)')
+        parser.add_argument('--samples', type=int, default=32,
+                            help='Number of images used for the parity check')
+        parser.add_argument('--min-similarity', type=float, default=0.999,
+                            help='Minimum cosine similarity to the eager embeddings (fp32 models)')
+        parser.add_argument('--min-similarity-int8', type=float, default=0.98,
+                            help='Minimum cosine similarity to the eager embeddings (int8 model)')
+
+    def handle(self, *args, **options):
+        try:
+            import torch
+        except ImportError:
+            raise CommandError('PyTorch and facenet-pytorch are required to export FaceNet')
+
+        output_dir = options['output_dir'] or get_model_dir()
+        os.makedirs(output_dir, exist_ok=True)
+        paths = {
+            'onnx': os.path.join(output_dir, os.path.basename(get_model_path('onnx'))),
+            'onnx-int8': os.path.join(output_dir, os.path.basename(get_model_path('onnx', quantized=True))),
+            'torchscript': os.path.join(output_dir, os.path.basename(get_model_path('torchscript'))),
+        }
+
+        model = load_eager_facenet()
+        dummy = torch.rand(1, 3, FACENET_INPUT_SIZE, FACENET_INPUT_SIZE)
+
+        self.stdout.write(f"Exporting ONNX model to {paths['onnx']}")
+        torch.onnx.export(
+            model, dummy, paths['onnx'],
+            input_names=['input'], output_names=['embedding'],
+            dynamic_axes={'input': {0: 'batch'}, 'embedding': {0: 'batch'}},
+            opset_version=options['opset'],
+        )
+        candidates = {'onnx': paths['onnx']}
+
+        if not options['no_quantize']:
+            try:
+                from onnxruntime.quantization import QuantType, quantize_dynamic
+            except ImportError:
+                raise CommandError('onnxruntime is required for the quantized model (or pass --no-quantize)')
+            self.stdout.write(f"Writing int8 dynamically quantized model to {paths['onnx-int8']}")
+            quantize_dynamic(paths['onnx'], paths['onnx-int8'], weight_type=QuantType.QInt8)
+            candidates['onnx-int8'] = paths['onnx-int8']
+
+        if not options['no_torchscript']:
+            self.stdout.write(f"Tracing TorchScript model to {paths['torchscript']}")
+            with torch.no_grad():
+                torch.jit.trace(model, dummy).save(paths['torchscript'])
+            candidates['torchscript'] = paths['torchscript']
+
+        self._check_parity(TorchEmbedder(model), candidates, options)
+
+    # Parity check
+
+    def _parity_batch(self, options):
+        """
+        Face crops exactly as the pipeline feeds FaceNet: detected, aligned
+        and preprocessed by compute_face_encoding, converted to RGB
+        """
+        from accounts.face_recognition_utils import compute_face_encoding, facenet_rgb
+
+        crops = []
+        for path in self._image_paths(options['images']):
+            try:
+                encoding = compute_face_encoding(path)
+            except Exception as e:
+                self.stderr.write(f'{path}: {e}')
+                continue
+            if encoding is not None and encoding.get('preprocessed_face') is not None:
+                crops.append(facenet_rgb(encoding['preprocessed_face']))
+            if len(crops) >= options['samples']:
+                break
+
+        if not crops:
+            raise CommandError(
+                'No face found for the parity check; the models were written but not verified. '
+                'Pass --images with a directory of face photos.'
+            )
+        if len(crops) < options['samples']:
+            self.stdout.write(self.style.WARNING(f"Only {len(crops)} face crops for the parity check"))
+        return prepare_facenet_batch(crops)
+
+    def _image_paths(self, directory):
+        if directory:
+            for dirpath, _, filenames in os.walk(directory):
+                for filename in sorted(filenames):
+                    if filename.lower().endswith(('.jpg', '.jpeg', '.png', '.webp')):
+                        yield os.path.join(dirpath, filename)
+        else:
+            for name in iter_face_media_files(min_age=0):
+                # Thumbnails are too small to stand in for real crops
+                if original_name_for_variant(name) is None:
+                    yield os.path.join(settings.MEDIA_ROOT, name)
+
+    def _check_parity(self, eager, candidates, options):
+        batch = self._parity_batch(options)
+        reference, eager_ms = self._timed_embed(eager, batch)
+        self.stdout.write(f'eager torch: {eager_ms:.1f} ms/face over {len(batch)} samples')
+
+        failures = []
+        for key, path in candidates.items():
+            embedder = TorchScriptEmbedder(path) if key == 'torchscript' else OnnxEmbedder(path, quantized=key == 'onnx-int8')
+            embeddings, ms = self._timed_embed(embedder, batch)
+            similarity = cosine_similarities(reference, embeddings)
+            threshold = options['min_similarity_int8'] if key == 'onnx-int8' else options['min_similarity']
+            size_mb = os.path.getsize(path) / (1024 * 1024)
+            line = (f'{key}: {ms:.1f} ms/face ({eager_ms / ms:.1f}x), {size_mb:.1f} MB, '
+                    f'cosine min={similarity.min():.5f} mean={similarity.mean():.5f}')
+            if similarity.min() < threshold:
+                failures.append(key)
+                self.stdout.write(self.style.ERROR(f'{line} < {threshold}'))
+            else:
+                self.stdout.write(self.style.SUCCESS(line))
+
+        if failures:
+            raise CommandError(
+                f"Parity check failed for {', '.join(failures)}; do not select them with FACENET_BACKEND"
+            )
+        self.stdout.write(self.style.SUCCESS('All exported models match the eager embeddings'))
+
+    def _timed_embed(self, embedder, batch):
+        """Embed one face at a time, as the verification path does, and time it"""
+        embedder.embed(batch[:1])  # warm up
+        started = time.perf_counter()
+        embeddings = np.concatenate([embedder.embed(batch[i:i + 1]) for i in range(len(batch))])
+        return embeddings, (time.perf_counter() - started) * 1000 / len(batch)
@@ -0,0 +1,95 @@
+import os
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from accounts.face_media import face_media_reference_counts, iter_face_media_files
+from accounts.face_variants import original_name_for_variant
+
+
+class Command(BaseCommand):
+    help = (
+        'Delete face image files under MEDIA_ROOT/face_recognition that no '
+        'UserProfile or UserFaceImage row references any more, together with '
+        'their thumbnails. Files are checked and removed in bounded batches.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Number of files checked against the database per batch')
+        parser.add_argument('--min-age', type=int, default=3600,
+                            help='Skip files modified less than this many seconds ago')
+        parser.add_argument('--sleep', type=float, default=0.0,
+                            help='Seconds to pause between batches to limit I/O pressure')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Report orphaned files without deleting them')
+
+    def handle(self, *args, **options):
+        self.verbosity = options['verbosity']
+        batch_size = max(1, options['batch_size'])
+        dry_run = options['dry_run']
+        stats = {'scanned': 0, 'orphaned': 0, 'deleted': 0, 'bytes_freed': 0}
+        started = time.monotonic()
+
+        batch = []
+        for name in iter_face_media_files(min_age=options['min_age']):
+            batch.append(name)
+            if len(batch) >= batch_size:
+                self._sweep(batch, stats, dry_run, options['min_age'])
+                batch = []
+                if options['sleep']:
+                    time.sleep(options['sleep'])
+        self._sweep(batch, stats, dry_run, options['min_age'])
+
+        elapsed = time.monotonic() - started
+        verb = 'Would free' if dry_run else 'Freed'
+        self.stdout.write(self.style.SUCCESS(
+            f"Scanned {stats['scanned']} files, {stats['orphaned']} orphaned, "
+            f"{stats['deleted']} deleted. {verb} {stats['bytes_freed'] / (1024 * 1024):.1f} MB "
+            f"in {elapsed:.1f}s"
+        ))
+
+    def _sweep(self, batch, stats, dry_run, min_age):
+        """Delete the files in batch that are not referenced by any row"""
+        if not batch:
+            return
+
+        stats['scanned'] += len(batch)
+        # Thumbnails live as long as the face image they were generated from
+        owners = {name: original_name_for_variant(name) or name for name in batch}
+        referenced = face_media_reference_counts(set(owners.values()))
+
+        for name in batch:
+            if referenced.get(owners[name]):
+                continue
+
+            # An upload of identical bytes touches the stored file before its
+            # row is committed, so recheck the age of the file (and of the
+            # original a thumbnail belongs to) right before deleting it
+            full_path = os.path.join(settings.MEDIA_ROOT, name)
+            if self._recently_modified({name, owners[name]}, min_age):
+                continue
+            stats['orphaned'] += 1
+
+            try:
+                size = os.path.getsize(full_path)
+                if not dry_run:
+                    os.remove(full_path)
+                    stats['deleted'] += 1
+                stats['bytes_freed'] += size
+            except OSError as e:
+                self.stderr.write(f'Could not remove {name}: {e}')
+
+            if self.verbosity > 1:
+                self.stdout.write(f"{'Would delete' if dry_run else 'Deleted'} {name}")
+
+    def _recently_modified(self, names, min_age):
+        cutoff = time.time() - min_age
+        for name in names:
+            try:
+                if os.path.getmtime(os.path.join(settings.MEDIA_ROOT, name)) > cutoff:
+                    return True
+            except OSError:
+                continue
+        return False
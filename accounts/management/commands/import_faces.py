@@ -0,0 +1,291 @@
+import json
+import multiprocessing
+import os
+import re
+import time
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+from django.contrib.auth import get_user_model
+from django.core.files.base import ContentFile
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from accounts.face_enrollment import ingest_photo_from_bytes, init_enrollment_worker
+from accounts.face_gallery import gallery_enabled, rebuild_gallery
+from accounts.face_variants import generate_variants
+from accounts.models import UserFaceImage
+from accounts.serializers import MAX_FACE_ANGLES
+
+User = get_user_model()
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+# File stems naming an angle in the <email>/<file> layout: '3' or 'angle_3'
+ANGLE_STEM = re.compile(r'(?:angle_)?(\d+)', re.IGNORECASE)
+
+
+def _email_from_folder(folder):
+    """Accept either a plain email or the safe form used under media/face_recognition"""
+    if '@' in folder:
+        return folder.lower()
+    return folder.replace('_at_', '@').replace('_dot_', '.').lower()
+
+
+def parse_entry_name(path):
+    """
+    Map a photo path to (email, angle_index or None)
+
+    Supported layouts:
+        <email>/<angle>.jpg        e.g. jane@corp.com/3.jpg or jane@corp.com/angle_3.jpg
+        <email>/<anything>.jpg     angle assigned in sorted order (e.g. IMG_0042.jpg)
+        <email>.jpg                angle assigned in sorted order
+        <email>__<angle>.jpg       e.g. jane@corp.com__3.jpg
+    """
+    parts = [p for p in path.replace('\\', '/').split('/') if p]
+    stem = os.path.splitext(parts[-1])[0]
+
+    if len(parts) >= 2 and ('@' in parts[-2] or '_at_' in parts[-2]):
+        email = _email_from_folder(parts[-2])
+        match = ANGLE_STEM.fullmatch(stem)
+        return email, int(match.group(1)) if match else None
+
+    if '__' in stem:
+        email, angle = stem.rsplit('__', 1)
+        return email.lower(), int(angle) if angle.isdigit() else None
+    return stem.lower(), None
+
+
+class Command(BaseCommand):
+    help = (
+        'Bulk-import employee face photos from a directory or zip file. '
+        'Photos are matched to users by email, normalized and encoded like '
+        'uploads in a process pool, and UserFaceImage rows are written with '
+        'bulk_create. '
+        'Re-running with the same --state-file resumes where it stopped.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('source', help='Directory or .zip file containing the photos')
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                            help='Number of worker processes for template extraction')
+        parser.add_argument('--batch-size', type=int, default=50,
+                            help='Number of rows written per bulk_create')
+        parser.add_argument('--state-file', default=None,
+                            help='File recording imported entries (default: <source>.import_state)')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Extract and validate templates without writing anything')
+
+    def handle(self, *args, **options):
+        source = options['source']
+        if not os.path.exists(source):
+            raise CommandError(f'Source not found: {source}')
+
+        self.dry_run = options['dry_run']
+        self.batch_size = max(1, options['batch_size'])
+        self.state_file = options['state_file'] or f"{source.rstrip(os.sep)}.import_state"
+        self.done = self._load_state()
+        self.stats = {'imported': 0, 'resumed': 0, 'unknown_user': 0, 'rejected': 0, 'errors': 0}
+        self.pending = []
+
+        users = {u.email.lower(): u for u in User.objects.only('id', 'email')}
+        self.started = time.monotonic()
+
+        with self._open_source(source) as entries:
+            work = self._plan(entries, users)
+            self._run(work, max(1, options['workers']))
+
+        self._flush()
+        self._report(final=True)
+
+        # bulk_create sends no signals, so refresh the shared gallery here
+        if not self.dry_run and self.stats['imported'] and gallery_enabled():
+            count = rebuild_gallery()
+            self.stdout.write(f'Rebuilt face gallery with {count} embeddings')
+
+    # Source handling
+
+    def _open_source(self, source):
+        if zipfile.is_zipfile(source):
+            return _ZipSource(source)
+        if os.path.isdir(source):
+            return _DirectorySource(source)
+        raise CommandError('Source must be a directory or a zip file')
+
+    def _plan(self, entries, users):
+        """Yield (key, user, angle_index, entry) for every photo still to import"""
+        next_angle = {}
+        for key in entries.names():
+            email, angle_index = parse_entry_name(key)
+            user = users.get(email)
+            if user is None:
+                self.stats['unknown_user'] += 1
+                self.stderr.write(f'{key}: no user with email {email}')
+                continue
+
+            if angle_index is None:
+                angle_index = next_angle.get(user.pk, 0)
+            next_angle[user.pk] = max(next_angle.get(user.pk, 0), angle_index + 1)
+
+            if not 0 <= angle_index < MAX_FACE_ANGLES:
+                self.stats['errors'] += 1
+                self.stderr.write(f'{key}: angle index must be between 0 and {MAX_FACE_ANGLES - 1}')
+                continue
+
+            if key in self.done:
+                self.stats['resumed'] += 1
+                continue
+
+            yield key, user, angle_index, entries
+
+    def _run(self, work, workers):
+        """Stream photos through the process pool, keeping a bounded number in flight"""
+        context = multiprocessing.get_context('spawn')
+        max_in_flight = workers * 2
+        in_flight = {}
+
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=init_enrollment_worker) as pool:
+            for key, user, angle_index, entries in work:
+                future = pool.submit(ingest_photo_from_bytes, os.path.basename(key), entries.read(key))
+                in_flight[future] = (key, user, angle_index)
+
+                if len(in_flight) >= max_in_flight:
+                    finished, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                    for future in finished:
+                        self._collect(future, *in_flight.pop(future))
+
+            for future in list(in_flight):
+                self._collect(future, *in_flight.pop(future))
+
+    def _collect(self, future, key, user, angle_index):
+        try:
+            result = future.result()
+        except Exception as e:
+            self.stats['errors'] += 1
+            self.stderr.write(f'{key}: {e}')
+            return
+
+        if not result['accepted']:
+            self.stats['rejected'] += 1
+            self.stderr.write(f"{key}: {result['reason']}")
+            return
+
+        # The normalized image is stored, not the original upload
+        self.pending.append((key, user, angle_index, result['name'], result['data'],
+                             result['template'], result['template_version']))
+        if len(self.pending) >= self.batch_size:
+            self._flush()
+
+    # Persistence
+
+    def _flush(self):
+        """Save the pending photos and upsert their rows with one bulk_create"""
+        if not self.pending:
+            return
+
+        batch, self.pending = self.pending, []
+
+        # Later photos for the same angle win, as with repeated uploads; the
+        # ones they supersede are marked done but not counted as imported
+        latest = {}
+        for entry in batch:
+            key, user, angle_index = entry[:3]
+            latest[(user.pk, angle_index)] = entry
+        if self.dry_run:
+            self.stats['imported'] += len(latest)
+            self._report()
+            return
+
+        rows = []
+        for key, user, angle_index, name, data, template, template_version in latest.values():
+            instance = UserFaceImage(user=user, angle_index=angle_index,
+                                     template=template, template_version=template_version)
+            # Store the file through the field so upload_to/storage naming applies
+            instance.image.save(name, ContentFile(data), save=False)
+            rows.append(instance)
+
+        with transaction.atomic():
+            UserFaceImage.objects.bulk_create(
+                rows,
+                update_conflicts=True,
+                unique_fields=['user', 'angle_index'],
+                update_fields=['image', 'template', 'template_version', 'updated_at'],
+            )
+        # Thumbnails, as the upload views make them
+        for instance in rows:
+            generate_variants(instance.image.name)
+
+        self._save_state(key for key, *_ in batch)
+        self.stats['imported'] += len(rows)
+        self._report()
+
+    def _load_state(self):
+        if not os.path.exists(self.state_file):
+            return set()
+        with open(self.state_file) as f:
+            return {json.loads(line) for line in f if line.strip()}
+
+    def _save_state(self, keys):
+        with open(self.state_file, 'a') as f:
+            for key in keys:
+                f.write(json.dumps(key) + '\n')
+                self.done.add(key)
+
+    def _report(self, final=False):
+        elapsed = time.monotonic() - self.started
+        rate = self.stats['imported'] / elapsed if elapsed > 0 else 0.0
+        summary = ', '.join(f'{name}={count}' for name, count in self.stats.items())
+        message = f'{summary} in {elapsed:.1f}s ({rate:.2f} photos/s)'
+        if final:
+            self.stdout.write(self.style.SUCCESS(f'Import finished: {message}'))
+        else:
+            self.stdout.write(message)
+
+
+class _DirectorySource:
+    """Photo entries found by walking a directory tree"""
+
+    def __init__(self, root):
+        self.root = root
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def names(self):
+        names = []
+        for dirpath, _, filenames in os.walk(self.root):
+            for filename in filenames:
+                if filename.lower().endswith(IMAGE_EXTENSIONS):
+                    names.append(os.path.relpath(os.path.join(dirpath, filename), self.root).replace(os.sep, '/'))
+        return sorted(names)
+
+    def read(self, name):
+        with open(os.path.join(self.root, name), 'rb') as f:
+            return f.read()
+
+
+class _ZipSource:
+    """Photo entries read one at a time from a zip archive"""
+
+    def __init__(self, path):
+        self.path = path
+        self.archive = None
+
+    def __enter__(self):
+        self.archive = zipfile.ZipFile(self.path)
+        return self
+
+    def __exit__(self, *exc):
+        self.archive.close()
+        return False
+
+    def names(self):
+        return sorted(
+            info.filename for info in self.archive.infolist()
+            if not info.is_dir() and info.filename.lower().endswith(IMAGE_EXTENSIONS)
+        )
+
+    def read(self, name):
+        return self.archive.read(name)
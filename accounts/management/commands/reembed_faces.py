@@ -0,0 +1,143 @@
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from accounts.face_enrollment import extract_template_from_bytes, init_enrollment_worker
+from accounts.face_gallery import gallery_enabled, rebuild_gallery
+from accounts.face_templates import pipeline_version
+from accounts.models import UserFaceImage
+
+
+class Command(BaseCommand):
+    help = (
+        'Recompute UserFaceImage templates that are missing or were made by '
+        'an older pipeline version. Photos are encoded in a process pool at '
+        'a bounded rate; an interrupted run resumes where it stopped because '
+        'only stale rows are selected. Photos the current version rejects are '
+        'recorded with an empty template and skipped by later runs.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=max(1, (os.cpu_count() or 2) // 2),
+                            help='Number of worker processes (default: half the cores, '
+                                 'leaving the rest for check-ins)')
+        parser.add_argument('--batch-size', type=int, default=50,
+                            help='Number of templates written per transaction')
+        parser.add_argument('--rate', type=float, default=0,
+                            help='Maximum photos per second submitted for encoding (0: unlimited)')
+        parser.add_argument('--limit', type=int, default=None,
+                            help='Stop after this many photos')
+        parser.add_argument('--all', action='store_true',
+                            help='Recompute every template, not only stale ones')
+
+    def handle(self, *args, **options):
+        self.version = pipeline_version()
+        self.batch_size = max(1, options['batch_size'])
+        self.stats = {'updated': 0, 'rejected': 0, 'missing': 0, 'changed': 0, 'errors': 0}
+        self.pending = []
+
+        rows = UserFaceImage.objects.order_by('pk')
+        if not options['all']:
+            # Photos this version rejected carry its tag with an empty template
+            rows = rows.exclude(template_version=self.version)
+        rows = rows.values_list('pk', 'image')
+        if options['limit']:
+            rows = rows[:options['limit']]
+
+        self.total = rows.count()
+        self.stdout.write(f'Re-embedding {self.total} face image(s) for pipeline version {self.version}')
+        if not self.total:
+            return
+
+        self.started = time.monotonic()
+        self._run(rows.iterator(), max(1, options['workers']), options['rate'])
+        self._flush()
+        self._report(final=True)
+
+        # Queryset updates send no signals, so refresh the shared gallery here
+        if self.stats['updated'] and gallery_enabled():
+            count = rebuild_gallery()
+            self.stdout.write(f'Rebuilt face gallery with {count} embeddings')
+
+    def _read(self, name):
+        with UserFaceImage._meta.get_field('image').storage.open(name, 'rb') as f:
+            return f.read()
+
+    def _run(self, rows, workers, rate):
+        """Stream photos through the process pool, paced to at most rate photos per second"""
+        context = multiprocessing.get_context('spawn')
+        max_in_flight = workers * 2
+        in_flight = {}
+        submitted = 0
+
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=init_enrollment_worker) as pool:
+            for pk, name in rows:
+                if rate > 0:
+                    delay = self.started + submitted / rate - time.monotonic()
+                    if delay > 0:
+                        time.sleep(delay)
+                try:
+                    data = self._read(name)
+                except (OSError, ValueError) as e:
+                    self.stats['missing'] += 1
+                    self.stderr.write(f'{name}: {e}')
+                    continue
+
+                in_flight[pool.submit(extract_template_from_bytes, os.path.basename(name), data)] = (pk, name)
+                submitted += 1
+
+                if len(in_flight) >= max_in_flight:
+                    finished, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                    for future in finished:
+                        self._collect(future, *in_flight.pop(future))
+
+            for future in list(in_flight):
+                self._collect(future, *in_flight.pop(future))
+
+    def _collect(self, future, pk, name):
+        try:
+            result = future.result()
+        except Exception as e:
+            self.stats['errors'] += 1
+            self.stderr.write(f'{name}: {e}')
+            return
+
+        if not result['accepted']:
+            # Recorded with an empty template, so the next run skips the photo
+            self.stats['rejected'] += 1
+            self.stderr.write(f"{name}: {result['reason']}")
+            self.pending.append((pk, name, None, self.version))
+        else:
+            self.pending.append((pk, name, result['template'], result['template_version']))
+        if len(self.pending) >= self.batch_size:
+            self._flush()
+
+    def _flush(self):
+        """Write the pending templates, skipping rows whose photo was replaced meanwhile"""
+        if not self.pending:
+            return
+
+        batch, self.pending = self.pending, []
+        with transaction.atomic():
+            for pk, name, template, template_version in batch:
+                updated = UserFaceImage.objects.filter(pk=pk, image=name).update(
+                    template=template, template_version=template_version
+                )
+                if template is not None:
+                    self.stats['updated' if updated else 'changed'] += 1
+        self._report()
+
+    def _report(self, final=False):
+        elapsed = time.monotonic() - self.started
+        done = sum(self.stats.values())
+        rate = done / elapsed if elapsed > 0 else 0.0
+        remaining = (self.total - done) / rate if rate > 0 else 0.0
+        summary = ', '.join(f'{name}={count}' for name, count in self.stats.items())
+        if final:
+            self.stdout.write(self.style.SUCCESS(f'Re-embedding finished: {summary} in {elapsed:.1f}s'))
+        else:
+            self.stdout.write(f'{done}/{self.total} {summary} ({rate:.2f} photos/s, ~{remaining:.0f}s left)')
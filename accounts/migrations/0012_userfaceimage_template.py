@@ -0,0 +1,18 @@
+# Generated by Django 5.2.1 on 2026-10-19 09:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0011_add_angle_index_to_userfaceimage'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userfaceimage',
+            name='template',
+            field=models.BinaryField(blank=True, editable=False, help_text='Serialized face encoding extracted at enrollment time', null=True),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.1 on 2026-10-19 10:05
+
+import accounts.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0012_userfaceimage_template'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='userfaceimage',
+            name='image',
+            field=models.ImageField(storage=accounts.models.face_image_storage, upload_to=accounts.models.user_face_images_path),
+        ),
+        migrations.AlterField(
+            model_name='userprofile',
+            name='face_image',
+            field=models.ImageField(blank=True, null=True, storage=accounts.models.face_image_storage, upload_to=accounts.models.user_face_image_path),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.1 on 2026-10-19 11:40
+
+import django.db.models.deletion
+import uuid
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0013_face_image_content_addressed_storage'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FaceVerificationJob',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('status', models.CharField(choices=[('PENDING', 'Pending'), ('RUNNING', 'Running'), ('VERIFIED', 'Verified'), ('FAILED', 'Failed'), ('ERROR', 'Error')], default='PENDING', max_length=10)),
+                ('result', models.JSONField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('completed_at', models.DateTimeField(blank=True, null=True)),
+                ('attendance', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='face_verification_jobs', to='accounts.attendance')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='face_verification_jobs', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['-created_at'],
+            },
+        ),
+    ]
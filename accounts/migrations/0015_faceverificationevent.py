@@ -0,0 +1,38 @@
+# Generated by Django 5.2.1 on 2026-10-19 13:05
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0014_faceverificationjob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FaceVerificationEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('source', models.CharField(choices=[('sync', 'Synchronous check-in'), ('async', 'Async check-in'), ('deferred', 'Deferred check-in')], default='sync', max_length=10)),
+                ('matched', models.BooleanField(default=False, help_text='Final decision, including any development override')),
+                ('development_override', models.BooleanField(default=False)),
+                ('similarity', models.FloatField(blank=True, null=True)),
+                ('confidence', models.FloatField(blank=True, null=True)),
+                ('has_eyes', models.BooleanField(default=False)),
+                ('reference_angle', models.IntegerField(blank=True, help_text='angle_index of the best reference, empty for the profile image', null=True)),
+                ('references_tried', models.IntegerField(default=0)),
+                ('scores', models.JSONField(blank=True, default=dict, help_text='Per-method scores of the best comparison')),
+                ('timings', models.JSONField(blank=True, default=dict, help_text='Stage durations in milliseconds')),
+                ('error', models.CharField(blank=True, max_length=255)),
+                ('created_at', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='face_verification_events', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['-created_at'],
+            },
+        ),
+    ]
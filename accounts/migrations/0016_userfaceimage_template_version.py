@@ -0,0 +1,18 @@
+# Generated by Django 5.2.1 on 2026-10-19 13:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0015_faceverificationevent'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userfaceimage',
+            name='template_version',
+            field=models.CharField(blank=True, db_index=True, default='', editable=False, help_text='Pipeline version that produced the template', max_length=16),
+        ),
+    ]
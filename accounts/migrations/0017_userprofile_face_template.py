@@ -0,0 +1,23 @@
+# Generated by Django 5.2.1 on 2026-10-19 16:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0016_userfaceimage_template_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userprofile',
+            name='face_template',
+            field=models.BinaryField(blank=True, editable=False, help_text='Serialized face encoding of face_image extracted at upload time', null=True),
+        ),
+        migrations.AddField(
+            model_name='userprofile',
+            name='face_template_version',
+            field=models.CharField(blank=True, default='', editable=False, help_text='Pipeline version that produced face_template', max_length=16),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.1 on 2026-10-19 19:40
+
+import accounts.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0017_userprofile_face_template'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='faceverificationjob',
+            name='owner',
+            field=models.CharField(blank=True, default=accounts.models.current_job_owner, editable=False, help_text='Process holding the job in its in-memory queue', max_length=100),
+        ),
+    ]
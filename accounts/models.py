@@ -2,14 +2,34 @@ from django.db import models
 from django.contrib.auth.models import AbstractUser, BaseUserManager
 from django.utils.translation import gettext_lazy as _
 from django.utils import timezone
+from django.conf import settings
+from django.core.files import File
 from django.core.files.storage import FileSystemStorage
+import hashlib
+import json
 import os
+import socket
+import threading
+import uuid
+
+try:
+    import fcntl
+except ImportError:  # Windows: fall back to the in-process lock only
+    fcntl = None
 
 class SequentialFileStorage(FileSystemStorage):
     """Custom storage class that ensures files are stored sequentially with numeric suffixes"""
     # This class overrides the default Django behavior of using random strings
     # for duplicate filenames, using sequential numbers instead (1, 2, 3, etc.)
-        
+    #
+    # Instead of probing name_1, name_2, ... until a free slot is found, the
+    # next suffix for every file name is kept in a small per-directory index
+    # file and reserved under a lock, so allocating a name is O(1) and
+    # concurrent uploads never receive the same suffix.
+    
+    SEQUENCE_INDEX_NAME = '.sequence_index.json'
+    _process_lock = threading.Lock()
+    
     def get_available_name(self, name, max_length=None):
         """
         Returns a filename that's available in the storage system.
@@ -19,32 +39,137 @@ class SequentialFileStorage(FileSystemStorage):
         if not self.exists(name):
             return name
             
-        # If it exists, we need to find an available name with a numeric suffix
+        # If it exists, reserve the next numeric suffix from the directory index
         dir_name, file_name = os.path.split(name)
         file_root, file_ext = os.path.splitext(file_name)
         
-        # Start with suffix _1 and increment until we find an available name
-        counter = 1
+        # Handle max_length if specified, leaving room for a generous counter
+        if max_length:
+            overflow = len(os.path.join(dir_name, f"{file_root}_{'9' * 6}{file_ext}")) - max_length
+            if overflow > 0:
+                file_root = file_root[:-overflow]
+        
         while True:
+            counter = self.reserve_suffix(dir_name, file_root, file_ext)
             new_name = os.path.join(dir_name, f"{file_root}_{counter}{file_ext}")
-            
-            # If this name is available, return it
+            # The index only goes stale if files were added behind its back
             if not self.exists(new_name):
-                # Handle max_length if specified
-                if max_length and len(new_name) > max_length:
-                    # Truncate the file_root to make room for the counter and extension
-                    truncation = len(new_name) - max_length
-                    file_root = file_root[:-truncation]
-                    new_name = os.path.join(dir_name, f"{file_root}_{counter}{file_ext}")
-                    
-                    # Double-check that the truncated name is available
-                    if not self.exists(new_name):
-                        return new_name
-                else:
-                    return new_name
-            
-            # If not available, increment counter and try again
-            counter += 1
+                return new_name
+    
+    def reserve_suffix(self, dir_name, file_root, file_ext):
+        """
+        Atomically reserve and return the next numeric suffix for file_root/file_ext
+        in dir_name, persisting the counter in the directory's sequence index.
+        """
+        directory = self.path(dir_name)
+        os.makedirs(directory, exist_ok=True)
+        index_path = os.path.join(directory, self.SEQUENCE_INDEX_NAME)
+        key = f"{file_root}{file_ext}"
+        
+        with self._process_lock, open(index_path, 'a+') as index_file:
+            if fcntl is not None:
+                fcntl.flock(index_file, fcntl.LOCK_EX)
+            try:
+                index_file.seek(0)
+                try:
+                    index = json.loads(index_file.read() or '{}')
+                except ValueError:
+                    index = {}
+                
+                counter = index.get(key)
+                if counter is None:
+                    # First collision for this name (or an index predating it):
+                    # seed the counter from the files already on disk, once
+                    counter = self._highest_existing_suffix(directory, file_root, file_ext) + 1
+                
+                index[key] = counter + 1
+                index_file.seek(0)
+                index_file.truncate()
+                index_file.write(json.dumps(index))
+                index_file.flush()
+                os.fsync(index_file.fileno())
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(index_file, fcntl.LOCK_UN)
+        
+        return counter
+    
+    def _highest_existing_suffix(self, directory, file_root, file_ext):
+        """Return the largest N among existing file_root_N files (0 if none)"""
+        prefix = f"{file_root}_"
+        highest = 0
+        for entry in os.listdir(directory):
+            entry_root, entry_ext = os.path.splitext(entry)
+            if entry_ext == file_ext and entry_root.startswith(prefix):
+                suffix = entry_root[len(prefix):]
+                if suffix.isdigit():
+                    highest = max(highest, int(suffix))
+        return highest
+
+class ContentAddressedFileStorage(SequentialFileStorage):
+    """
+    Deduplicating storage for face images.
+    
+    Files are named after a hash of their bytes (e.g. angle_3_9f86d081884c7d65.jpg),
+    so re-uploading an identical image reuses the stored file instead of writing
+    a new copy. Because one file may back several rows, files are only deleted
+    once nothing references them. References are not counted in a table: they
+    are looked up in UserProfile/UserFaceImage at deletion time. Orphans left
+    behind by replaced images are swept by the gc_face_media management command.
+    """
+    
+    HASH_LENGTH = 16
+    
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+        
+        name = self.content_addressed_name(name, content)
+        if self.exists(name):
+            # Identical bytes are already stored under this name. Refresh its
+            # modification time, which gc_face_media's --min-age guard reads,
+            # so an orphan about to be referenced again is not swept meanwhile
+            try:
+                os.utime(self.path(name))
+                return name
+            except FileNotFoundError:
+                # Swept since exists(); store it again
+                pass
+        return super().save(name, content, max_length=max_length)
+    
+    def content_addressed_name(self, name, content):
+        """Return name with a hash of the content appended to the file root"""
+        digest = hashlib.sha256()
+        if hasattr(content, 'seek'):
+            content.seek(0)
+        for chunk in content.chunks():
+            digest.update(chunk)
+        if hasattr(content, 'seek'):
+            content.seek(0)
+        
+        dir_name, file_name = os.path.split(name)
+        file_root, file_ext = os.path.splitext(file_name)
+        return os.path.join(dir_name, f"{file_root}_{digest.hexdigest()[:self.HASH_LENGTH]}{file_ext.lower()}")
+    
+    def delete(self, name):
+        """Only delete files that no UserProfile/UserFaceImage row references any more"""
+        from .face_media import face_media_reference_counts
+        if face_media_reference_counts([name]).get(name):
+            return
+        super().delete(name)
+
+def face_image_storage():
+    """
+    Storage used for face image fields.
+    
+    Deduplicating, content-addressed storage unless FACE_IMAGE_DEDUPLICATE is
+    disabled, in which case files keep plain sequential names.
+    """
+    if getattr(settings, 'FACE_IMAGE_DEDUPLICATE', True):
+        return ContentAddressedFileStorage()
+    return SequentialFileStorage()
 
 def user_face_image_path(instance, filename):
     """
@@ -129,7 +254,9 @@ class UserProfile(models.Model):
     user = models.OneToOneField(CustomUser, on_delete=models.CASCADE, related_name='profile')
     bio = models.TextField(max_length=500, blank=True)
     profile_picture = models.ImageField(upload_to='profile_pics/', blank=True, null=True)
-    face_image = models.ImageField(upload_to=user_face_image_path, blank=True, null=True, storage=SequentialFileStorage())
+    face_image = models.ImageField(upload_to=user_face_image_path, blank=True, null=True, storage=face_image_storage)
+    face_template = models.BinaryField(null=True, blank=True, editable=False, help_text="Serialized face encoding of face_image extracted at upload time")
+    face_template_version = models.CharField(max_length=16, blank=True, default='', editable=False, help_text="Pipeline version that produced face_template")
     address = models.CharField(max_length=255, blank=True)
     
     def __str__(self):
@@ -138,8 +265,10 @@ class UserProfile(models.Model):
 class UserFaceImage(models.Model):
     """Model for storing multiple face images for a user from different angles"""
     user = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name='face_images')
-    image = models.ImageField(upload_to=user_face_images_path, storage=SequentialFileStorage())
+    image = models.ImageField(upload_to=user_face_images_path, storage=face_image_storage)
     angle_index = models.IntegerField(help_text="Index representing the angle of the face image (0-9)")
+    template = models.BinaryField(null=True, blank=True, editable=False, help_text="Serialized face encoding extracted at enrollment time")
+    template_version = models.CharField(max_length=16, blank=True, default='', db_index=True, editable=False, help_text="Pipeline version that produced the template")
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
@@ -191,3 +320,76 @@ class Attendance(models.Model):
             duration = self.check_out_time - self.check_in_time
             return round(duration.total_seconds() / 3600, 2)  # Convert to hours
         return None
+
+# Identifies this process (host, pid and a per-start nonce) as the owner of
+# the verification jobs it queues in memory
+_PROCESS_OWNER = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+def current_job_owner():
+    return _PROCESS_OWNER
+
+
+class FaceVerificationJob(models.Model):
+    """Deferred face verification for a pending (unverified) check-in"""
+    STATUS_PENDING = 'PENDING'
+    STATUS_RUNNING = 'RUNNING'
+    STATUS_VERIFIED = 'VERIFIED'
+    STATUS_FAILED = 'FAILED'
+    STATUS_ERROR = 'ERROR'
+    STATUS_CHOICES = [
+        (STATUS_PENDING, 'Pending'),
+        (STATUS_RUNNING, 'Running'),
+        (STATUS_VERIFIED, 'Verified'),
+        (STATUS_FAILED, 'Failed'),
+        (STATUS_ERROR, 'Error'),
+    ]
+    FINAL_STATUSES = (STATUS_VERIFIED, STATUS_FAILED, STATUS_ERROR)
+    UNFINISHED_STATUSES = (STATUS_PENDING, STATUS_RUNNING)
+    
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name='face_verification_jobs')
+    attendance = models.ForeignKey(Attendance, on_delete=models.SET_NULL, null=True, blank=True, related_name='face_verification_jobs')
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    result = models.JSONField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    completed_at = models.DateTimeField(null=True, blank=True)
+    owner = models.CharField(max_length=100, blank=True, default=current_job_owner, editable=False, help_text="Process holding the job in its in-memory queue")
+    
+    class Meta:
+        ordering = ['-created_at']
+    
+    def __str__(self):
+        return f"{self.user.email} - {self.status} ({self.id})"
+    
+    @property
+    def is_finished(self):
+        return self.status in self.FINAL_STATUSES
+
+class FaceVerificationEvent(models.Model):
+    """Audit record of a single face verification attempt"""
+    SOURCE_CHOICES = [
+        ('sync', 'Synchronous check-in'),
+        ('async', 'Async check-in'),
+        ('deferred', 'Deferred check-in'),
+    ]
+    
+    user = models.ForeignKey(CustomUser, on_delete=models.SET_NULL, null=True, blank=True, related_name='face_verification_events')
+    source = models.CharField(max_length=10, choices=SOURCE_CHOICES, default='sync')
+    matched = models.BooleanField(default=False, help_text="Final decision, including any development override")
+    development_override = models.BooleanField(default=False)
+    similarity = models.FloatField(null=True, blank=True)
+    confidence = models.FloatField(null=True, blank=True)
+    has_eyes = models.BooleanField(default=False)
+    reference_angle = models.IntegerField(null=True, blank=True, help_text="angle_index of the best reference, empty for the profile image")
+    references_tried = models.IntegerField(default=0)
+    scores = models.JSONField(default=dict, blank=True, help_text="Per-method scores of the best comparison")
+    timings = models.JSONField(default=dict, blank=True, help_text="Stage durations in milliseconds")
+    error = models.CharField(max_length=255, blank=True)
+    created_at = models.DateTimeField(default=timezone.now, db_index=True)
+    
+    class Meta:
+        ordering = ['-created_at']
+    
+    def __str__(self):
+        return f"{self.user.email if self.user else 'deleted user'} - {'match' if self.matched else 'no match'} ({self.created_at:%Y-%m-%d %H:%M})"
@@ -1,7 +1,12 @@
 from rest_framework import serializers
+from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.contrib.auth.password_validation import validate_password
 from .models import UserProfile, Location, Attendance, UserFaceImage
+from .image_ingest import (
+    DEFAULT_FACE_IMAGE_MAX_PIXELS, DEFAULT_FACE_IMAGE_MAX_UPLOAD_SIZE, DecodedImage, normalize_face_image,
+)
+from .face_variants import variant_urls
 import math
 import base64
 import io
@@ -11,9 +16,17 @@ import numpy as np
 User = get_user_model()
 
 class UserProfileSerializer(serializers.ModelSerializer):
+    face_image_variants = serializers.SerializerMethodField()
+    
     class Meta:
         model = UserProfile
-        fields = ['bio', 'profile_picture', 'address', 'face_image']
+        fields = ['bio', 'profile_picture', 'address', 'face_image', 'face_image_variants']
+    
+    def get_face_image_variants(self, obj):
+        request = self.context.get('request')
+        if request is None or not obj.face_image:
+            return {}
+        return variant_urls(request, obj.face_image.name)
 
 class UserSerializer(serializers.ModelSerializer):
     profile = UserProfileSerializer(read_only=True)
@@ -215,8 +228,61 @@ class AttendanceCheckOutSerializer(serializers.Serializer):
         data['longitude'] = round(float(data['longitude']), 6)
         return data 
 
+class DecodedImageField(serializers.ImageField):
+    """
+    ImageField that reads and decodes the upload once.
+    
+    DRF's ImageField verifies the file with PIL and throws the result away, so
+    every later consumer decodes it again. This field fully decodes the image
+    as its validation step and returns a DecodedImage that carries the bytes
+    and decoded pixels on to normalization, face encoding and storage.
+    
+    The file size (FACE_IMAGE_MAX_UPLOAD_SIZE) and the pixel count in the
+    image header (FACE_IMAGE_MAX_PIXELS) are checked first, so an oversized
+    or decompression-bomb upload is refused before any pixels are decoded.
+    """
+    default_error_messages = {
+        'file_too_large': 'Image file too large. Maximum size is {max_size:g}MB.',
+        'too_many_pixels': 'Image dimensions too large. Maximum is {max_pixels} pixels.',
+    }
+    
+    def to_internal_value(self, data):
+        # Name/size/empty checks from FileField, skipping ImageField's PIL verify()
+        file_object = serializers.FileField.to_internal_value(self, data)
+        max_size = getattr(settings, 'FACE_IMAGE_MAX_UPLOAD_SIZE', DEFAULT_FACE_IMAGE_MAX_UPLOAD_SIZE)
+        if file_object.size > max_size:
+            self.fail('file_too_large', max_size=max_size / (1024 * 1024))
+        
+        try:
+            decoded = DecodedImage.from_upload(file_object)
+            width, height = decoded.dimensions
+        except Exception:
+            self.fail('invalid_image')
+        max_pixels = getattr(settings, 'FACE_IMAGE_MAX_PIXELS', DEFAULT_FACE_IMAGE_MAX_PIXELS)
+        if width * height > max_pixels:
+            self.fail('too_many_pixels', max_pixels=max_pixels)
+        
+        try:
+            decoded.pil_image
+        except Exception:
+            self.fail('invalid_image')
+        return decoded
+
+# Frames accepted in one check-in burst
+MAX_BURST_FRAMES = 5
+
 class FaceRecognitionSerializer(serializers.Serializer):
-    face_image = serializers.ImageField(required=True)
+    """
+    Check-in with a single face_image or a burst of frames sent as repeated
+    face_images fields; validated data lists them all under 'face_images'.
+    """
+    face_image = DecodedImageField(required=False)
+    face_images = serializers.ListField(
+        child=DecodedImageField(),
+        required=False,
+        max_length=MAX_BURST_FRAMES,
+        error_messages={'max_length': f'At most {MAX_BURST_FRAMES} frames can be sent in one check-in.'}
+    )
     latitude = serializers.FloatField(
         required=True,
         min_value=-90,
@@ -235,51 +301,69 @@ class FaceRecognitionSerializer(serializers.Serializer):
             'max_value': 'Longitude must be between -180 and 180 degrees.',
         }
     )
+    # Return 202 with a verification job instead of waiting for the face match
+    deferred = serializers.BooleanField(required=False, default=False)
     
     def validate(self, data):
+        face_images = list(data.get('face_images') or [])
+        if data.get('face_image'):
+            face_images.insert(0, data['face_image'])
+        if not face_images:
+            raise serializers.ValidationError({'face_image': 'A face image or a burst of face_images is required.'})
+        if len(face_images) > MAX_BURST_FRAMES:
+            raise serializers.ValidationError({
+                'face_images': f'At most {MAX_BURST_FRAMES} frames can be sent in one check-in.'
+            })
+        data['face_images'] = face_images
+        data['face_image'] = face_images[0]
+        
         # Round coordinates to 6 decimal places
         data['latitude'] = round(float(data['latitude']), 6)
         data['longitude'] = round(float(data['longitude']), 6)
         return data
 
+FACE_IMAGE_ERROR_MESSAGES = {
+    'required': 'A face image file is required.',
+    'invalid': 'The uploaded file is not a valid image.',
+    'empty': 'The uploaded image file is empty.',
+    'invalid_image': 'Upload a valid image. The file you uploaded was either not an image or a corrupted image.'
+}
+
+# Number of face angles a user can enroll (angle_index 0-9)
+MAX_FACE_ANGLES = 10
+
+def validate_face_image_file(value):
+    """Shared size/extension checks for uploaded face images"""
+    # Check if the image is valid
+    if not value:
+        raise serializers.ValidationError('Face image is required')
+        
+    # Check file size (limit to 5MB)
+    if value.size > 5 * 1024 * 1024:
+        raise serializers.ValidationError('Image file too large. Maximum size is 5MB.')
+        
+    # Check file extension
+    valid_extensions = ['jpg', 'jpeg', 'png']
+    ext = value.name.split('.')[-1].lower()
+    if ext not in valid_extensions:
+        raise serializers.ValidationError(f'Unsupported file extension. Supported formats: {", ".join(valid_extensions)}')
+        
+    return value
+
 class FaceImageUploadSerializer(serializers.Serializer):
-    face_image = serializers.ImageField(
+    face_image = DecodedImageField(
         required=True,
-        error_messages={
-            'required': 'A face image file is required.',
-            'invalid': 'The uploaded file is not a valid image.',
-            'empty': 'The uploaded image file is empty.',
-            'invalid_image': 'Upload a valid image. The file you uploaded was either not an image or a corrupted image.'
-        }
+        error_messages=FACE_IMAGE_ERROR_MESSAGES
     )
     user_id = serializers.IntegerField(required=False)
     
     def validate_face_image(self, value):
-        # Check if the image is valid
-        if not value:
-            raise serializers.ValidationError('Face image is required')
-            
-        # Check file size (limit to 5MB)
-        if value.size > 5 * 1024 * 1024:
-            raise serializers.ValidationError('Image file too large. Maximum size is 5MB.')
-            
-        # Check file extension
-        valid_extensions = ['jpg', 'jpeg', 'png']
-        ext = value.name.split('.')[-1].lower()
-        if ext not in valid_extensions:
-            raise serializers.ValidationError(f'Unsupported file extension. Supported formats: {", ".join(valid_extensions)}')
-            
-        return value
+        return normalize_face_image(validate_face_image_file(value))
 
 class MultiFaceImageUploadSerializer(serializers.Serializer):
-    face_image = serializers.ImageField(
+    face_image = DecodedImageField(
         required=True,
-        error_messages={
-            'required': 'A face image file is required.',
-            'invalid': 'The uploaded file is not a valid image.',
-            'empty': 'The uploaded image file is empty.',
-            'invalid_image': 'Upload a valid image. The file you uploaded was either not an image or a corrupted image.'
-        }
+        error_messages=FACE_IMAGE_ERROR_MESSAGES
     )
     user_id = serializers.IntegerField(required=False)
     angle_index = serializers.IntegerField(
@@ -294,24 +378,56 @@ class MultiFaceImageUploadSerializer(serializers.Serializer):
     )
     
     def validate_face_image(self, value):
-        # Check if the image is valid
-        if not value:
-            raise serializers.ValidationError('Face image is required')
-            
-        # Check file size (limit to 5MB)
-        if value.size > 5 * 1024 * 1024:
-            raise serializers.ValidationError('Image file too large. Maximum size is 5MB.')
-            
-        # Check file extension
-        valid_extensions = ['jpg', 'jpeg', 'png']
-        ext = value.name.split('.')[-1].lower()
-        if ext not in valid_extensions:
-            raise serializers.ValidationError(f'Unsupported file extension. Supported formats: {", ".join(valid_extensions)}')
-            
-        return value
+        return normalize_face_image(validate_face_image_file(value))
+
+class MultiFaceImageBatchUploadSerializer(serializers.Serializer):
+    """
+    Serializer for enrolling several face angles in one multipart request.
+
+    Each angle is sent as a separate file field named face_image_<angle_index>,
+    e.g. face_image_0 ... face_image_9. The validated data exposes them as a
+    {angle_index: file} mapping under 'face_images'.
+    """
+    user_id = serializers.IntegerField(required=False)
+    
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        for angle_index in range(MAX_FACE_ANGLES):
+            self.fields[f'face_image_{angle_index}'] = DecodedImageField(
+                required=False,
+                error_messages=FACE_IMAGE_ERROR_MESSAGES
+            )
+    
+    def validate(self, attrs):
+        face_images = {}
+        for angle_index in range(MAX_FACE_ANGLES):
+            field_name = f'face_image_{angle_index}'
+            face_image = attrs.pop(field_name, None)
+            if not face_image:
+                continue
+            try:
+                face_images[angle_index] = normalize_face_image(validate_face_image_file(face_image))
+            except serializers.ValidationError as e:
+                raise serializers.ValidationError({field_name: e.detail})
+        
+        if not face_images:
+            raise serializers.ValidationError(
+                f'At least one face image is required (fields face_image_0 to face_image_{MAX_FACE_ANGLES - 1}).'
+            )
+        
+        attrs['face_images'] = face_images
+        return attrs
 
 class UserFaceImageSerializer(serializers.ModelSerializer):
+    variants = serializers.SerializerMethodField()
+    
     class Meta:
         model = UserFaceImage
-        fields = ['id', 'user', 'image', 'angle_index', 'created_at', 'updated_at']
-        read_only_fields = ['id', 'created_at', 'updated_at']
\ No newline at end of file
+        fields = ['id', 'user', 'image', 'angle_index', 'variants', 'created_at', 'updated_at']
+        read_only_fields = ['id', 'created_at', 'updated_at']
+    
+    def get_variants(self, obj):
+        request = self.context.get('request')
+        if request is None or not obj.image:
+            return {}
+        return variant_urls(request, obj.image.name)
\ No newline at end of file
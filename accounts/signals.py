@@ -0,0 +1,36 @@
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+
+from .authentication import invalidate_token, invalidate_user_tokens
+from .face_gallery import schedule_gallery_rebuild
+from .models import UserFaceImage
+
+User = get_user_model()
+
+
+@receiver(post_delete, sender=Token)
+def invalidate_deleted_token(sender, instance, **kwargs):
+    """Forget a token as soon as it is deleted (logout, password change, user deletion)"""
+    invalidate_token(instance.key)
+
+
+@receiver(post_save, sender=User)
+def invalidate_saved_user_tokens(sender, instance, created, update_fields=None, **kwargs):
+    """Drop cached snapshots when a user changes, e.g. is deactivated or loses staff rights"""
+    if created:
+        return
+    # Logging in only touches last_login, which is not worth a cache flush
+    if update_fields is not None and set(update_fields) == {'last_login'}:
+        return
+    invalidate_user_tokens(instance)
+
+
+@receiver(post_save, sender=UserFaceImage)
+@receiver(post_delete, sender=UserFaceImage)
+def rebuild_gallery_on_enrollment_change(sender, instance, **kwargs):
+    """Refresh the user's rows of the shared embedding gallery once the enrollment change is committed"""
+    user_id = instance.user_id
+    transaction.on_commit(lambda: schedule_gallery_rebuild(user_id))
@@ -1,3 +1,1952 @@
-from django.test import TestCase
+import io
+import json
+import logging
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+import cv2
+import numpy as np
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import DatabaseError
+from django.test import AsyncClient, SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from PIL import Image
+from rest_framework.authtoken.models import Token
+from rest_framework.exceptions import AuthenticationFailed, ValidationError
+from rest_framework.test import APIClient
+
+from . import face_encoding_cache, face_enrollment, face_gallery
+from .authentication import CachedTokenAuthentication, clear_token_cache, invalidate_token
+from .caching import TTLCache
+from .face_audit import AuditBuffer, record_verification_event
+from .face_checkin import CheckInError, select_probe_frames, verify_against_references, verify_probe_frames
+from .face_detection import PRIMARY_PASSES, HaarPyramid, detect_faces_haar
+from .face_embedders import (
+    get_active_weights, get_model_path, load_embedder, prepare_facenet_batch, set_active_weights,
+)
+from .face_encoding_cache import NO_FACE_TTL, cached_face_encoding, encoding_cache_key
+from .face_enrollment import (
+    _refresh_template, assess_enrollment_encoding, extract_enrollment_templates, schedule_template_refresh,
+)
+from .face_gallery import (
+    FaceGallery, build_gallery, get_gallery, rebuild_gallery, schedule_gallery_rebuild, update_gallery,
+)
+from .face_jobs import (
+    LOST_JOB_RESULT, PENDING_FACE_CHECKIN, VerificationQueueFull, _expire_jobs, expire_orphaned_jobs, get_job_status,
+    process_verification_job,
+)
+from .face_logging import StageLogger, is_sampled, log_verification_summary, verification_trace
+from .face_quality import QUALITY_REASONS, assess_probe_quality, frame_score, quality_gate
+from .face_recognition_utils import (
+    ALIGNED_LEFT_EYE, ALIGNED_RIGHT_EYE, _load_facenet, align_face, alignment_transform, compute_face_encoding,
+    find_eye_centers, get_pipeline_context, guided_smooth, preprocess_image, preprocess_image_legacy,
+)
+from .face_runtime import configure_native_threads
+from .face_templates import (
+    TEMPLATE_FACE_REGION_SIZE, deserialize_template, is_compact_template, is_current_template, needs_template,
+    pipeline_version, serialize_template, template_embedding,
+)
+from .face_variants import generate_variants, get_variant_sizes, original_name_for_variant, variant_name
+from .image_ingest import DecodedImage, normalize_face_image
+from .management.commands.import_faces import parse_entry_name
+from .models import (
+    Attendance, ContentAddressedFileStorage, FaceVerificationEvent, FaceVerificationJob, Location,
+    SequentialFileStorage, UserFaceImage, UserProfile, current_job_owner,
+)
+from .serializers import DecodedImageField
+
+User = get_user_model()
+
+LOCMEM_CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
+# An enrolled photo shipped with the repository, with one clearly visible face
+SAMPLE_FACE = os.path.join(settings.BASE_DIR, 'media', 'face_recognition', 'dhruv_at_gmail_dot_com', '15.jpg')
+
+
+def make_encoding(seed=0):
+    """A face encoding shaped like get_face_encoding's output"""
+    rng = np.random.default_rng(seed)
+    return {
+        'face_img': rng.integers(0, 256, (200, 200)).astype(np.float32) / 255.0,
+        'face_region': rng.integers(0, 256, (120, 110), dtype=np.uint8),
+        'descriptors': rng.integers(0, 256, (12, 128)).astype(np.float32),
+        'facenet_embedding': rng.standard_normal(512).astype(np.float32),
+        'has_eyes': True,
+        'original_bbox': (40, 32, 120, 110),
+        'keypoints': [],
+    }
+
+
+def cosine(a, b):
+    return float(np.dot(a, b) / (np.linalg.norm(a) * np.linalg.norm(b)))
+
+
+PROBE = DecodedImage(b'probe bytes', 'probe.jpg')
+BLANK = DecodedImage(b'blank bytes', 'blank.jpg')
+
+
+@override_settings(FACE_ENCODING_CACHE_ENABLED=True, FACE_ENCODING_CACHE_DIR=None)
+class FaceEncodingCacheTests(SimpleTestCase):
+    def setUp(self):
+        # A fresh in-memory tier for every test
+        patcher = mock.patch.object(face_encoding_cache, '_memory_cache', TTLCache(max_entries=16, ttl=3600))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.compute = mock.Mock(return_value=make_encoding())
+
+    def test_hit_returns_the_same_form_as_a_miss(self):
+        miss = cached_face_encoding(PROBE, self.compute)
+        hit = cached_face_encoding(PROBE, self.compute)
+
+        self.compute.assert_called_once()
+        self.assertEqual(miss.keys(), hit.keys())
+        for key, value in miss.items():
+            if isinstance(value, np.ndarray):
+                np.testing.assert_array_equal(hit[key], value)
+                self.assertEqual(hit[key].dtype, value.dtype)
+            else:
+                self.assertEqual(hit[key], value)
+        # Template form: keypoints and the colour crop are not kept on either path
+        self.assertNotIn('preprocessed_face', miss)
+
+    def test_no_face_result_expires(self):
+        self.compute.return_value = None
+        now = time.monotonic()
+        with mock.patch('accounts.caching.time.monotonic', return_value=now):
+            self.assertIsNone(cached_face_encoding(BLANK, self.compute))
+            self.assertIsNone(cached_face_encoding(BLANK, self.compute))
+        self.assertEqual(self.compute.call_count, 1)
+
+        with mock.patch('accounts.caching.time.monotonic', return_value=now + NO_FACE_TTL + 1):
+            self.assertIsNone(cached_face_encoding(BLANK, self.compute))
+        self.assertEqual(self.compute.call_count, 2)
+
+    def test_errors_are_not_cached(self):
+        self.compute.side_effect = [RuntimeError('detector failed'), make_encoding()]
+        with self.assertRaises(RuntimeError):
+            cached_face_encoding(PROBE, self.compute)
+
+        self.assertIsNotNone(cached_face_encoding(PROBE, self.compute))
+        self.assertEqual(self.compute.call_count, 2)
+
+    def test_disabled_cache_always_computes(self):
+        with override_settings(FACE_ENCODING_CACHE_ENABLED=False):
+            cached_face_encoding(PROBE, self.compute)
+            cached_face_encoding(PROBE, self.compute)
+        self.assertEqual(self.compute.call_count, 2)
+
+
+@override_settings(FACE_ENCODING_CACHE_ENABLED=True)
+class FaceEncodingDiskCacheTests(SimpleTestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.cache_dir)
+        override = override_settings(FACE_ENCODING_CACHE_DIR=self.cache_dir)
+        override.enable()
+        self.addCleanup(override.disable)
+        patcher = mock.patch.object(face_encoding_cache, '_memory_cache', TTLCache(max_entries=16, ttl=3600))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.compute = mock.Mock(return_value=make_encoding())
+
+    def test_disk_tier_round_trips(self):
+        miss = cached_face_encoding(PROBE, self.compute)
+        # Another process starts with an empty memory tier
+        face_encoding_cache.clear_encoding_cache()
+        hit = cached_face_encoding(PROBE, self.compute)
+
+        self.compute.assert_called_once()
+        np.testing.assert_array_equal(hit['facenet_embedding'], miss['facenet_embedding'])
+        np.testing.assert_array_equal(hit['descriptors'], miss['descriptors'])
+
+    def test_no_face_result_is_not_written_to_disk(self):
+        self.compute.return_value = None
+        cached_face_encoding(BLANK, self.compute)
+        face_encoding_cache.clear_encoding_cache()
+        cached_face_encoding(BLANK, self.compute)
+        self.assertEqual(self.compute.call_count, 2)
+
+    def test_expired_disk_entry_is_removed(self):
+        cached_face_encoding(PROBE, self.compute)
+        face_encoding_cache.clear_encoding_cache()
+        path = face_encoding_cache._disk_path(encoding_cache_key(PROBE.data))
+        old = time.time() - 8 * 24 * 3600
+        os.utime(path, (old, old))
+
+        cached_face_encoding(PROBE, self.compute)
+        self.assertEqual(self.compute.call_count, 2)
+
+    def test_pipeline_version_change_invalidates_entries(self):
+        cached_face_encoding(PROBE, self.compute)
+        old_key = encoding_cache_key(PROBE.data)
+
+        with override_settings(FACE_PREPROCESSING='fast'):
+            self.assertNotEqual(encoding_cache_key(PROBE.data), old_key)
+            cached_face_encoding(PROBE, self.compute)
+        self.assertEqual(self.compute.call_count, 2)
+
+
+class FaceTemplateTests(SimpleTestCase):
+    def test_float32_round_trip_is_exact(self):
+        encoding = make_encoding()
+        template = serialize_template(encoding, embedding_dtype='float32')
+        self.assertTrue(is_compact_template(template))
+
+        restored = deserialize_template(template)
+        for key in ('face_img', 'descriptors', 'facenet_embedding'):
+            np.testing.assert_array_equal(restored[key], encoding[key])
+        # Only a thumbnail of the face region is kept
+        self.assertEqual(restored['face_region'].shape, (TEMPLATE_FACE_REGION_SIZE, TEMPLATE_FACE_REGION_SIZE))
+        self.assertEqual(restored['face_region'].dtype, np.uint8)
+        self.assertTrue(restored['has_eyes'])
+        self.assertEqual(restored['original_bbox'], encoding['original_bbox'])
+        self.assertEqual(restored['keypoints'], [])
+
+    def test_reduced_precision_embeddings_stay_close(self):
+        encoding = make_encoding()
+        for dtype in ('float16', 'int8'):
+            with self.subTest(dtype=dtype):
+                template = serialize_template(encoding, embedding_dtype=dtype)
+                embedding = deserialize_template(template)['facenet_embedding']
+                self.assertEqual(embedding.dtype, np.float32)
+                self.assertGreater(cosine(embedding, encoding['facenet_embedding']), 0.999)
+                np.testing.assert_array_equal(template_embedding(template), embedding)
+
+    def test_missing_fields_round_trip(self):
+        encoding = make_encoding()
+        encoding.update(facenet_embedding=None, descriptors=None, has_eyes=False, original_bbox=None)
+        restored = deserialize_template(serialize_template(encoding))
+
+        self.assertIsNone(restored['facenet_embedding'])
+        self.assertIsNone(restored['descriptors'])
+        self.assertFalse(restored['has_eyes'])
+        self.assertIsNone(restored['original_bbox'])
+        self.assertIsNone(template_embedding(serialize_template(encoding)))
+
+    def test_version1_npz_templates_are_still_read(self):
+        encoding = make_encoding()
+        buffer = io.BytesIO()
+        np.savez_compressed(
+            buffer,
+            face_img=encoding['face_img'],
+            face_region=encoding['face_region'],
+            descriptors=encoding['descriptors'],
+            facenet_embedding=encoding['facenet_embedding'],
+            has_eyes=np.array(True),
+            original_bbox=np.array(encoding['original_bbox']),
+        )
+        data = buffer.getvalue()
+        self.assertFalse(is_compact_template(data))
+
+        restored = deserialize_template(data)
+        np.testing.assert_array_equal(restored['facenet_embedding'], encoding['facenet_embedding'])
+        np.testing.assert_array_equal(restored['face_region'], encoding['face_region'])
+        self.assertEqual(restored['original_bbox'], encoding['original_bbox'])
+        np.testing.assert_array_equal(template_embedding(data), encoding['facenet_embedding'])
+
+    def test_empty_and_invalid_data(self):
+        self.assertIsNone(serialize_template(None))
+        self.assertIsNone(deserialize_template(None))
+        self.assertIsNone(deserialize_template(b''))
+        self.assertIsNone(deserialize_template(b'not a template'))
+
+
+class TTLCacheTests(SimpleTestCase):
+    def test_get_set_delete_clear(self):
+        cache = TTLCache(max_entries=4, ttl=60)
+        cache.set('a', 1)
+        cache.set('b', None)
+        self.assertEqual(cache.get('a'), 1)
+        self.assertEqual(cache.get('missing', 'default'), 'default')
+        # A cached None is still an entry
+        self.assertIn('b', cache)
+
+        cache.delete('a')
+        self.assertNotIn('a', cache)
+        cache.delete('a')
+        cache.clear()
+        self.assertEqual(len(cache), 0)
+
+    def test_least_recently_used_entry_is_evicted(self):
+        cache = TTLCache(max_entries=2, ttl=60)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+
+        self.assertIn('a', cache)
+        self.assertNotIn('b', cache)
+        self.assertIn('c', cache)
+        self.assertEqual(len(cache), 2)
+
+    def test_entries_expire(self):
+        cache = TTLCache(max_entries=4, ttl=10)
+        now = time.monotonic()
+        with mock.patch('accounts.caching.time.monotonic', return_value=now):
+            cache.set('default', 1)
+            cache.set('short', 2, ttl=1)
+        with mock.patch('accounts.caching.time.monotonic', return_value=now + 5):
+            self.assertEqual(cache.get('default'), 1)
+            self.assertIsNone(cache.get('short'))
+        with mock.patch('accounts.caching.time.monotonic', return_value=now + 11):
+            self.assertIsNone(cache.get('default'))
+        self.assertEqual(len(cache), 0)
+
+    def test_zero_size_cache_stores_nothing(self):
+        cache = TTLCache(max_entries=0)
+        cache.set('a', 1)
+        self.assertNotIn('a', cache)
+
+
+@override_settings(CACHES=LOCMEM_CACHES, TOKEN_AUTH_CACHE={'USE_DJANGO_CACHE': True})
+class CachedTokenAuthenticationTests(TestCase):
+    def setUp(self):
+        clear_token_cache()
+        caches['default'].clear()
+        self.addCleanup(clear_token_cache)
+        self.user = User.objects.create_user(email='jane@example.com', password='secret-pass-1')
+        self.token = Token.objects.create(user=self.user)
+        self.auth = CachedTokenAuthentication()
+
+    def test_repeated_lookup_skips_the_database(self):
+        self.auth.authenticate_credentials(self.token.key)
+        with self.assertNumQueries(0):
+            user, token = self.auth.authenticate_credentials(self.token.key)
+        self.assertEqual(user.pk, self.user.pk)
+        self.assertEqual(token.key, self.token.key)
+
+    def test_shared_cache_serves_other_processes(self):
+        self.auth.authenticate_credentials(self.token.key)
+        # Another worker starts with an empty in-process cache
+        clear_token_cache()
+        with self.assertNumQueries(0):
+            user, _ = self.auth.authenticate_credentials(self.token.key)
+        self.assertEqual(user.pk, self.user.pk)
+
+    def test_invalidated_token_is_looked_up_again(self):
+        self.auth.authenticate_credentials(self.token.key)
+        invalidate_token(self.token.key)
+        with self.assertNumQueries(1):
+            self.auth.authenticate_credentials(self.token.key)
+
+    def test_deleted_token_is_rejected(self):
+        self.auth.authenticate_credentials(self.token.key)
+        self.token.delete()
+        with self.assertRaises(AuthenticationFailed):
+            self.auth.authenticate_credentials(self.token.key)
+
+    def test_deactivated_user_is_rejected(self):
+        self.auth.authenticate_credentials(self.token.key)
+        self.user.is_active = False
+        self.user.save()
+        with self.assertRaises(AuthenticationFailed):
+            self.auth.authenticate_credentials(self.token.key)
+
+    def test_password_hash_is_not_cached(self):
+        self.auth.authenticate_credentials(self.token.key)
+        clear_token_cache()
+        _, field_names, values = caches['default'].get(f'token-auth:{self.token.key}')
+        self.assertNotIn('password', field_names)
+        self.assertNotIn(self.user.password, values)
+
+        user, _ = self.auth.authenticate_credentials(self.token.key)
+        # Loaded from the database only when accessed
+        self.assertIn('password', user.get_deferred_fields())
+        with self.assertNumQueries(1):
+            self.assertTrue(user.check_password('secret-pass-1'))
+
+    def test_shared_cache_is_off_by_default(self):
+        with override_settings(TOKEN_AUTH_CACHE={}):
+            self.auth.authenticate_credentials(self.token.key)
+        self.assertIsNone(caches['default'].get(f'token-auth:{self.token.key}'))
+
+
+class ContentAddressedFileStorageTests(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        override = override_settings(MEDIA_ROOT=self.media_root)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.storage = ContentAddressedFileStorage()
+
+    def test_identical_bytes_share_one_file(self):
+        first = self.storage.save('face_recognition/jane/angle_0.jpg', ContentFile(b'face bytes'))
+        second = self.storage.save('face_recognition/jane/angle_0.jpg', ContentFile(b'face bytes'))
+        other = self.storage.save('face_recognition/jane/angle_0.jpg', ContentFile(b'other bytes'))
+
+        self.assertEqual(first, second)
+        self.assertNotEqual(first, other)
+        self.assertRegex(first, r'^face_recognition/jane/angle_0_[0-9a-f]{16}\.jpg$')
+        self.assertEqual(len(os.listdir(self.storage.path('face_recognition/jane'))), 2)
+
+    def test_reuse_refreshes_modification_time(self):
+        name = self.storage.save('face_recognition/jane/angle_0.jpg', ContentFile(b'face bytes'))
+        old = time.time() - 7 * 24 * 3600
+        os.utime(self.storage.path(name), (old, old))
+
+        self.storage.save('face_recognition/jane/angle_0.jpg', ContentFile(b'face bytes'))
+        self.assertGreater(os.path.getmtime(self.storage.path(name)), old + 3600)
+
+    def test_delete_keeps_referenced_files(self):
+        user = User.objects.create_user(email='jane@example.com', password='secret-pass-1')
+        referenced = self.storage.save('face_recognition/jane/angle_0.jpg', ContentFile(b'face bytes'))
+        orphan = self.storage.save('face_recognition/jane/angle_1.jpg', ContentFile(b'old bytes'))
+        UserFaceImage.objects.create(user=user, angle_index=0, image=referenced)
+
+        self.storage.delete(referenced)
+        self.storage.delete(orphan)
+
+        self.assertTrue(self.storage.exists(referenced))
+        self.assertFalse(self.storage.exists(orphan))
+
+    def test_gc_face_media_deletes_only_old_orphans(self):
+        user = User.objects.create_user(email='jane@example.com', password='secret-pass-1')
+        referenced = self.storage.save('face_recognition/jane/angle_0.jpg', ContentFile(b'face bytes'))
+        orphan = self.storage.save('face_recognition/jane/angle_1.jpg', ContentFile(b'old bytes'))
+        recent = self.storage.save('face_recognition/jane/angle_2.jpg', ContentFile(b'new bytes'))
+        UserFaceImage.objects.create(user=user, angle_index=0, image=referenced)
+        old = time.time() - 2 * 3600
+        for name in (referenced, orphan):
+            os.utime(self.storage.path(name), (old, old))
+
+        call_command('gc_face_media', stdout=io.StringIO())
+
+        self.assertTrue(self.storage.exists(referenced))
+        self.assertFalse(self.storage.exists(orphan))
+        # Possibly an upload whose row is not committed yet
+        self.assertTrue(self.storage.exists(recent))
+
+
+def use_temp_media_root(test):
+    """Point MEDIA_ROOT at a temporary directory for the duration of test"""
+    media_root = tempfile.mkdtemp()
+    test.addCleanup(shutil.rmtree, media_root)
+    override = override_settings(MEDIA_ROOT=media_root)
+    override.enable()
+    test.addCleanup(override.disable)
+    return media_root
+
+
+def make_jpeg(width=64, height=64, color=(120, 90, 60), **save_args):
+    """Bytes of a plain JPEG image"""
+    buffer = io.BytesIO()
+    Image.new('RGB', (width, height), color).save(buffer, format='JPEG', **save_args)
+    return buffer.getvalue()
+
+
+class FaceStatusViewTests(TestCase):
+    def setUp(self):
+        use_temp_media_root(self)
+        self.user = User.objects.create_user(email='jane@example.com', password='secret-pass-1')
+        UserProfile.objects.create(user=self.user)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.url = reverse('face-status')
+
+    def add_face_image(self, angle_index, data=None):
+        return UserFaceImage.objects.create(
+            user=self.user, angle_index=angle_index,
+            image=ContentFile(data or make_jpeg(color=(angle_index, 0, 0)), name='face.jpg'),
+        )
+
+    def test_reports_enrollment(self):
+        self.add_face_image(0)
+        self.add_face_image(1)
+
+        response = self.client.get(self.url)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.data['has_uploads'])
+        self.assertFalse(response.data['has_face_image'])
+        self.assertEqual(response.data['face_image_count'], 2)
+        self.assertEqual([entry['angle_index'] for entry in response.data['face_image_urls']], [0, 1])
+        self.assertIsNotNone(response.data['latest_upload_date'])
+        self.assertIn('ETag', response)
+
+    def test_unchanged_enrollment_is_not_modified(self):
+        self.add_face_image(0)
+        etag = self.client.get(self.url)['ETag']
+
+        # One aggregate query (the profile is already loaded), no face image rows
+        with self.assertNumQueries(1):
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+
+    def test_enrollment_change_changes_the_etag(self):
+        first = self.add_face_image(0)
+        etag = self.client.get(self.url)['ETag']
+
+        self.add_face_image(1)
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+        # Deleting an angle also changes it, even though the newest row stays
+        etag = response['ETag']
+        first.delete()
+        self.assertNotEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+
+def accepted_template(seed=0):
+    """extract_enrollment_template result for an accepted photo"""
+    return {
+        'accepted': True,
+        'reason': None,
+        'metrics': {'face_size': 120, 'sharpness': 80.0},
+        'template': serialize_template(make_encoding(seed)),
+        'template_version': pipeline_version(),
+    }
+
+
+def rejected_template(reason='No face detected in the image'):
+    """extract_enrollment_template result for a rejected photo"""
+    return {'accepted': False, 'reason': reason, 'metrics': {}, 'template': None, 'template_version': ''}
+
+
+def jpeg_upload(name='face.jpg', **kwargs):
+    return SimpleUploadedFile(name, make_jpeg(**kwargs), content_type='image/jpeg')
+
+
+class MultiFaceImageUploadViewTests(TestCase):
+    def setUp(self):
+        use_temp_media_root(self)
+        self.user = User.objects.create_user(email='jane@example.com', password='secret-pass-1')
+        UserProfile.objects.create(user=self.user)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    @mock.patch('accounts.api_views.extract_enrollment_template', return_value=accepted_template())
+    def test_upload_lists_every_angle(self, extract):
+        self.client.post(reverse('face-multi-upload'), {'face_image': jpeg_upload(), 'angle_index': 0})
+        response = self.client.post(reverse('face-multi-upload'), {'face_image': jpeg_upload(), 'angle_index': 2})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['message'], 'Face image uploaded successfully')
+        self.assertEqual(response.data['face_image_count'], 2)
+        self.assertEqual([entry['angle_index'] for entry in response.data['face_image_urls']], [0, 2])
+
+    def test_listing_uses_one_query(self):
+        for angle_index in range(3):
+            UserFaceImage.objects.create(user=self.user, angle_index=angle_index,
+                                         image=ContentFile(make_jpeg(), name='face.jpg'))
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('face-multi-upload'))
+        self.assertEqual(response.data['face_image_count'], 3)
+
+    @mock.patch('accounts.api_views.extract_enrollment_template', return_value=rejected_template())
+    def test_rejected_photo_is_not_stored(self, extract):
+        response = self.client.post(reverse('face-multi-upload'), {'face_image': jpeg_upload(), 'angle_index': 0})
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['error'], 'No face detected in the image')
+        self.assertFalse(UserFaceImage.objects.exists())
+
+
+class MultiFaceImageBatchUploadViewTests(TestCase):
+    def setUp(self):
+        use_temp_media_root(self)
+        self.user = User.objects.create_user(email='jane@example.com', password='secret-pass-1')
+        UserProfile.objects.create(user=self.user)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.url = reverse('face-multi-upload-batch')
+
+    def test_accepted_angles_are_saved_and_rejected_ones_reported(self):
+        UserFaceImage.objects.create(user=self.user, angle_index=0, image=ContentFile(make_jpeg(), name='face.jpg'))
+        results = {0: accepted_template(0), 1: accepted_template(1), 2: rejected_template('Image is too blurry')}
+        with mock.patch('accounts.api_views.extract_enrollment_templates', return_value=results):
+            response = self.client.post(self.url, {
+                'face_image_0': jpeg_upload(color=(1, 2, 3)),
+                'face_image_1': jpeg_upload(),
+                'face_image_2': jpeg_upload(),
+            })
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['created_angles'], [1])
+        self.assertEqual(response.data['updated_angles'], [0])
+        self.assertEqual([entry['angle_index'] for entry in response.data['rejected_angles']], [2])
+        self.assertEqual(response.data['face_image_count'], 2)
+        self.assertEqual(list(UserFaceImage.objects.values_list('angle_index', flat=True)), [0, 1])
+
+    def test_nothing_is_saved_when_every_angle_is_rejected(self):
+        with mock.patch('accounts.api_views.extract_enrollment_templates', return_value={0: rejected_template()}):
+            response = self.client.post(self.url, {'face_image_0': jpeg_upload()})
+
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(UserFaceImage.objects.exists())
+
+    def test_at_least_one_angle_is_required(self):
+        response = self.client.post(self.url, {})
+        self.assertEqual(response.status_code, 400)
+
+
+class EnrollmentTemplateTests(TestCase):
+    def setUp(self):
+        use_temp_media_root(self)
+        self.user = User.objects.create_user(email='jane@example.com', password='secret-pass-1')
+        UserProfile.objects.create(user=self.user)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_reupload_replaces_the_template(self):
+        url = reverse('face-multi-upload')
+        with mock.patch('accounts.api_views.extract_enrollment_template', return_value=accepted_template(0)):
+            self.client.post(url, {'face_image': jpeg_upload(color=(10, 10, 10)), 'angle_index': 0})
+        with mock.patch('accounts.api_views.extract_enrollment_template', return_value=accepted_template(1)):
+            response = self.client.post(url, {'face_image': jpeg_upload(color=(200, 10, 10)), 'angle_index': 0})
+
+        self.assertEqual(response.data['message'], 'Face image updated successfully')
+        face_image = UserFaceImage.objects.get()
+        self.assertEqual(bytes(face_image.template), accepted_template(1)['template'])
+
+    def test_angles_are_extracted_separately(self):
+        images = {0: 'front', 3: 'left', 7: 'right'}
+        with mock.patch('accounts.face_enrollment.extract_enrollment_template',
+                        side_effect=lambda image: {'accepted': True, 'image': image}):
+            results = extract_enrollment_templates(images)
+
+        self.assertEqual({angle: result['image'] for angle, result in results.items()}, images)
+
+    def test_small_or_blurry_faces_are_rejected(self):
+        encoding = make_encoding()
+        self.assertEqual(assess_enrollment_encoding(encoding)[:2], (True, None))
+        self.assertEqual(assess_enrollment_encoding(None)[:2], (False, 'No face detected in the image'))
+
+        encoding['original_bbox'] = (0, 0, 40, 40)
+        self.assertEqual(assess_enrollment_encoding(encoding)[:2], (False, 'Face is too small, move closer to the camera'))
+
+        encoding = make_encoding()
+        encoding['face_region'] = np.full((120, 110), 128, dtype=np.uint8)
+        self.assertEqual(assess_enrollment_encoding(encoding)[:2], (False, 'Image is too blurry'))
+
+
+class InlineExecutor:
+    """Stand-in for ProcessPoolExecutor that runs each call when it is submitted"""
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def submit(self, fn, *args):
+        future = Future()
+        try:
+            future.set_result(fn(*args))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+
+def ingested_photo(name, data):
+    """ingest_photo_from_bytes result for an accepted photo"""
+    return dict(accepted_template(), name=name, data=data)
+
+
+class ImportFacesTests(TestCase):
+    def test_parse_entry_name(self):
+        cases = {
+            'jane@corp.com/3.jpg': ('jane@corp.com', 3),
+            'photos/Jane@Corp.com/angle_3.jpg': ('jane@corp.com', 3),
+            'jane_at_corp_dot_com/Angle_2.png': ('jane@corp.com', 2),
+            'jane@corp.com/IMG_0042.jpg': ('jane@corp.com', None),
+            'jane@corp.com/selfie 2.jpg': ('jane@corp.com', None),
+            'Jane@Corp.com.jpg': ('jane@corp.com', None),
+            'jane@corp.com__4.jpg': ('jane@corp.com', 4),
+            'jane@corp.com__front.jpg': ('jane@corp.com', None),
+        }
+        for path, expected in cases.items():
+            with self.subTest(path=path):
+                self.assertEqual(parse_entry_name(path), expected)
+
+    @mock.patch('accounts.management.commands.import_faces.ProcessPoolExecutor', InlineExecutor)
+    @mock.patch('accounts.management.commands.import_faces.ingest_photo_from_bytes', side_effect=ingested_photo)
+    def test_import_and_resume(self, ingest):
+        use_temp_media_root(self)
+        jane = User.objects.create_user(email='jane@corp.com', password='secret-pass-1')
+        source = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, source)
+        os.makedirs(os.path.join(source, 'jane@corp.com'))
+        for name in ('2.jpg', 'IMG_0001.jpg', 'IMG_0002.jpg'):
+            with open(os.path.join(source, 'jane@corp.com', name), 'wb') as f:
+                f.write(make_jpeg())
+        with open(os.path.join(source, 'nobody@corp.com.jpg'), 'wb') as f:
+            f.write(make_jpeg())
+        state_file = os.path.join(source, 'import.state')
+
+        stdout, stderr = io.StringIO(), io.StringIO()
+        call_command('import_faces', source, state_file=state_file, stdout=stdout, stderr=stderr)
+
+        # Unnumbered photos take the next angles in sorted order
+        self.assertEqual(sorted(jane.face_images.values_list('angle_index', flat=True)), [2, 3, 4])
+        self.assertTrue(all(face_image.template for face_image in jane.face_images.all()))
+        self.assertIn('imported=3', stdout.getvalue())
+        self.assertIn('unknown_user=1', stdout.getvalue())
+
+        ingest.reset_mock()
+        stdout = io.StringIO()
+        call_command('import_faces', source, state_file=state_file, stdout=stdout, stderr=io.StringIO())
+        ingest.assert_not_called()
+        self.assertIn('resumed=3', stdout.getvalue())
+
+
+class SequentialFileStorageTests(SimpleTestCase):
+    def setUp(self):
+        self.storage = SequentialFileStorage(location=tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.storage.location)
+
+    def save(self, name, content=b'x'):
+        return self.storage.save(name, ContentFile(content))
+
+    def test_duplicates_get_sequential_suffixes(self):
+        names = [self.save('faces/jane.jpg') for _ in range(3)]
+
+        self.assertEqual(names, ['faces/jane.jpg', 'faces/jane_1.jpg', 'faces/jane_2.jpg'])
+        with open(self.storage.path(f'faces/{SequentialFileStorage.SEQUENCE_INDEX_NAME}')) as f:
+            self.assertEqual(json.load(f), {'jane.jpg': 3})
+
+    def test_counter_is_seeded_from_existing_files(self):
+        # Files stored before the index existed (none of these names collide)
+        for name in ('faces/jane.jpg', 'faces/jane_4.jpg', 'faces/jane_x.jpg', 'faces/jane_9.png'):
+            self.save(name)
+
+        self.assertEqual(self.save('faces/jane.jpg'), 'faces/jane_5.jpg')
+
+    def test_stale_index_skips_taken_names(self):
+        self.save('faces/jane.jpg')
+        self.save('faces/jane.jpg')
+        # Written behind the index's back
+        with open(self.storage.path('faces/jane_2.jpg'), 'wb') as f:
+            f.write(b'x')
+
+        self.assertEqual(self.save('faces/jane.jpg'), 'faces/jane_3.jpg')
+
+    def test_suffixes_are_unique_across_threads(self):
+        self.save('faces/jane.jpg')
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            suffixes = list(pool.map(lambda _: self.storage.reserve_suffix('faces', 'jane', '.jpg'), range(40)))
+
+        self.assertEqual(sorted(suffixes), list(range(1, 41)))
+
+
+class NormalizeFaceImageTests(SimpleTestCase):
+    def test_orientation_is_applied_and_metadata_dropped(self):
+        exif = Image.Exif()
+        exif[0x0112] = 6  # rotate 90 degrees clockwise for display
+        exif[0x010F] = 'Camera maker'
+        upload = DecodedImage(make_jpeg(60, 40, exif=exif.tobytes()), 'IMG_1.JPG')
+
+        normalized = normalize_face_image(upload)
+
+        self.assertEqual(normalized.name, 'IMG_1.jpg')
+        with Image.open(io.BytesIO(normalized.data)) as image:
+            self.assertEqual(image.size, (40, 60))
+            self.assertEqual(len(image.getexif()), 0)
+
+    @override_settings(FACE_IMAGE_MAX_SIDE=100, FACE_IMAGE_FORMAT='WEBP')
+    def test_large_images_are_downsized(self):
+        normalized = normalize_face_image(DecodedImage(make_jpeg(400, 300), 'face.jpg'))
+
+        self.assertEqual(normalized.name, 'face.webp')
+        self.assertEqual(normalized.content_type, 'image/webp')
+        with Image.open(io.BytesIO(normalized.data)) as image:
+            self.assertEqual(image.format, 'WEBP')
+            self.assertEqual(image.size, (100, 75))
+        # The decoded pixels are handed on with the bytes
+        self.assertEqual(normalized.bgr.shape, (75, 100, 3))
+
+    def test_originals_are_archived_when_enabled(self):
+        originals = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, originals)
+        data = make_jpeg()
+        with override_settings(FACE_IMAGE_KEEP_ORIGINALS=True, FACE_ORIGINALS_ROOT=originals):
+            normalize_face_image(DecodedImage(data, 'face.jpg'))
+
+        archived = [os.path.join(root, name) for root, _, names in os.walk(originals) for name in names]
+        self.assertEqual(len(archived), 1)
+        with open(archived[0], 'rb') as f:
+            self.assertEqual(f.read(), data)
+
+    def test_unreadable_image_is_returned_unchanged(self):
+        upload = DecodedImage(b'not an image', 'face.jpg')
+        with self.assertLogs('accounts.image_ingest', 'WARNING'):
+            self.assertIs(normalize_face_image(upload), upload)
+
+
+class DecodedImageFieldTests(SimpleTestCase):
+    def test_valid_upload_is_decoded_once(self):
+        decoded = DecodedImageField().to_internal_value(jpeg_upload(width=30, height=20))
+
+        self.assertIsInstance(decoded, DecodedImage)
+        self.assertEqual(decoded.dimensions, (30, 20))
+        self.assertEqual(decoded.bgr.shape, (20, 30, 3))
+        self.assertIs(decoded.bgr, decoded.bgr)
+
+    @override_settings(FACE_IMAGE_MAX_UPLOAD_SIZE=1024 * 1024)
+    def test_large_file_is_refused(self):
+        upload = SimpleUploadedFile('face.jpg', b'\xff' * (1024 * 1024 + 1), content_type='image/jpeg')
+        with self.assertRaisesMessage(ValidationError, 'Maximum size is 1MB.'):
+            DecodedImageField().to_internal_value(upload)
+
+    @override_settings(FACE_IMAGE_MAX_PIXELS=100 * 100)
+    def test_oversized_dimensions_are_refused_before_decoding(self):
+        with mock.patch.object(DecodedImage, 'pil_image', new_callable=mock.PropertyMock) as pil_image:
+            with self.assertRaisesMessage(ValidationError, 'Maximum is 10000 pixels.'):
+                DecodedImageField().to_internal_value(jpeg_upload(width=101, height=100))
+        pil_image.assert_not_called()
+
+    def test_corrupt_image_is_refused(self):
+        data = make_jpeg()
+        upload = SimpleUploadedFile('face.jpg', data[:len(data) // 2], content_type='image/jpeg')
+        with self.assertRaises(ValidationError) as raised:
+            DecodedImageField().to_internal_value(upload)
+        self.assertEqual(raised.exception.detail[0].code, 'invalid_image')
+
+
+class FaceImageVariantTests(TestCase):
+    def setUp(self):
+        self.media_root = use_temp_media_root(self)
+        self.user = User.objects.create_user(email='jane@example.com', password='secret-pass-1')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.name = 'face_recognition/jane_at_example_dot_com/angle_0.jpg'
+        self.write(self.name, make_jpeg(400, 200))
+
+    def write(self, name, data):
+        path = os.path.join(self.media_root, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(data)
+
+    def url(self, size, name):
+        return f'/api/auth/face/variants/{size}/{name}'
+
+    def test_variants_are_generated_on_upload(self):
+        generate_variants(self.name)
+
+        for size in get_variant_sizes():
+            with self.subTest(size=size):
+                path = os.path.join(self.media_root, variant_name(self.name, size))
+                with Image.open(path) as image:
+                    self.assertEqual(max(image.size), size)
+                self.assertEqual(original_name_for_variant(variant_name(self.name, size)), self.name)
+
+    def test_own_variant_is_served(self):
+        response = self.client.get(self.url(96, self.name))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'image/jpeg')
+        self.assertIn('immutable', response['Cache-Control'])
+        with Image.open(io.BytesIO(b''.join(response.streaming_content))) as image:
+            self.assertEqual(image.size, (96, 48))
+
+    def test_other_users_variant_is_forbidden(self):
+        other = 'face_recognition/john_at_example_dot_com/angle_0.jpg'
+        self.write(other, make_jpeg())
+
+        self.assertEqual(self.client.get(self.url(96, other)).status_code, 403)
+        # Path segments cannot step out of the user's own directory
+        escaped = 'face_recognition/jane_at_example_dot_com/../john_at_example_dot_com/angle_0.jpg'
+        self.assertEqual(self.client.get(self.url(96, escaped)).status_code, 403)
+
+        self.user.is_staff = True
+        self.assertEqual(self.client.get(self.url(96, other)).status_code, 200)
+
+    def test_paths_outside_face_media_are_not_served(self):
+        self.write('secret.jpg', make_jpeg())
+        for name in ('secret.jpg', 'face_recognition/../secret.jpg',
+                     'face_recognition/jane_at_example_dot_com/../../secret.jpg'):
+            with self.subTest(name=name):
+                self.assertEqual(self.client.get(self.url(96, name)).status_code, 404)
+
+    def test_unknown_size_or_missing_image_is_not_found(self):
+        self.assertEqual(self.client.get(self.url(97, self.name)).status_code, 404)
+        missing = 'face_recognition/jane_at_example_dot_com/angle_1.jpg'
+        self.assertEqual(self.client.get(self.url(96, missing)).status_code, 404)
+
+
+class AsyncFaceCheckInTests(TestCase):
+    def setUp(self):
+        use_temp_media_root(self)
+        clear_token_cache()
+        self.addCleanup(clear_token_cache)
+        self.user = User.objects.create_user(email='jane@example.com', password='secret-pass-1')
+        UserProfile.objects.create(user=self.user)
+        UserFaceImage.objects.create(user=self.user, angle_index=0, image=ContentFile(make_jpeg(), name='face.jpg'))
+        self.location = Location.objects.create(name='Office', latitude=12.971599, longitude=77.594566, radius=100)
+        self.token = Token.objects.create(user=self.user)
+        self.client = AsyncClient()
+        self.url = reverse('face-check-in-async')
+
+    def check_in(self, latitude=12.971599, longitude=77.594566, token=None):
+        data = {'face_image': jpeg_upload(), 'latitude': latitude, 'longitude': longitude}
+        headers = {'Authorization': f'Token {token or self.token.key}'} if token != '' else {}
+        return self.client.post(self.url, data, headers=headers)
+
+    async def test_verified_check_in_is_recorded(self):
+        with mock.patch('accounts.api_views.select_probe_frames', side_effect=lambda frames: frames), \
+                mock.patch('accounts.api_views.verify_probe_frames', return_value={'verified': True}) as verify:
+            response = await self.check_in()
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['face_verification'], {'verified': True})
+        attendance = await Attendance.objects.aget()
+        self.assertTrue(attendance.is_verified)
+        self.assertEqual(attendance.location_id, self.location.pk)
+        # The profile has no image, so only the angle references are compared
+        _, references, profile_face_image_name = verify.call_args.args
+        self.assertEqual([ref.angle_index for ref in references], [0])
+        self.assertIsNone(profile_face_image_name)
+        self.assertEqual(verify.call_args.kwargs['source'], 'async')
+
+    async def test_failed_verification_records_nothing(self):
+        error = CheckInError({'error': 'Face verification failed'})
+        with mock.patch('accounts.api_views.select_probe_frames', side_effect=lambda frames: frames), \
+                mock.patch('accounts.api_views.verify_probe_frames', side_effect=error):
+            response = await self.check_in()
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {'error': 'Face verification failed'})
+        self.assertFalse(await Attendance.objects.aexists())
+
+    async def test_out_of_range_check_in_is_refused(self):
+        with mock.patch('accounts.api_views.verify_probe_frames') as verify:
+            response = await self.check_in(latitude=13.5)
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['error'], 'You are not within range of any authorized location.')
+        verify.assert_not_called()
+
+    async def test_token_is_required(self):
+        self.assertEqual((await self.check_in(token='')).status_code, 401)
+        self.assertEqual((await self.check_in(token='not-a-token')).status_code, 401)
+        self.assertFalse(await Attendance.objects.aexists())
+
+
+class FaceVerificationJobTests(TestCase):
+    def setUp(self):
+        use_temp_media_root(self)
+        self.user = User.objects.create_user(email='jane@example.com', password='secret-pass-1')
+        UserProfile.objects.create(user=self.user)
+        self.location = Location.objects.create(name='Office', latitude=12.971599, longitude=77.594566, radius=100)
+
+    def pending_check_in(self, **job_fields):
+        attendance = Attendance.objects.create(
+            user=self.user, location=self.location, check_in_latitude=12.971599, check_in_longitude=77.594566,
+            is_verified=False, verification_method='FACE_GPS'
+        )
+        job = FaceVerificationJob.objects.create(user=self.user, attendance=attendance, **job_fields)
+        return job, attendance
+
+    def process(self, job, **verify):
+        with mock.patch('accounts.face_jobs.verify_probe_frames', **verify):
+            process_verification_job(job.pk, ['frame'], [], None)
+        job.refresh_from_db()
+
+    def test_match_verifies_the_attendance(self):
+        job, attendance = self.pending_check_in()
+        self.process(job, return_value={'verified': True, 'similarity': np.float32(0.8)})
+
+        self.assertEqual(job.status, FaceVerificationJob.STATUS_VERIFIED)
+        self.assertAlmostEqual(job.result['similarity'], 0.8, places=5)
+        self.assertIsNotNone(job.completed_at)
+        attendance.refresh_from_db()
+        self.assertTrue(attendance.is_verified)
+
+    def test_mismatch_deletes_the_pending_attendance(self):
+        job, attendance = self.pending_check_in()
+        self.process(job, side_effect=CheckInError({'error': 'Face verification failed'}))
+
+        self.assertEqual(job.status, FaceVerificationJob.STATUS_FAILED)
+        self.assertEqual(job.result, {'error': 'Face verification failed'})
+        self.assertIsNone(job.attendance_id)
+        self.assertFalse(Attendance.objects.filter(pk=attendance.pk).exists())
+
+    def test_pipeline_error_deletes_the_pending_attendance(self):
+        job, attendance = self.pending_check_in()
+        with self.assertLogs('accounts.face_jobs', 'ERROR'):
+            self.process(job, side_effect=RuntimeError('model crashed'))
+
+        self.assertEqual(job.status, FaceVerificationJob.STATUS_ERROR)
+        self.assertFalse(Attendance.objects.exists())
+
+    def test_job_expired_while_running_keeps_its_error(self):
+        job, attendance = self.pending_check_in()
+
+        def expire_meanwhile(*args, **kwargs):
+            _expire_jobs([job.pk])
+            return {'verified': True}
+
+        self.process(job, side_effect=expire_meanwhile)
+
+        self.assertEqual(job.status, FaceVerificationJob.STATUS_ERROR)
+        self.assertEqual(job.result, LOST_JOB_RESULT)
+        self.assertFalse(Attendance.objects.exists())
+
+    def test_finished_job_is_not_run_again(self):
+        job, _ = self.pending_check_in(status=FaceVerificationJob.STATUS_FAILED)
+        with mock.patch('accounts.face_jobs.verify_probe_frames') as verify:
+            process_verification_job(job.pk, ['frame'], [], None)
+        verify.assert_not_called()
+
+    def test_timed_out_job_is_expired_when_polled(self):
+        job, attendance = self.pending_check_in()
+        self.assertEqual(get_job_status(job.pk).status, FaceVerificationJob.STATUS_PENDING)
+
+        FaceVerificationJob.objects.filter(pk=job.pk).update(created_at=timezone.now() - timedelta(minutes=10))
+        with override_settings(FACE_VERIFICATION_JOB_TIMEOUT=300):
+            job = get_job_status(job.pk)
+
+        self.assertEqual(job.status, FaceVerificationJob.STATUS_ERROR)
+        self.assertEqual(job.result, LOST_JOB_RESULT)
+        self.assertFalse(Attendance.objects.filter(pk=attendance.pk).exists())
+
+    def test_jobs_of_gone_processes_are_expired(self):
+        host, pid, nonce = current_job_owner().split(':')
+        finished = subprocess.Popen([sys.executable, '-c', 'pass'])
+        finished.wait()
+        jobs = {
+            'restarted': self.pending_check_in(owner=f'{host}:{pid}:00000000')[0],
+            'dead': self.pending_check_in(owner=f'{host}:{finished.pid}:{nonce}',
+                                          status=FaceVerificationJob.STATUS_RUNNING)[0],
+            'own': self.pending_check_in()[0],
+            'sibling': self.pending_check_in(owner=f'{host}:{os.getppid()}:{nonce}')[0],
+            'other host': self.pending_check_in(owner=f'{host}-other:{finished.pid}:{nonce}')[0],
+        }
+
+        with self.assertLogs('accounts.face_jobs', 'WARNING'):
+            self.assertEqual(expire_orphaned_jobs(), 2)
+
+        statuses = dict(FaceVerificationJob.objects.values_list('pk', 'status'))
+        self.assertEqual({label: statuses[job.pk] for label, job in jobs.items()}, {
+            'restarted': FaceVerificationJob.STATUS_ERROR,
+            'dead': FaceVerificationJob.STATUS_ERROR,
+            'own': FaceVerificationJob.STATUS_PENDING,
+            'sibling': FaceVerificationJob.STATUS_PENDING,
+            'other host': FaceVerificationJob.STATUS_PENDING,
+        })
+        self.assertEqual(Attendance.objects.count(), 3)
+
+
+class DeferredFaceCheckInTests(TestCase):
+    def setUp(self):
+        use_temp_media_root(self)
+        self.user = User.objects.create_user(email='jane@example.com', password='secret-pass-1')
+        UserProfile.objects.create(user=self.user)
+        UserFaceImage.objects.create(user=self.user, angle_index=0, image=ContentFile(make_jpeg(), name='face.jpg'))
+        self.location = Location.objects.create(name='Office', latitude=12.971599, longitude=77.594566, radius=100)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        patcher = mock.patch('accounts.api_views.select_probe_frames', side_effect=lambda frames: frames)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def check_in(self):
+        return self.client.post(reverse('face-check-in'), {
+            'face_image': jpeg_upload(), 'latitude': 12.971599, 'longitude': 77.594566, 'deferred': True,
+        })
+
+    @mock.patch('accounts.api_views.submit_verification_job')
+    def test_check_in_is_pending_until_verified(self, submit):
+        response = self.check_in()
+
+        self.assertEqual(response.status_code, 202)
+        job = FaceVerificationJob.objects.get(pk=response.data['job_id'])
+        self.assertEqual(job.owner, current_job_owner())
+        submit.assert_called_once()
+        self.assertTrue(response.data['status_url'].endswith(reverse('face-verification-job', args=[job.pk])))
+
+        # Pending check-ins are left out of the attendance list and summary
+        self.assertEqual(len(self.client.get(reverse('attendance-list')).data), 0)
+        self.assertEqual(self.client.get(reverse('attendance-summary')).data['attendance_count'], 0)
+        self.assertEqual(Attendance.objects.filter(PENDING_FACE_CHECKIN).count(), 1)
+
+        with mock.patch('accounts.face_jobs.verify_probe_frames', return_value={'verified': True}):
+            queued_job, *frames_and_references = submit.call_args.args
+            process_verification_job(queued_job.pk, *frames_and_references)
+        response = self.client.get(reverse('face-verification-job', args=[job.pk]))
+        self.assertEqual(response.data['status'], FaceVerificationJob.STATUS_VERIFIED)
+        self.assertTrue(response.data['finished'])
+        self.assertEqual(len(self.client.get(reverse('attendance-list')).data), 1)
+
+    @mock.patch('accounts.api_views.submit_verification_job', side_effect=VerificationQueueFull)
+    def test_full_queue_records_nothing(self, submit):
+        response = self.check_in()
+
+        self.assertEqual(response.status_code, 503)
+        self.assertFalse(Attendance.objects.exists())
+        self.assertFalse(FaceVerificationJob.objects.exists())
+
+    def test_other_users_jobs_are_hidden(self):
+        other = User.objects.create_user(email='john@example.com', password='secret-pass-1')
+        job = FaceVerificationJob.objects.create(user=other)
+        self.assertEqual(self.client.get(reverse('face-verification-job', args=[job.pk])).status_code, 404)
+
+
+class FaceLoggingTests(SimpleTestCase):
+    def setUp(self):
+        self.logger = logging.getLogger('accounts.tests.face_pipeline')
+        self.trace = StageLogger(self.logger)
+
+    def test_sample_rates(self):
+        with override_settings(FACE_LOG_SAMPLE_RATE=1, FACE_LOG_SAMPLE_RATES={'detection': 0}):
+            self.assertTrue(is_sampled('embedding'))
+            self.assertFalse(is_sampled('detection'))
+
+        with override_settings(FACE_LOG_SAMPLE_RATE=4, FACE_LOG_SAMPLE_RATES={}):
+            with mock.patch('accounts.face_logging.random.random', return_value=0.24):
+                self.assertTrue(is_sampled('embedding'))
+            with mock.patch('accounts.face_logging.random.random', return_value=0.26):
+                self.assertFalse(is_sampled('embedding'))
+
+    @override_settings(FACE_LOG_SAMPLE_RATE=2, FACE_LOG_SAMPLE_RATES={})
+    def test_one_decision_per_verification(self):
+        draws = iter([0.1, 0.9])
+        with mock.patch('accounts.face_logging.random.random', side_effect=lambda: next(draws)):
+            with verification_trace():
+                sampled = [is_sampled(stage) for stage in ('detection', 'embedding', 'comparison')]
+            with verification_trace():
+                skipped = [is_sampled(stage) for stage in ('detection', 'embedding', 'comparison')]
+
+        self.assertEqual(sampled, [True] * 3)
+        self.assertEqual(skipped, [False] * 3)
+
+    @override_settings(FACE_LOG_SAMPLE_RATE=1, FACE_LOG_SAMPLE_RATES={})
+    def test_stage_records_are_lazy(self):
+        argument = mock.MagicMock()
+        self.logger.setLevel(logging.INFO)
+        self.addCleanup(self.logger.setLevel, logging.NOTSET)
+        self.trace.debug('detection', 'faces: %s', argument)
+        argument.__str__.assert_not_called()
+
+        with self.assertLogs(self.logger, 'DEBUG') as logs:
+            self.trace.debug('detection', 'faces: %s', 3)
+        self.assertEqual(logs.output, ['DEBUG:accounts.tests.face_pipeline:faces: 3'])
+        self.assertEqual(logs.records[0].face_stage, 'detection')
+
+    def test_verification_summary(self):
+        started = time.monotonic()
+        with self.assertLogs('accounts.face_logging', 'INFO') as logs:
+            log_verification_summary({'match': True, 'similarity': np.float32(0.81), 'confidence': 92.5},
+                                     started, user_id=7, references=3)
+
+        summary = logs.records[0].face_verification
+        self.assertTrue(summary['match'])
+        self.assertAlmostEqual(summary['similarity'], 0.81, places=5)
+        self.assertEqual((summary['user_id'], summary['references']), (7, 3))
+        self.assertIn('user_id=7 references=3', logs.output[0])
+
+
+class FaceAuditTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(email='jane@example.com', password='secret-pass-1')
+        # Flushes are driven by the tests instead of the background thread
+        patcher = mock.patch('accounts.face_audit.threading.Thread')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.buffer = AuditBuffer(batch_size=2, flush_interval=60, max_pending=3)
+
+    def event(self, **fields):
+        return FaceVerificationEvent(user=self.user, **fields)
+
+    def test_events_are_recorded_from_results(self):
+        result = {'match': True, 'similarity': np.float32(0.82), 'confidence': 91.0, 'has_eyes': True,
+                  'scores': {'facenet': 0.82}}
+        audit = {'reference_angle': 2, 'references_tried': 3, 'timings': {'embedding': 40.5}}
+        with mock.patch('accounts.face_audit.get_audit_buffer', return_value=self.buffer):
+            record_verification_event(self.user, 'deferred', result, audit)
+            record_verification_event(self.user, 'sync', {'error': 'No face detected'}, {})
+            with override_settings(FACE_AUDIT_ENABLED=False):
+                record_verification_event(self.user, 'sync', result, audit)
+
+        # Nothing is written until the buffer is flushed
+        self.assertFalse(FaceVerificationEvent.objects.exists())
+        self.assertEqual(self.buffer.flush(), 2)
+
+        matched, failed = FaceVerificationEvent.objects.order_by('pk')
+        self.assertEqual((matched.source, matched.matched, matched.reference_angle), ('deferred', True, 2))
+        self.assertAlmostEqual(matched.similarity, 0.82, places=5)
+        self.assertEqual(matched.scores, {'facenet': 0.82})
+        self.assertEqual(matched.timings, {'embedding': 40.5})
+        self.assertFalse(failed.matched)
+        self.assertIsNone(failed.similarity)
+        self.assertEqual(failed.error, 'No face detected')
+
+    def test_full_batch_wakes_the_writer(self):
+        self.buffer.add(self.event())
+        self.assertFalse(self.buffer._wake.is_set())
+        self.buffer.add(self.event())
+        self.assertTrue(self.buffer._wake.is_set())
+
+    def test_oldest_events_are_dropped_when_full(self):
+        events = [self.event(references_tried=index) for index in range(5)]
+        with self.assertLogs('accounts.face_audit', 'WARNING'):
+            for event in events:
+                self.buffer.add(event)
+
+        with self.assertNumQueries(2):
+            self.assertEqual(self.buffer.flush(), 3)
+        self.assertEqual(sorted(FaceVerificationEvent.objects.values_list('references_tried', flat=True)), [2, 3, 4])
+
+    def test_failed_write_keeps_the_events(self):
+        self.buffer.add(self.event())
+        with mock.patch.object(FaceVerificationEvent.objects, 'bulk_create', side_effect=DatabaseError('down')):
+            with self.assertLogs('accounts.face_audit', 'ERROR'):
+                self.assertEqual(self.buffer.flush(), 0)
+
+        self.assertEqual(self.buffer.flush(), 1)
+        self.assertEqual(FaceVerificationEvent.objects.count(), 1)
+
+
+class PipelineContextTests(SimpleTestCase):
+    def test_context_is_reused_within_a_thread(self):
+        context = get_pipeline_context()
+        self.assertIs(get_pipeline_context(), context)
+        self.assertIs(get_pipeline_context().clahe, context.clahe)
+
+    def test_each_thread_gets_its_own_objects(self):
+        def objects():
+            context = get_pipeline_context()
+            return id(context.clahe), id(context.face_cascade)
+
+        barrier = threading.Barrier(3)
+
+        def objects_in_worker(_):
+            # Keep all three threads alive, so no object id is reused
+            ids = objects()
+            barrier.wait(timeout=10)
+            return ids
+
+        with ThreadPoolExecutor(max_workers=3) as pool:
+            worker_objects = list(pool.map(objects_in_worker, range(3)))
+
+        clahe_ids = {clahe for clahe, _ in worker_objects} | {objects()[0]}
+        self.assertEqual(len(clahe_ids), 4)
+        if get_pipeline_context().face_cascade is not None:
+            cascade_ids = {cascade for _, cascade in worker_objects} | {objects()[1]}
+            self.assertEqual(len(cascade_ids), 4)
+
+    @override_settings(FACE_NUM_THREADS=2, FACE_OPENCV_THREADS=None, FACE_TORCH_THREADS=3,
+                       FACE_TORCH_INTEROP_THREADS=None)
+    def test_native_thread_counts(self):
+        torch = mock.Mock()
+        with mock.patch('cv2.setNumThreads') as set_opencv_threads, \
+                mock.patch.dict(sys.modules, {'torch': torch}):
+            configure_native_threads()
+
+        # FACE_NUM_THREADS applies where no per-library count is set
+        set_opencv_threads.assert_called_once_with(2)
+        torch.set_num_threads.assert_called_once_with(3)
+        torch.set_num_interop_threads.assert_not_called()
+
+    @override_settings(FACE_NUM_THREADS=None, FACE_OPENCV_THREADS=None)
+    def test_library_defaults_are_kept_when_unset(self):
+        with mock.patch('cv2.setNumThreads') as set_opencv_threads:
+            configure_native_threads()
+        set_opencv_threads.assert_not_called()
+
+
+class FaceNetBackendTests(SimpleTestCase):
+    def setUp(self):
+        self.addCleanup(set_active_weights, get_active_weights())
+
+    def test_unknown_backend_is_refused(self):
+        with self.assertRaises(ValueError):
+            load_embedder('tensorrt')
+
+    def test_missing_export_is_reported(self):
+        model_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, model_dir)
+        with override_settings(FACENET_MODEL_DIR=model_dir):
+            self.assertEqual(get_model_path('onnx', quantized=True), os.path.join(model_dir, 'facenet.int8.onnx'))
+            self.assertEqual(get_model_path('onnx'), os.path.join(model_dir, 'facenet.onnx'))
+            with self.assertRaisesMessage(FileNotFoundError, 'export_facenet'):
+                load_embedder('onnx', quantized=True)
+
+    def test_failed_backend_falls_back_to_eager_pytorch(self):
+        eager = mock.Mock()
+        with override_settings(FACENET_BACKEND='onnx'), \
+                mock.patch('accounts.face_recognition_utils.load_embedder',
+                           side_effect=[FileNotFoundError('no export'), eager]) as load, \
+                self.assertLogs('accounts.face_recognition_utils', 'ERROR'):
+            self.assertIs(_load_facenet(), eager)
+        self.assertEqual([call.args for call in load.call_args_list], [('onnx',), ('torch',)])
+
+    def test_batch_layout(self):
+        red = np.zeros((100, 80, 3), dtype=np.uint8)
+        red[..., 0] = 255
+        batch = prepare_facenet_batch([red, np.zeros((200, 200, 3), dtype=np.uint8)])
+
+        self.assertEqual(batch.shape, (2, 3, 160, 160))
+        self.assertEqual(batch.dtype, np.float32)
+        self.assertTrue(batch.flags['C_CONTIGUOUS'])
+        self.assertEqual(batch[0, 0].min(), 1.0)
+        self.assertEqual(batch[0, 1:].max(), 0.0)
+
+    def test_pipeline_version_follows_the_loaded_weights(self):
+        set_active_weights('fp32')
+        fp32 = pipeline_version()
+        set_active_weights('int8')
+        int8 = pipeline_version()
+        set_active_weights('none')
+        self.assertEqual(len({fp32, int8, pipeline_version()}), 3)
+
+        # Before the pipeline is loaded, the settings decide
+        set_active_weights(None)
+        with override_settings(FACENET_BACKEND='onnx', FACENET_ONNX_QUANTIZED=True):
+            self.assertEqual(pipeline_version(), int8)
+        with override_settings(FACENET_BACKEND='torchscript'):
+            self.assertEqual(pipeline_version(), fp32)
+
+
+class FaceGalleryTests(TestCase):
+    def setUp(self):
+        use_temp_media_root(self)
+        gallery_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, gallery_dir)
+        self.path = os.path.join(gallery_dir, 'gallery.bin')
+        override = override_settings(FACE_GALLERY_PATH=self.path, FACE_GALLERY_DTYPE='float32',
+                                     FACE_GALLERY_CHECK_INTERVAL=0)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.jane = User.objects.create_user(email='jane@example.com', password='secret-pass-1')
+        self.john = User.objects.create_user(email='john@example.com', password='secret-pass-1')
+
+    def enroll(self, user, angle_index, seed, template_version=None):
+        encoding = make_encoding(seed)
+        face_image, _ = UserFaceImage.objects.update_or_create(user=user, angle_index=angle_index, defaults={
+            'image': ContentFile(make_jpeg(), name='face.jpg'),
+            'template': serialize_template(encoding, embedding_dtype='float32'),
+            'template_version': pipeline_version() if template_version is None else template_version,
+        })
+        return encoding['facenet_embedding']
+
+    def test_build_and_rank(self):
+        jane_front = self.enroll(self.jane, 0, seed=1)
+        jane_left = self.enroll(self.jane, 1, seed=2)
+        john_front = self.enroll(self.john, 0, seed=3)
+        self.enroll(self.john, 1, seed=4, template_version='stale')
+
+        self.assertEqual(build_gallery(), 3)
+        gallery = FaceGallery(self.path)
+
+        self.assertEqual(gallery.pipeline_version, pipeline_version())
+        self.assertEqual(gallery.user_ids.tolist(), [self.jane.pk, self.jane.pk, self.john.pk])
+        scores = gallery.rank_user_references(self.jane.pk, jane_left)
+        self.assertEqual(scores.keys(), {0, 1})
+        self.assertAlmostEqual(scores[1], 1.0, places=5)
+        self.assertAlmostEqual(scores[0], cosine(jane_left, jane_front), places=5)
+        # Only current templates are kept
+        self.assertEqual(gallery.rank_user_references(self.john.pk, john_front).keys(), {0})
+        self.assertEqual(gallery.rank_user_references(self.john.pk + 100, john_front), {})
+
+        best_user, best_angle, similarity = gallery.search(john_front, top_k=2)[0]
+        self.assertEqual((best_user, best_angle), (self.john.pk, 0))
+        self.assertAlmostEqual(similarity, 1.0, places=5)
+
+    def test_update_matches_a_full_build(self):
+        self.enroll(self.jane, 0, seed=1)
+        self.enroll(self.john, 0, seed=2)
+        build_gallery()
+
+        self.enroll(self.jane, 0, seed=5)
+        self.enroll(self.jane, 3, seed=6)
+        UserFaceImage.objects.filter(user=self.john).delete()
+        self.assertEqual(update_gallery([self.jane.pk, self.john.pk]), 2)
+        updated = FaceGallery(self.path)
+
+        full_path = os.path.join(os.path.dirname(self.path), 'full.bin')
+        build_gallery(full_path)
+        full = FaceGallery(full_path)
+        np.testing.assert_array_equal(updated.user_ids, full.user_ids)
+        np.testing.assert_array_equal(updated.angles, full.angles)
+        np.testing.assert_array_equal(updated.matrix, full.matrix)
+
+    def test_update_rebuilds_a_gallery_of_another_pipeline_version(self):
+        self.enroll(self.jane, 0, seed=1)
+        self.enroll(self.john, 0, seed=2)
+        build_gallery()
+
+        with override_settings(FACE_PREPROCESSING='fast'):
+            # No template is current for the new version; John's old row must not survive either
+            self.assertEqual(update_gallery([self.jane.pk]), 0)
+            self.assertEqual(FaceGallery(self.path).pipeline_version, pipeline_version())
+
+    def test_readers_remap_a_rebuilt_gallery(self):
+        self.enroll(self.jane, 0, seed=1)
+        with mock.patch.object(face_gallery, '_gallery', None):
+            self.assertIsNone(get_gallery())
+            build_gallery()
+            first = get_gallery()
+            self.assertEqual(first.count, 1)
+            self.assertIs(get_gallery(), first)
+
+            self.enroll(self.john, 0, seed=2)
+            rebuild_gallery([self.john.pk])
+            self.assertEqual(get_gallery().count, 2)
+            # The old mapping stays readable
+            self.assertEqual(first.user_ids.tolist(), [self.jane.pk])
+
+    def test_changes_are_coalesced_into_one_rebuild(self):
+        with mock.patch.object(face_gallery, '_rebuild_users', set()), \
+                mock.patch.object(face_gallery, '_rebuild_timer', None), \
+                mock.patch('accounts.face_gallery.threading.Timer') as timer, \
+                mock.patch('accounts.face_gallery.rebuild_gallery') as rebuild:
+            schedule_gallery_rebuild(self.jane.pk)
+            schedule_gallery_rebuild(self.john.pk)
+            schedule_gallery_rebuild(self.jane.pk)
+            timer.assert_called_once()
+            face_gallery._run_scheduled_rebuild()
+            rebuild.assert_called_once_with({self.jane.pk, self.john.pk})
+
+            # A change without a user rebuilds everything
+            schedule_gallery_rebuild(self.jane.pk)
+            schedule_gallery_rebuild()
+            face_gallery._run_scheduled_rebuild()
+            rebuild.assert_called_with(None)
+
+
+def bgr_frame(low, high, size=(240, 320), seed=0):
+    """BGR frame of uniform noise between low and high"""
+    rng = np.random.default_rng(seed)
+    gray = rng.integers(low, high + 1, size, dtype=np.uint8)
+    return np.ascontiguousarray(np.repeat(gray[:, :, None], 3, axis=2))
+
+
+class FaceQualityGateTests(SimpleTestCase):
+    def detect_face_at(self, box):
+        """Replace the Haar pass with one that finds a face at box (x, y, w, h), or none"""
+        context = mock.Mock()
+        context.face_cascade.detectMultiScale.return_value = [box] if box else []
+        patcher = mock.patch('accounts.face_quality.get_pipeline_context', return_value=context)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        return context.face_cascade
+
+    def test_real_face_passes(self):
+        assessment = assess_probe_quality(SAMPLE_FACE)
+
+        self.assertTrue(assessment['passed'])
+        self.assertIsNone(assessment['reason'])
+        self.assertGreater(assessment['metrics']['face_ratio'], 0.12)
+
+    def test_reasons(self):
+        cases = [
+            ('no_face', None, bgr_frame(60, 200)),
+            ('too_small', (150, 100, 20, 20), bgr_frame(60, 200)),
+            ('too_dark', (80, 40, 160, 160), bgr_frame(0, 40)),
+            ('too_bright', (80, 40, 160, 160), bgr_frame(225, 255)),
+            ('blurry', (80, 40, 160, 160), bgr_frame(128, 128)),
+            (None, (80, 40, 160, 160), bgr_frame(60, 200)),
+        ]
+        for code, box, frame in cases:
+            with self.subTest(code=code):
+                self.detect_face_at(box)
+                assessment = assess_probe_quality(mock.Mock(bgr=frame))
+                self.assertEqual(assessment['code'], code)
+                self.assertEqual(assessment['passed'], code is None)
+                self.assertEqual(assessment['reason'], QUALITY_REASONS.get(code))
+
+    def test_large_frames_are_checked_downscaled(self):
+        cascade = self.detect_face_at((80, 40, 160, 160))
+        frame = bgr_frame(60, 200, size=(1200, 1600))
+        with override_settings(FACE_QUALITY_MAX_SIDE=320):
+            assess_probe_quality(mock.Mock(bgr=frame))
+
+        gray = cascade.detectMultiScale.call_args.args[0]
+        self.assertEqual(gray.shape, (240, 320))
+
+    def test_unreadable_image(self):
+        assessment = assess_probe_quality(io.BytesIO(b'not an image'))
+        self.assertEqual(assessment['code'], 'unreadable')
+
+    def test_gate_never_blocks_on_errors(self):
+        with override_settings(FACE_QUALITY_ENABLED=False):
+            self.assertIsNone(quality_gate(SAMPLE_FACE))
+        with mock.patch('accounts.face_quality.assess_probe_quality', side_effect=cv2.error('bad frame')), \
+                self.assertLogs('accounts.face_quality', 'WARNING'):
+            self.assertIsNone(quality_gate(SAMPLE_FACE))
+
+
+def transform_point(matrix, point):
+    return matrix @ np.array([point[0], point[1], 1.0])
+
+
+class FaceAlignmentTests(SimpleTestCase):
+    def test_transform_levels_eyes_at_canonical_positions(self):
+        size = 160
+        for left, right in [((40, 60), (90, 60)), ((40, 70), (90, 50)), ((112.5, 30.0), (150.0, 52.0))]:
+            with self.subTest(left=left, right=right):
+                matrix = alignment_transform(left, right, size)
+                np.testing.assert_allclose(
+                    transform_point(matrix, left), np.array(ALIGNED_LEFT_EYE) * size, atol=1e-6
+                )
+                np.testing.assert_allclose(
+                    transform_point(matrix, right), np.array(ALIGNED_RIGHT_EYE) * size, atol=1e-6
+                )
+
+    def test_landmark_eyes_are_sorted_left_to_right(self):
+        gray = np.zeros((100, 100), dtype=np.uint8)
+        landmarks = {'left_eye': [70.0, 40.0], 'right_eye': [30.0, 42.0], 'nose': [50.0, 60.0]}
+        self.assertEqual(find_eye_centers(gray, (0, 0, 100, 100), landmarks), ((30.0, 42.0), (70.0, 40.0)))
+
+    def test_implausible_eye_pairs_are_rejected(self):
+        gray = np.zeros((100, 100), dtype=np.uint8)
+        for left_eye, right_eye in [((50, 40), (54, 40)), ((30, 20), (50, 60))]:
+            with self.subTest(left_eye=left_eye, right_eye=right_eye):
+                landmarks = {'left_eye': left_eye, 'right_eye': right_eye}
+                self.assertIsNone(find_eye_centers(gray, (0, 0, 100, 100), landmarks))
+
+    def test_cascade_fallback_uses_two_largest_eyes_in_upper_half(self):
+        gray = np.zeros((200, 200), dtype=np.uint8)
+        eye_cascade = mock.Mock()
+        eye_cascade.detectMultiScale.return_value = [(60, 20, 20, 20), (10, 20, 20, 20), (40, 40, 4, 4)]
+
+        eyes = find_eye_centers(gray, (30, 50, 100, 100), eye_cascade=eye_cascade)
+
+        self.assertEqual(eyes, ((50.0, 80.0), (100.0, 80.0)))
+        self.assertEqual(eye_cascade.detectMultiScale.call_args.args[0].shape, (50, 100))
+
+    def test_cascade_fallback_needs_two_eyes(self):
+        eye_cascade = mock.Mock()
+        eye_cascade.detectMultiScale.return_value = [(60, 20, 20, 20)]
+        gray = np.zeros((200, 200), dtype=np.uint8)
+        self.assertIsNone(find_eye_centers(gray, (30, 50, 100, 100), eye_cascade=eye_cascade))
+        self.assertIsNone(find_eye_centers(gray, (30, 50, 100, 100)))
+
+    def test_align_face_warps_every_image_to_the_crop_size(self):
+        color = bgr_frame(0, 255, size=(120, 100))
+        gray = cv2.cvtColor(color, cv2.COLOR_BGR2GRAY)
+        aligned_gray, aligned_color = align_face([gray, color], ((30, 50), (70, 55)), 64)
+        self.assertEqual(aligned_gray.shape, (64, 64))
+        self.assertEqual(aligned_color.shape, (64, 64, 3))
+
+    def test_encoding_reports_alignment(self):
+        with open(SAMPLE_FACE, 'rb') as f:
+            image = DecodedImage(f.read(), os.path.basename(SAMPLE_FACE))
+        self.assertTrue(compute_face_encoding(image)['aligned'])
+        with override_settings(FACE_ALIGNMENT_ENABLED=False):
+            self.assertFalse(compute_face_encoding(image)['aligned'])
+
+
+@override_settings(FACE_GALLERY_ENABLED=False)
+class TemplateVersioningTests(TestCase):
+    def setUp(self):
+        use_temp_media_root(self)
+        self.user = User.objects.create_user(email='jane@example.com', password='secret-pass-1')
+        self.addCleanup(face_enrollment._refreshing.clear)
+
+    def add_reference(self, angle_index, template=None, template_version='old'):
+        return UserFaceImage.objects.create(
+            user=self.user, angle_index=angle_index, image=ContentFile(make_jpeg(), name='face.jpg'),
+            template=template, template_version=template_version
+        )
+
+    def verify(self, references, **kwargs):
+        audit = {}
+        with mock.patch('accounts.face_checkin.get_face_encoding', return_value=make_encoding()) as encode, \
+                mock.patch('accounts.face_checkin.verify_face_encodings',
+                           return_value={'match': False, 'similarity': 10.0}), \
+                mock.patch('accounts.face_checkin.schedule_template_refresh') as refresh:
+            verify_against_references(PROBE, references, audit=audit, **kwargs)
+        return encode.call_count, audit['references_tried'], refresh
+
+    def test_version_tracks_settings_that_change_templates(self):
+        version = pipeline_version()
+        with override_settings(FACE_ALIGNMENT_ENABLED=False):
+            self.assertNotEqual(pipeline_version(), version)
+        with override_settings(FACE_PREPROCESSING='fast'):
+            self.assertNotEqual(pipeline_version(), version)
+        with override_settings(FACE_TEMPLATE_EMBEDDING_DTYPE='float32'):
+            self.assertEqual(pipeline_version(), version)
+
+    def test_rejected_photos_are_not_stale(self):
+        rejected = self.add_reference(0, template_version=pipeline_version())
+        self.assertFalse(needs_template(rejected))
+        self.assertFalse(is_current_template(rejected))
+        self.assertTrue(needs_template(rejected, version='newer'))
+
+    def test_stale_references_encoded_per_check_in_are_capped(self):
+        references = [self.add_reference(angle_index) for angle_index in range(3)]
+
+        encodings, tried, refresh = self.verify(references)
+        # The probe and one reference
+        self.assertEqual((encodings, tried), (2, 1))
+        refresh.assert_called_once_with(references)
+
+        with override_settings(FACE_STALE_REFERENCE_LIMIT=2):
+            self.assertEqual(self.verify(references)[:2], (3, 2))
+
+    def test_current_templates_replace_stale_references(self):
+        current = self.add_reference(0, accepted_template()['template'], pipeline_version())
+        stale = self.add_reference(1)
+
+        encodings, tried, refresh = self.verify([current, stale])
+
+        self.assertEqual((encodings, tried), (1, 1))
+        refresh.assert_called_once_with([current, stale])
+
+    def test_profile_template_skips_stale_encoding(self):
+        references = [self.add_reference(angle_index) for angle_index in range(2)]
+        encodings, tried, _ = self.verify(
+            references, profile_face_image_name='profile.jpg', profile_template=accepted_template()['template']
+        )
+        self.assertEqual((encodings, tried), (1, 1))
+
+    def test_refresh_stores_the_new_template(self):
+        reference = self.add_reference(0)
+        with mock.patch('accounts.face_enrollment.extract_enrollment_template', return_value=accepted_template(3)), \
+                mock.patch('accounts.face_enrollment.schedule_gallery_rebuild') as rebuild:
+            _refresh_template(reference.pk, self.user.pk, reference.image.name)
+
+        reference.refresh_from_db()
+        self.assertEqual(bytes(reference.template), accepted_template(3)['template'])
+        self.assertTrue(is_current_template(reference))
+        rebuild.assert_called_once_with(self.user.pk)
+
+    def test_refresh_records_rejections_with_the_current_version(self):
+        reference = self.add_reference(0, accepted_template()['template'])
+        with mock.patch('accounts.face_enrollment.extract_enrollment_template', return_value=rejected_template()), \
+                self.assertLogs('accounts.face_enrollment', 'WARNING'):
+            _refresh_template(reference.pk, self.user.pk, reference.image.name)
+
+        reference.refresh_from_db()
+        self.assertIsNone(reference.template)
+        self.assertFalse(needs_template(reference))
+
+    def test_refresh_leaves_replaced_photos_alone(self):
+        reference = self.add_reference(0)
+        storage = UserFaceImage._meta.get_field('image').storage
+        replaced = storage.save('replaced.jpg', ContentFile(make_jpeg(color=(1, 2, 3))))
+        with mock.patch('accounts.face_enrollment.extract_enrollment_template', return_value=accepted_template()):
+            _refresh_template(reference.pk, self.user.pk, replaced)
+
+        reference.refresh_from_db()
+        self.assertEqual(reference.template_version, 'old')
+
+    def test_schedule_skips_queued_and_current_rows(self):
+        stale = self.add_reference(0)
+        current = self.add_reference(1, accepted_template()['template'], pipeline_version())
+        rejected = self.add_reference(2, template_version=pipeline_version())
+        executor = mock.Mock()
+
+        with mock.patch('accounts.face_enrollment.get_enrollment_executor', return_value=executor):
+            self.assertEqual(schedule_template_refresh([stale, current, rejected]), 1)
+            self.assertEqual(schedule_template_refresh([stale, current, rejected]), 0)
+
+        executor.submit.assert_called_once_with(_refresh_template, stale.pk, self.user.pk, stale.image.name)
+
+    @mock.patch('accounts.management.commands.reembed_faces.ProcessPoolExecutor', InlineExecutor)
+    def test_reembed_faces_updates_stale_rows_only(self):
+        stale = self.add_reference(0)
+        unusable = self.add_reference(1)
+        rejected = self.add_reference(2, template_version=pipeline_version())
+        results = {
+            os.path.basename(stale.image.name): accepted_template(),
+            os.path.basename(unusable.image.name): rejected_template(),
+        }
+
+        stdout = io.StringIO()
+        with mock.patch('accounts.management.commands.reembed_faces.extract_template_from_bytes',
+                        side_effect=lambda name, data: results[name]) as extract:
+            call_command('reembed_faces', stdout=stdout, stderr=io.StringIO())
+
+        self.assertEqual(extract.call_count, 2)
+        self.assertIn('updated=1, rejected=1', stdout.getvalue())
+        for reference in (stale, unusable, rejected):
+            reference.refresh_from_db()
+            self.assertFalse(needs_template(reference))
+        self.assertTrue(is_current_template(stale))
+        self.assertIsNone(unusable.template)
+
+
+def quality(passed=True, sharpness=100.0, face_ratio=0.3, code=None):
+    """assess_probe_quality result with the given metrics"""
+    return {
+        'passed': passed,
+        'code': code,
+        'reason': QUALITY_REASONS.get(code),
+        'metrics': {'sharpness': sharpness, 'face_ratio': face_ratio},
+    }
+
+
+class BurstCheckInTests(TestCase):
+    def gate(self, assessments):
+        """Patch the quality gate to assess each frame by its name"""
+        patcher = mock.patch('accounts.face_checkin.quality_gate', side_effect=lambda frame: assessments[frame.name])
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def frames(self, *names):
+        return [DecodedImage(b'frame bytes', name) for name in names]
+
+    def test_frame_score_ranks_passing_then_ungated_then_failing(self):
+        scores = [
+            frame_score(quality(sharpness=50.0, face_ratio=0.2)),
+            frame_score(quality(sharpness=50.0, face_ratio=0.4)),
+            frame_score(None),
+            frame_score(quality(passed=False, code='blurry')),
+        ]
+        self.assertEqual(sorted(scores, reverse=True), [scores[1], scores[0], scores[2], scores[3]])
+
+    def test_best_passing_frames_are_selected(self):
+        self.gate({
+            'dark.jpg': quality(passed=False, code='too_dark'),
+            'soft.jpg': quality(sharpness=40.0),
+            'sharp.jpg': quality(sharpness=200.0),
+            'close.jpg': quality(sharpness=150.0, face_ratio=0.5),
+        })
+        frames = self.frames('dark.jpg', 'soft.jpg', 'sharp.jpg', 'close.jpg')
+
+        self.assertEqual([frame.name for frame in select_probe_frames(frames)], ['close.jpg', 'sharp.jpg'])
+        with override_settings(FACE_BURST_ENCODE_FRAMES=3):
+            self.assertEqual(len(select_probe_frames(frames)), 3)
+
+    def test_frames_keep_their_order_without_the_gate(self):
+        frames = self.frames('first.jpg', 'second.jpg', 'third.jpg')
+        with override_settings(FACE_QUALITY_ENABLED=False, FACE_BURST_ENCODE_FRAMES=2):
+            self.assertEqual(select_probe_frames(frames), frames[:2])
+
+    def test_burst_without_usable_frames_is_rejected(self):
+        self.gate({
+            'dark.jpg': quality(passed=False, code='too_dark'),
+            'blurry.jpg': quality(passed=False, code='blurry'),
+        })
+        with self.assertRaises(CheckInError) as raised:
+            select_probe_frames(self.frames('dark.jpg', 'blurry.jpg'))
+
+        self.assertEqual(raised.exception.payload['error'], QUALITY_REASONS['too_dark'])
+        self.assertEqual(raised.exception.payload['quality']['code'], 'too_dark')
+
+    @mock.patch('accounts.face_checkin.run_face_verification')
+    def test_next_frame_is_only_tried_after_a_mismatch(self, run):
+        frames = self.frames('best.jpg', 'next.jpg')
+
+        run.return_value = {'match': True}
+        self.assertEqual(verify_probe_frames(frames, []), {'match': True})
+        self.assertEqual(run.call_count, 1)
+
+        run.reset_mock()
+        run.side_effect = [CheckInError({'error': 'no match'}), {'match': True}]
+        self.assertEqual(verify_probe_frames(frames, []), {'match': True})
+        self.assertEqual([call.args[0] for call in run.call_args_list], frames)
+
+        run.side_effect = CheckInError({'error': 'no match'})
+        with self.assertRaises(CheckInError):
+            verify_probe_frames(frames, [])
+
+
+class BurstCheckInViewTests(TestCase):
+    def setUp(self):
+        use_temp_media_root(self)
+        self.user = User.objects.create_user(email='jane@example.com', password='secret-pass-1')
+        UserProfile.objects.create(user=self.user)
+        UserFaceImage.objects.create(user=self.user, angle_index=0, image=ContentFile(make_jpeg(), name='face.jpg'))
+        Location.objects.create(name='Office', latitude=12.971599, longitude=77.594566, radius=100)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def check_in(self, *frame_names, **data):
+        data.setdefault('face_images', [jpeg_upload(name) for name in frame_names])
+        return self.client.post(reverse('face-check-in'), dict(data, latitude=12.971599, longitude=77.594566))
+
+    @mock.patch('accounts.api_views.verify_probe_frames', return_value={'match': True, 'similarity': 0.9})
+    def test_only_the_best_frames_are_verified(self, verify):
+        assessments = {
+            'a.jpg': quality(sharpness=20.0),
+            'b.jpg': quality(sharpness=90.0),
+            'c.jpg': quality(passed=False, code='blurry'),
+        }
+        with mock.patch('accounts.face_checkin.quality_gate',
+                        side_effect=lambda frame: assessments[frame.name]) as gate:
+            response = self.check_in('a.jpg', 'b.jpg', 'c.jpg')
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(gate.call_count, 3)
+        self.assertEqual([frame.name for frame in verify.call_args.args[0]], ['b.jpg', 'a.jpg'])
+
+    @mock.patch('accounts.api_views.verify_probe_frames')
+    def test_unusable_burst_is_rejected_before_verification(self, verify):
+        with mock.patch('accounts.face_checkin.quality_gate', return_value=quality(passed=False, code='blurry')):
+            response = self.check_in('a.jpg', 'b.jpg')
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['quality']['code'], 'blurry')
+        verify.assert_not_called()
+        self.assertFalse(Attendance.objects.exists())
+
+    def test_burst_size_is_limited(self):
+        response = self.check_in(*[f'{index}.jpg' for index in range(6)])
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('face_images', response.data)
+
+        response = self.check_in(face_images=[])
+        self.assertEqual(response.status_code, 400)
+
+
+def box_overlap(a, b):
+    """Intersection over union of two (x, y, w, h) boxes"""
+    width = min(a[0] + a[2], b[0] + b[2]) - max(a[0], b[0])
+    height = min(a[1] + a[3], b[1] + b[3]) - max(a[1], b[1])
+    intersection = max(0, width) * max(0, height)
+    return intersection / float(a[2] * a[3] + b[2] * b[3] - intersection)
+
+
+def fake_cascade(hits_for_level):
+    """Haar cascade stand-in returning hits_for_level(level) from each single-scale scan"""
+    cascade = mock.Mock()
+    cascade.getOriginalWindowSize.return_value = (24, 24)
+    cascade.detectMultiScale.side_effect = lambda level, **kwargs: hits_for_level(level)
+    return cascade
+
+
+class HaarPyramidTests(SimpleTestCase):
+    def setUp(self):
+        self.gray = cv2.cvtColor(cv2.imread(SAMPLE_FACE), cv2.COLOR_BGR2GRAY)
+        self.cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
+
+    def test_levels_are_built_once_coarsest_first(self):
+        pyramid = HaarPyramid(np.zeros((1200, 1600), dtype=np.uint8), max_side=640, step=1.25)
+        levels = list(pyramid.levels())
+
+        self.assertEqual(levels[-1][1].shape, (480, 640))
+        self.assertEqual([scale for scale, _ in levels], sorted(scale for scale, _ in levels))
+        self.assertGreaterEqual(min(levels[0][1].shape), 20)
+        self.assertTrue(all(a is b for (_, a), (_, b) in zip(levels, pyramid.levels())))
+
+    def test_finds_the_face_detect_multiscale_finds(self):
+        expected = self.cascade.detectMultiScale(self.gray, scaleFactor=1.1, minNeighbors=5, minSize=(60, 60))
+        faces = detect_faces_haar(self.gray, self.cascade)
+
+        self.assertEqual(len(faces), 1)
+        self.assertGreater(box_overlap(faces[0], expected[0]), 0.6)
+
+    def test_boxes_are_in_full_image_pixels(self):
+        large = cv2.resize(self.gray, None, fx=2, fy=2)
+        face = detect_faces_haar(self.gray, self.cascade)[0]
+        with override_settings(FACE_HAAR_MAX_SIDE=600):
+            large_face = detect_faces_haar(large, self.cascade)[0]
+
+        self.assertGreater(box_overlap(large_face, [2 * v for v in face]), 0.8)
+
+    def test_scan_stops_at_the_first_level_with_a_face(self):
+        cascade = fake_cascade(lambda level: [(10, 10, 24, 24)] * 6)
+        pyramid = HaarPyramid(np.zeros((200, 200), dtype=np.uint8), step=1.5)
+
+        faces = pyramid.detect(cascade, ((5, 0), (3, 0)))
+
+        self.assertEqual(cascade.detectMultiScale.call_count, 1)
+        self.assertEqual(len(faces), 1)
+
+    def test_lenient_passes_reuse_the_strict_hits(self):
+        full_size = (200, 200)
+        cascade = fake_cascade(lambda level: [(100, 100, 50, 50)] * 4 if level.shape == full_size else [])
+        pyramid = HaarPyramid(np.zeros(full_size, dtype=np.uint8), step=1.5)
+
+        self.assertEqual(pyramid.detect(cascade, PRIMARY_PASSES), [(100, 100, 50, 50)])
+        self.assertEqual(cascade.detectMultiScale.call_count, len(list(pyramid.levels())))
+        # Too small for every pass
+        self.assertEqual(pyramid.detect(cascade, ((5, 60), (3, 60))), [])
+
+    def test_fallbacks_run_in_order(self):
+        alt_cascade = mock.Mock()
+        with mock.patch.object(HaarPyramid, 'detect', autospec=True, side_effect=[[], [], [(1, 2, 3, 4)]]) as detect:
+            self.assertEqual(detect_faces_haar(self.gray, self.cascade, alt_cascade), [(1, 2, 3, 4)])
+
+        self.assertEqual(
+            [(call.args[1], call.kwargs.get('source', 'gray')) for call in detect.call_args_list],
+            [(self.cascade, 'gray'), (alt_cascade, 'gray'), (self.cascade, 'edges')]
+        )
+
+
+class PreprocessingTests(TestCase):
+    def setUp(self):
+        self.image = cv2.imread(SAMPLE_FACE)
+
+    def test_variant_follows_the_setting(self):
+        with mock.patch('accounts.face_recognition_utils.preprocess_image_legacy', return_value='legacy') as legacy:
+            self.assertEqual(preprocess_image(self.image), 'legacy')
+            with override_settings(FACE_PREPROCESSING='fast'):
+                self.assertIsInstance(preprocess_image(self.image), np.ndarray)
+        legacy.assert_called_once_with(self.image)
+
+    @override_settings(FACE_PREPROCESSING='fast')
+    def test_fast_variant_keeps_shape_type_and_color(self):
+        original = self.image.copy()
+        processed = preprocess_image(self.image)
+
+        self.assertEqual((processed.shape, processed.dtype), (self.image.shape, np.uint8))
+        np.testing.assert_array_equal(self.image, original)
+        # Only luminance is changed
+        chroma = cv2.cvtColor(self.image, cv2.COLOR_BGR2YCrCb)[..., 1:].astype(int)
+        processed_chroma = cv2.cvtColor(processed, cv2.COLOR_BGR2YCrCb)[..., 1:]
+        self.assertLess(np.abs(chroma - processed_chroma).mean(), 0.5)
+
+        gray = cv2.cvtColor(self.image, cv2.COLOR_BGR2GRAY)
+        self.assertEqual(preprocess_image(gray).shape, gray.shape)
+
+    def test_fast_variant_stays_close_to_legacy(self):
+        with override_settings(FACE_PREPROCESSING='fast'):
+            fast = cv2.cvtColor(preprocess_image(self.image), cv2.COLOR_BGR2GRAY)
+        legacy = cv2.cvtColor(preprocess_image_legacy(self.image), cv2.COLOR_BGR2GRAY)
+        self.assertGreater(np.corrcoef(fast.ravel(), legacy.ravel())[0, 1], 0.85)
+
+    def test_guided_smooth_removes_noise_and_keeps_edges(self):
+        rng = np.random.default_rng(0)
+        noisy = np.clip(128 + rng.normal(0, 10, (101, 77)), 0, 255).astype(np.uint8)
+        smoothed = guided_smooth(noisy)
+        self.assertEqual((smoothed.shape, smoothed.dtype), (noisy.shape, np.uint8))
+        self.assertLess(smoothed.std(), noisy.std() / 4)
+
+        step = np.zeros((64, 64), dtype=np.uint8)
+        step[:, 32:] = 200
+        smoothed = guided_smooth(step)
+        self.assertLessEqual(smoothed[:, :28].max(), 5)
+        self.assertGreaterEqual(smoothed[:, 36:].min(), 195)
+
+    def test_guided_smooth_of_tiny_images(self):
+        flat = np.full((5, 5), 77, dtype=np.uint8)
+        np.testing.assert_array_equal(guided_smooth(flat), flat)
+
+    def test_benchmark_compares_both_variants(self):
+        use_temp_media_root(self)
+        for email in ('jane@example.com', 'john@example.com'):
+            user = User.objects.create_user(email=email, password='secret-pass-1')
+            for angle_index in range(2):
+                UserFaceImage.objects.create(user=user, angle_index=angle_index,
+                                             image=ContentFile(make_jpeg(), name='face.jpg'))
+
+        stdout = io.StringIO()
+        with mock.patch('accounts.management.commands.benchmark_preprocessing.get_face_encoding',
+                        return_value=make_encoding()) as encode, \
+                mock.patch('accounts.management.commands.benchmark_preprocessing.verify_face_encodings',
+                           return_value={'match': True}):
+            call_command('benchmark_preprocessing', impostor_pairs=2, repeat=1, stdout=stdout)
+
+        self.assertEqual(encode.call_count, 8)
+        self.assertIn('legacy: preprocess', stdout.getvalue())
+        self.assertIn('fast: preprocess', stdout.getvalue())
+        self.assertIn('false accept +0.0%', stdout.getvalue())
+
+    def test_benchmark_needs_two_enrolled_users(self):
+        with self.assertRaises(CommandError):
+            call_command('benchmark_preprocessing', stdout=io.StringIO())
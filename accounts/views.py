@@ -21,6 +21,7 @@ from .forms import (
     CustomPasswordResetForm, CustomSetPasswordForm, 
     CustomPasswordChangeForm, UserProfileForm, UserUpdateForm
 )
+from .face_variants import thumbnail_url
 from .models import CustomUser, UserProfile
 from .tokens import account_activation_token
 
@@ -189,8 +190,11 @@ def user_detail(request, user_id):
         return redirect('home')
     
     user = get_object_or_404(User, id=user_id)
+    profile = getattr(user, 'profile', None)
     context = {
-        'user_detail': user
+        'user_detail': user,
+        # The page shows the face image at up to 200px
+        'face_image_thumbnail_url': thumbnail_url(request, profile.face_image.name, 200) if profile and profile.face_image else None
     }
     
     return render(request, 'users/user_detail.html', context)
\ No newline at end of file
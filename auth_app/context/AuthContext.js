@@ -10,6 +10,9 @@ import axios from 'axios';
 // const API_URL = 'http://10.84.15.213:8000/api/auth/';  // For iOS simulator
 const API_URL = 'http://192.168.29.66:8000/api/auth/';  // For physical device (your computer's IP)
 
+// Thumbnail variant (longest side in pixels) shown instead of the original face images
+const FACE_THUMBNAIL_SIZE = '256';
+
 // Create context
 export const AuthContext = createContext();
 
@@ -460,6 +463,7 @@ export const AuthProvider = ({ children }) => {
       if (referenceFaceImage) {
         faceImages.push({
           image_url: referenceFaceImage,
+          thumbnail_url: userDetails.profile?.face_image_variants?.[FACE_THUMBNAIL_SIZE],
           upload_date: userDetails.profile?.updated_at || new Date().toISOString(),
           is_reference: true
         });
@@ -507,6 +511,7 @@ export const AuthProvider = ({ children }) => {
             // Map the API response to our expected format
             const apiImages = data.face_images.map(img => ({
               image_url: img.url || img.image,
+              thumbnail_url: img.variants?.[FACE_THUMBNAIL_SIZE],
               upload_date: img.updated_at || img.created_at,
               is_reference: false,
               angle_index: img.angle_index
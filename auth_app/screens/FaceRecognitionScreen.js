@@ -85,32 +85,18 @@ const FaceRecognitionScreen = ({ navigation }) => {
   // Helper function to check server without UI side effects
   const checkServerForReferenceImage = async () => {
     try {
-      // Try direct face check endpoint
+      // Combined enrollment status endpoint (replaces face/check + face/history)
       try {
-        const faceCheckResponse = await axios.get(`${API_URL}face/check/`, {
+        const statusResponse = await axios.get(`${API_URL}face/status/`, {
           headers: { Authorization: `Token ${authToken}` },
           timeout: 5000
         });
         
-        if (faceCheckResponse.data && faceCheckResponse.data.has_face_image) {
+        if (statusResponse.data && statusResponse.data.has_uploads) {
           return true;
         }
       } catch (error) {
-        console.log('Face check endpoint not available');
-      }
-      
-      // Try history endpoint
-      try {
-        const historyResponse = await axios.get(`${API_URL}face/history/`, {
-          headers: { Authorization: `Token ${authToken}` },
-          timeout: 5000
-        });
-        
-        if (historyResponse.data && historyResponse.data.has_uploads) {
-          return true;
-        }
-      } catch (error) {
-        console.log('History endpoint not available');
+        console.log('Face status endpoint not available');
       }
       
       // No evidence of a face image
@@ -21,11 +21,13 @@ import { useAuth } from '../context/AuthContext';
 import Icon from 'react-native-vector-icons/MaterialCommunityIcons';
 
 // Component to handle image loading with fallback
-const ImageWithFallback = ({ imageUrl, style, onDelete }) => {
+// Pass authToken for URLs behind the API's token authentication (thumbnails)
+const ImageWithFallback = ({ imageUrl, authToken, style, onDelete }) => {
   const [hasError, setHasError] = useState(false);
   const [isLoading, setIsLoading] = useState(true);
   const [loadAttempts, setLoadAttempts] = useState(0);
   const filename = imageUrl ? imageUrl.split('/').pop() : 'unknown';
+  const headers = authToken ? { Authorization: `Token ${authToken}` } : undefined;
   
   // Log the image URL for debugging with more details
   useEffect(() => {
@@ -38,6 +40,11 @@ const ImageWithFallback = ({ imageUrl, style, onDelete }) => {
     setIsLoading(true);
     setLoadAttempts(prev => prev + 1);
     
+    // Thumbnails need the auth header, which Image.prefetch cannot send
+    if (authToken) {
+      return;
+    }
+    
     // Preload the image to check if it exists
     Image.prefetch(imageUrl)
       .then(() => {
@@ -53,7 +60,7 @@ const ImageWithFallback = ({ imageUrl, style, onDelete }) => {
     return () => {
       console.log(`[ImageWithFallback] Cleanup for image: ${filename}`);
     };
-  }, [imageUrl, style]);
+  }, [imageUrl, authToken, style]);
   
   // If there's an error loading the image, show error placeholder instead of returning null
   if (hasError) {
@@ -87,7 +94,7 @@ const ImageWithFallback = ({ imageUrl, style, onDelete }) => {
         </View>
       )}
       <Image 
-        source={{ uri: imageUrl }} 
+        source={{ uri: imageUrl, headers }} 
         style={style} 
         resizeMode="cover"
         onLoadStart={() => {
@@ -123,7 +130,7 @@ const ImageWithFallback = ({ imageUrl, style, onDelete }) => {
 
 const UserDetailScreen = ({ route, navigation }) => {
   const { userId } = route.params;
-  const { getUserDetails, deleteUser, uploadUserFaceImage, getUserFaceImages, deleteUserFaceImage, user: currentUser } = useAuth();
+  const { getUserDetails, deleteUser, uploadUserFaceImage, getUserFaceImages, deleteUserFaceImage, user: currentUser, authToken } = useAuth();
   const [user, setUser] = useState(null);
   const [loading, setLoading] = useState(true);
   const [error, setError] = useState(null);
@@ -852,7 +859,8 @@ const UserDetailScreen = ({ route, navigation }) => {
                       <View key={index} style={styles.faceImageItem}>
                         <View style={styles.faceImageContainer}>
                           <ImageWithFallback 
-                            imageUrl={image.image_url} 
+                            imageUrl={image.thumbnail_url || image.image_url} 
+                            authToken={image.thumbnail_url ? authToken : undefined}
                             style={[styles.additionalFaceImage, image.is_reference && styles.referenceImage]}
                           />
                           <TouchableOpacity 
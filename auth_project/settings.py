@@ -172,7 +172,7 @@ X_FRAME_OPTIONS = 'DENY'
 # REST Framework settings
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'accounts.authentication.CachedTokenAuthentication',
         'rest_framework.authentication.SessionAuthentication',
     ],
     'DEFAULT_PERMISSION_CLASSES': [
@@ -180,6 +180,172 @@ REST_FRAMEWORK = {
     ],
 }
 
+# Token authentication cache (accounts.authentication.CachedTokenAuthentication)
+# Keeps token -> user snapshots (without the password hash) in a small
+# in-process LRU whose entries are trusted for LOCAL_TTL seconds only, so a
+# logged-out or deactivated user is rejected by every worker within that
+# time. With USE_DJANGO_CACHE the snapshots, and their invalidations, are
+# also shared through CACHES[CACHE_ALIAS]; enable it only once CACHES points
+# at a backend every worker shares, e.g.
+#     CACHES = {'default': {'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+#                           'LOCATION': 'redis://127.0.0.1:6379'}}
+TOKEN_AUTH_CACHE = {
+    'MAX_ENTRIES': 1024,
+    'TTL': 300,  # seconds
+    'LOCAL_TTL': 5,  # seconds
+    'USE_DJANGO_CACHE': False,
+    'CACHE_ALIAS': 'default',
+}
+
+# Face enrollment (accounts.face_enrollment)
+# Worker threads used to extract templates from batch enrollment uploads
+FACE_ENROLLMENT_WORKERS = 4
+# Reject enrollment images whose detected face is smaller than this (pixels)
+FACE_ENROLLMENT_MIN_FACE_SIZE = 80
+# Reject enrollment images whose face region Laplacian variance is below this
+FACE_ENROLLMENT_MIN_SHARPNESS = 30.0
+
+# Store face images under content-hash names so identical uploads share one
+# file; run `manage.py gc_face_media` periodically to sweep unreferenced files
+FACE_IMAGE_DEDUPLICATE = True
+
+# Face image ingestion (accounts.image_ingest)
+# Uploaded reference images are EXIF-rotated, downsized so the longest side is
+# at most FACE_IMAGE_MAX_SIDE pixels and re-encoded without metadata.
+FACE_IMAGE_MAX_SIDE = 800
+FACE_IMAGE_FORMAT = 'JPEG'  # or 'WEBP'
+FACE_IMAGE_QUALITY = 90
+# Every face upload, check-in frames included, is refused before decoding when
+# the file or the pixel count in its header is over these limits.
+FACE_IMAGE_MAX_UPLOAD_SIZE = 5 * 1024 * 1024  # bytes
+FACE_IMAGE_MAX_PIXELS = 24_000_000
+# Archive untouched uploads outside MEDIA_ROOT (not served, not garbage collected)
+FACE_IMAGE_KEEP_ORIGINALS = False
+FACE_ORIGINALS_ROOT = os.path.join(BASE_DIR, 'face_originals')
+
+# Face image thumbnails (accounts.face_variants), served from
+# api/auth/face/variants/<size>/<name> with long-lived cache headers
+FACE_IMAGE_VARIANT_SIZES = (96, 256)
+FACE_IMAGE_VARIANT_QUALITY = 85
+# Generate thumbnails right after upload instead of on first access
+FACE_IMAGE_VARIANTS_ON_UPLOAD = True
+
+# Worker threads running face verification for the async check-in endpoint
+# (api/auth/face/check-in/async/, served under auth_project.asgi)
+FACE_VERIFICATION_WORKERS = 4
+# Deferred check-ins (face/check-in/ with deferred=true) are verified by the
+# same number of background threads; beyond FACE_VERIFICATION_QUEUE_SIZE
+# waiting jobs new deferred check-ins get 503
+FACE_VERIFICATION_QUEUE_SIZE = 100
+# Longest ?wait= honoured by face/check-in/jobs/<id>/ (seconds)
+FACE_VERIFICATION_MAX_WAIT = 25
+# Unfinished (pending or running) jobs older than this are expired and their
+# pending check-in deleted (seconds). Jobs of a process that restarted on this
+# host are expired as soon as the job queue starts again or they are polled.
+FACE_VERIFICATION_JOB_TIMEOUT = 300
+
+# Face pipeline logging (accounts.face_logging): every verification emits one
+# INFO summary event; per-stage DEBUG details are traced for 1 in
+# FACE_LOG_SAMPLE_RATE verifications (1 = all, 0 = none). FACE_LOG_SAMPLE_RATES
+# overrides the rate per stage: detection, embedding, scores, result, verification.
+FACE_LOG_SAMPLE_RATE = 100
+FACE_LOG_SAMPLE_RATES = {}
+
+# Face verification audit table (accounts.face_audit): attempts are buffered in
+# memory and written with bulk_create every FACE_AUDIT_BATCH_SIZE events or
+# FACE_AUDIT_FLUSH_INTERVAL seconds, whichever comes first
+FACE_AUDIT_ENABLED = True
+FACE_AUDIT_BATCH_SIZE = 50
+FACE_AUDIT_FLUSH_INTERVAL = 5.0
+
+# Native thread pools used by the face pipeline (accounts.face_runtime). Each
+# library defaults to one thread per core in every worker process; set
+# FACE_NUM_THREADS to roughly cores / (processes * FACE_VERIFICATION_WORKERS)
+# to avoid oversubscription. The per-library settings override it; None keeps
+# the library default.
+FACE_NUM_THREADS = None
+FACE_OPENCV_THREADS = None
+FACE_TORCH_THREADS = None
+FACE_TORCH_INTEROP_THREADS = None
+FACE_TF_INTRA_OP_THREADS = None
+FACE_TF_INTER_OP_THREADS = None
+
+# FaceNet embedding backend (accounts.face_embedders): 'torch' runs the eager
+# PyTorch model; 'onnx' and 'torchscript' load the models written by
+# `manage.py export_facenet` into FACENET_MODEL_DIR (the int8 ONNX model when
+# FACENET_ONNX_QUANTIZED). FACE_ONNX_THREADS sizes ONNX Runtime's pool.
+FACENET_BACKEND = 'torch'
+FACENET_MODEL_DIR = os.path.join(BASE_DIR, 'models', 'facenet')
+FACENET_ONNX_QUANTIZED = True
+FACE_ONNX_THREADS = None
+
+# Precision of the FaceNet embedding inside stored face templates
+# (accounts.face_templates): 'float16' (default), 'int8' (with per-vector scale)
+# or 'float32'. Older npz templates remain readable.
+FACE_TEMPLATE_EMBEDDING_DTYPE = 'float16'
+
+# Shared embedding gallery (accounts.face_gallery): one memory-mapped file with
+# every enrolled FaceNet embedding, mapped read-only by all worker processes.
+# When enrollments change, the changed users' rows are replaced in the
+# background (atomically, reading only their templates); `manage.py
+# build_face_gallery` rebuilds it from every template.
+FACE_GALLERY_ENABLED = True
+FACE_GALLERY_PATH = os.path.join(BASE_DIR, 'face_gallery', 'gallery.bin')
+FACE_GALLERY_DTYPE = 'float16'  # or 'float32'
+FACE_GALLERY_REBUILD_DELAY = 2.0
+
+# Probe quality gate (accounts.face_quality): a fast check on a downscaled
+# frame that rejects dark, overexposed, blurry, faceless or distant photos
+# with an actionable reason before detection and embedding run.
+FACE_QUALITY_ENABLED = True
+FACE_QUALITY_MAX_SIDE = 320
+FACE_QUALITY_MIN_BRIGHTNESS = 40
+FACE_QUALITY_MAX_BRIGHTNESS = 220
+FACE_QUALITY_MIN_SHARPNESS = 20.0  # Laplacian variance of the face at FACE_QUALITY_MAX_SIDE
+FACE_QUALITY_MIN_FACE_RATIO = 0.12  # face width / frame width
+# Check-ins may send a burst of up to 5 frames (repeated face_images fields);
+# all of them are quality-checked, only this many of the best go through
+# detection, embedding and comparison.
+FACE_BURST_ENCODE_FRAMES = 2
+
+# preprocess_image variant: 'legacy' (YUV/LAB CLAHE with a full bilateral
+# filter) or 'fast' (luminance-only CLAHE and guided filter). Switch to 'fast'
+# only after `manage.py benchmark_preprocessing` shows it is at least as
+# accurate on the enrolled photos; the switch makes every template stale.
+FACE_PREPROCESSING = 'legacy'
+
+# Haar fallback detection (accounts.face_detection) scans one image pyramid
+# of the frame downscaled to FACE_HAAR_MAX_SIDE, shared by all cascades.
+FACE_HAAR_MAX_SIDE = 640
+FACE_HAAR_SCALE_STEP = 1.1
+
+# Face alignment: warp detected faces so the eyes are level at fixed
+# positions (RetinaFace landmarks, Haar eye detections as fallback) before
+# SIFT/SSIM/FaceNet. Templates stored before enabling it should be
+# re-extracted. With aligned faces only the FACE_VERIFY_MAX_REFERENCES
+# enrolled angles closest to the probe (per the gallery) are compared.
+FACE_ALIGNMENT_ENABLED = True
+FACE_VERIFY_MAX_REFERENCES = 3
+
+# Templates are tagged with the pipeline version that produced them
+# (accounts.face_templates.pipeline_version). Stale templates are ignored at
+# check-in: users with none current get at most FACE_STALE_REFERENCE_LIMIT
+# photos encoded on the fly (none when the profile image has a current
+# template), and stale rows are re-extracted in the background on the
+# enrollment workers. `manage.py reembed_faces` refreshes everyone ahead of
+# their next check-in.
+FACE_STALE_REFERENCE_LIMIT = 1
+
+# get_face_encoding results cached by image content hash and pipeline version
+# (accounts.face_encoding_cache): an LRU of FACE_ENCODING_CACHE_SIZE entries
+# in process memory and, when FACE_ENCODING_CACHE_DIR is set, template files
+# shared by all processes. Directories of old pipeline versions can be deleted.
+FACE_ENCODING_CACHE_ENABLED = True
+FACE_ENCODING_CACHE_SIZE = 256
+FACE_ENCODING_CACHE_TTL = 3600
+FACE_ENCODING_CACHE_DIR = None  # e.g. os.path.join(BASE_DIR, 'face_encoding_cache')
+FACE_ENCODING_CACHE_DISK_TTL = 7 * 24 * 3600
+
 # CORS settings
 CORS_ALLOW_ALL_ORIGINS = True  # Set to False in production
 # CORS_ALLOWED_ORIGINS = [